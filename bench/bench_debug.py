@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Compare the cost of debugging calls that send nothing with a bare function call
+
+Runs the calls in a fresh interpreter for each case, so the
+OBSTAC_NODEBUG switch (which takes effect on import) can be tried.
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/bench_debug.py
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import sys
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.join(BENCH_DIR, '..', 'python')
+
+NUMBER = 1000000
+
+SETUP = """
+import logging
+from obstac.debug import debug, set_debug, set_debug_out
+def bare(text, *args):
+    pass
+queue = range(100)
+"""
+
+# (label, environment, setup, statement)
+CASES = (
+    ('bare function call', {}, "", "bare('Queue has %d exposures', len(queue))"),
+    ('set_debug(False), formatted first', {}, "set_debug(False)",
+     "debug('Queue has %d exposures' % len(queue))"),
+    ('set_debug(False), lazy', {}, "set_debug(False)",
+     "debug('Queue has %d exposures', len(queue))"),
+    ('logger above DEBUG, lazy', {}, "logging.getLogger('obstac').setLevel(logging.INFO)",
+     "debug('Queue has %d exposures', len(queue))"),
+    ('OBSTAC_NODEBUG, lazy', {'OBSTAC_NODEBUG': '1'}, "",
+     "debug('Queue has %d exposures', len(queue))"),
+    ('enabled, lazy (sent to a no-op)', {}, "set_debug_out(bare)",
+     "debug('Queue has %d exposures', len(queue))"),
+)
+
+def time_case(environment, setup, statement):
+    env = dict(os.environ)
+    env.pop('OBSTAC_NODEBUG', None)
+    env.update(environment)
+    env['PYTHONPATH'] = PYTHON_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    command = [sys.executable, '-m', 'timeit', '-n', str(NUMBER), '-r', '5',
+               '-s', SETUP + setup, statement]
+    output = subprocess.check_output(command, env=env)
+    return output.strip().split('\n')[-1]
+
+if __name__ == '__main__':
+    for label, environment, setup, statement in CASES:
+        print("%-36s %s" % (label, time_case(environment, setup, statement)))
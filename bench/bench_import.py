@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Time how long a freshly started scheduler takes to import obstac
+
+Each import is timed in fresh interpreters, less the time the
+interpreter takes to start and exit, and checked against a budget.
+The exit status is 1 if any import goes over its budget, so this can
+be run as a check. It also reports whether numpy was imported, since
+that is most of the cost when it is.
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/bench_import.py
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import sys
+import time
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.join(BENCH_DIR, '..', 'python')
+
+NUM_RUNS = 15
+
+# (import statement, budget in milliseconds beyond interpreter startup)
+IMPORTS = (
+    ('import obstac', 10),
+    ('from obstac.Scheduler import Scheduler', 50),
+    ('import obstac.ExampleScheduler', 60),
+)
+
+REPORT = "; import sys; sys.stdout.write(str('numpy' in sys.modules))"
+
+def median_run_time(statement):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = PYTHON_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    times = []
+    for run in range(NUM_RUNS):
+        start = time.time()
+        output = subprocess.check_output([sys.executable, '-c', statement + REPORT], env=env)
+        times.append(time.time() - start)
+    times.sort()
+    return times[len(times)//2], output.strip() == 'True'
+
+if __name__ == '__main__':
+    startup, _ = median_run_time('pass')
+    print("interpreter startup: %.1f ms" % (1000*startup))
+    print("%-42s %10s %10s %8s" % ('', 'time (ms)', 'budget', 'numpy'))
+    over_budget = False
+    for statement, budget in IMPORTS:
+        run_time, numpy_imported = median_run_time(statement)
+        import_time = 1000*(run_time - startup)
+        over_budget = over_budget or import_time > budget
+        print("%-42s %10.1f %10d %8s" % (statement, import_time, budget,
+                                         'yes' if numpy_imported else 'no'))
+    sys.exit(1 if over_budget else 0)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Measure how long autoobs takes to notice a script from a scheduler
+
+A fake scheduler process waits for a trigger, then (after a random
+delay, as if it were choosing exposures) writes a script to a
+temporary file and renames it into the inbox. We record the time
+between the rename and autoobs noticing the script, both with the
+original one-second polling loop and with `InboxWatcher`.
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/bench_inbox_latency.py
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from multiprocessing import Process, Pipe
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'python'))
+from obstac.InboxWatcher import InboxWatcher
+
+WAIT_TIMEOUT = 25
+NUM_TRIGGERS = 20
+
+def fake_scheduler(inbox_fname, conn):
+    while conn.recv():
+        time.sleep(random.uniform(0.0, 0.5))
+        fd, tmp_fname = tempfile.mkstemp(dir=os.path.dirname(inbox_fname))
+        with os.fdopen(fd, 'w') as fp:
+            fp.write('[]')
+        os.rename(tmp_fname, inbox_fname)
+        conn.send(time.time())
+
+def poll_inbox(inbox_fname, start_time):
+    # The loop used by AutoObs.update_queue before InboxWatcher
+    while not os.path.exists(inbox_fname):
+        if (time.time() - start_time) > WAIT_TIMEOUT:
+            break
+        time.sleep(1)
+    if os.path.exists(inbox_fname):
+        while start_time > os.path.getmtime(inbox_fname):
+            if (time.time() - start_time) > WAIT_TIMEOUT:
+                break
+            time.sleep(1)
+
+def bench(wait, inbox_fname, conn):
+    latencies = []
+    for trigger in range(NUM_TRIGGERS):
+        if os.path.exists(inbox_fname):
+            os.remove(inbox_fname)
+        start_time = time.time()
+        conn.send(True)
+        wait(start_time)
+        found_time = time.time()
+        latencies.append(found_time - conn.recv())
+    latencies.sort()
+    return latencies
+
+if __name__ == '__main__':
+    inbox_dir = tempfile.mkdtemp()
+    inbox_fname = os.path.join(inbox_dir, 'queue.json')
+    conn, scheduler_conn = Pipe()
+    scheduler = Process(target=fake_scheduler, args=(inbox_fname, scheduler_conn))
+    scheduler.start()
+
+    watcher = InboxWatcher(inbox_fname)
+    methods = [('sleep(1) polling', lambda start_time: poll_inbox(inbox_fname, start_time)),
+               ('InboxWatcher (%s)' % watcher.mode,
+                lambda start_time: watcher.wait(start_time, WAIT_TIMEOUT))]
+
+    try:
+        print("%-28s %12s %12s %12s" % ('method', 'median (s)', 'max (s)', 'total (s)'))
+        for name, wait in methods:
+            latencies = bench(wait, inbox_fname, conn)
+            print("%-28s %12.4f %12.4f %12.3f" % (name, latencies[len(latencies)//2],
+                                                  latencies[-1], sum(latencies)))
+    finally:
+        conn.send(False)
+        scheduler.join()
+        watcher.close()
+        shutil.rmtree(inbox_dir)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Run update cycles through an outage of the (pretend) SVE and PML servers
+
+Each cycle reads EXPOSUREQUEUE and INPROGRESS through the connection
+manager, as autoobs does, and asks OCS to load a script. The servers
+go down for a while partway through; this reports how long cycles
+took during the outage, how many times the manager tried to
+reconnect, how soon after the servers came back cycles succeeded, and
+how many SVE clients were left open.
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/bench_reconnect.py
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import sys
+import time
+import logging
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, 'fakesispi'))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'python'))
+from fakesispi import set_server_available
+from sve.pythonclient import SVE, SVEError, SharedVariable, set_value, set_read_delay, open_clients
+from PML.core import PML_Connection
+from obstac.SnapshotFetcher import SnapshotFetcher, FetchTimeout
+from obstac.ConnectionManager import ConnectionManager, ConnectionUnavailable
+
+CYCLE_INTERVAL = 0.05
+OUTAGE_START = 1.0
+OUTAGE_END = 4.0
+RUN_TIME = 6.0
+
+def cycle(connections, fetcher, ocs):
+    """Do one update, returning True if it succeeded"""
+    fetched = fetcher.fetch()
+    succeeded = True
+    for name, result in fetched.items():
+        if result.error is not None:
+            succeeded = False
+            if not isinstance(result.error, (FetchTimeout, ConnectionUnavailable)):
+                connections.mark_failed('SVE', result.error)
+    try:
+        ocs('loadq', '/tmp/queue.json')
+    except ConnectionUnavailable:
+        succeeded = False
+    except Exception as e:
+        succeeded = False
+        connections.mark_failed('OCS', e)
+    return succeeded
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    set_value('OCS', 'EXPOSUREQUEUE', [{'expType': 'object', 'exptime': 90}]*100)
+    set_value('OCS', 'INPROGRESS', [])
+    set_read_delay('OCS', 'EXPOSUREQUEUE', 0.005)
+
+    attempts = []
+    def counted(connect):
+        def connect_and_count(*handles):
+            attempts.append(time.time())
+            return connect(*handles)
+        return connect_and_count
+
+    connections = ConnectionManager(initial_delay=0.05, max_delay=1.0)
+    ocs = connections.add('OCS', counted(lambda: PML_Connection('OCS', 'OCS')))
+    connections.add('SVE', counted(SVE))
+    fetcher = SnapshotFetcher(
+        {'EXPOSUREQUEUE': connections.add('EXPOSUREQUEUE', counted(
+            lambda sve: SharedVariable('OCS', 'EXPOSUREQUEUE', sve)), depends_on=('SVE',)),
+         'INPROGRESS': connections.add('INPROGRESS', counted(
+            lambda sve: SharedVariable('OCS', 'INPROGRESS', sve)), depends_on=('SVE',))},
+        default_timeout=1.0, retry_errors=(SVEError,))
+    connections.start()
+    for name in ('OCS', 'SVE', 'EXPOSUREQUEUE', 'INPROGRESS'):
+        connections.get(name, timeout=5)
+
+    start = time.time()
+    server_up = True
+    outage_cycles = []
+    recovered = None
+    while time.time() - start < RUN_TIME:
+        now = time.time() - start
+        if server_up and OUTAGE_START <= now < OUTAGE_END:
+            set_server_available(False)
+            server_up = False
+            outage_attempts = len(attempts)
+        elif not server_up and now >= OUTAGE_END:
+            set_server_available(True)
+            server_up = True
+            outage_attempts = len(attempts) - outage_attempts
+
+        cycle_start = time.time()
+        succeeded = cycle(connections, fetcher, ocs)
+        cycle_time = time.time() - cycle_start
+        if not server_up:
+            outage_cycles.append(cycle_time)
+        elif now >= OUTAGE_END and succeeded and recovered is None:
+            recovered = now - OUTAGE_END
+        time.sleep(CYCLE_INTERVAL)
+    connections.stop()
+
+    print("Outage of %.1f s, cycles every %.0f ms" % (OUTAGE_END - OUTAGE_START,
+                                                     1000*CYCLE_INTERVAL))
+    print("cycles during outage:            %d" % len(outage_cycles))
+    print("longest cycle during outage:     %.1f ms" % (1000*max(outage_cycles)))
+    print("reconnect attempts during outage: %d (4 connections)" % outage_attempts)
+    print("first good cycle after outage:   %s" %
+          ('never' if recovered is None else '%.0f ms' % (1000*recovered)))
+    print("SVE clients left open:           %d" % open_clients())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""Compare autoobs/scheduler round trips over the FIFO and over the socket channel
+
+Each round trip takes a queue snapshot from a stand-in for the OCS
+shared variables, hands it to a scheduler running in another process,
+and gets back a script, the way `AutoObs.update_queue` does: either
+by writing the queue files and a marker in the named pipe and waiting
+for the inbox, or by sending it over the socket channel.
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/bench_round_trip.py
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import datetime
+import tempfile
+from multiprocessing import Process
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'python'))
+from obstac.Scheduler import Scheduler
+from obstac.Serializer import Serializer
+from obstac.Publisher import Publisher, Publication
+from obstac.InboxWatcher import InboxWatcher
+from obstac.SocketChannel import ChannelServer
+
+NUM_TRIPS = 50
+QUEUE_LENGTH = 100
+WAIT_TIMEOUT = 25
+SERIALIZER = Serializer()
+PUBLISHER = Publisher()
+
+CONFIG_TEMPLATE = """
+[observatory]
+longitude = -70.815
+latitude = -30.16527778
+
+[paths]
+outbox = %(dir)s/inbox/queue.json
+current_queue = %(dir)s/queue/current.json
+previous_queue = %(dir)s/queue/previous.json
+inprogress = %(dir)s/queue/inprogress.json
+fifo = %(dir)s/obstac_fifo.txt
+%(socket)s
+
+[timeouts]
+fifo = 300
+"""
+
+class FakeSharedVariable(object):
+    """Stand in for an OCS shared variable"""
+    def __init__(self, value):
+        self.value = value
+
+    def read(self):
+        return self.value
+
+class BenchScheduler(Scheduler):
+    def make_script(self):
+        queue = self.queue
+        if queue is None:
+            with open(self.queue_fname, 'r') as fp:
+                queue = json.load(fp)
+            with open(self.in_progress_fname, 'r') as fp:
+                json.load(fp)
+        return [{'expType': 'object', 'object': 'after_%d' % len(queue),
+                 'exptime': 90, 'filter': 'z', 'count': 1}]
+
+def run_scheduler(config_fname):
+    logging.getLogger().setLevel(logging.WARNING)
+    BenchScheduler(config_fname)()
+
+def fifo_round_trip(base_dir, fifo, watcher, queue_sv, inprogress_sv):
+    start_time = time.time()
+    queue_dir = os.path.join(base_dir, 'queue')
+    PUBLISHER.publish_generation([
+        Publication(os.path.join(queue_dir, 'current.json'),
+                    SERIALIZER.dumps(queue_sv.read()),
+                    os.path.join(queue_dir, 'previous.json')),
+        Publication(os.path.join(queue_dir, 'inprogress.json'),
+                    SERIALIZER.dumps(inprogress_sv.read()), None)])
+    time_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    os.write(fifo, time_str + "\n")
+    if not watcher.wait(start_time, WAIT_TIMEOUT):
+        raise RuntimeError("Scheduler timed out")
+    loaded_fname = os.path.join(base_dir, 'loaded.json')
+    os.rename(watcher.fname, loaded_fname)
+    with open(loaded_fname, 'r') as fp:
+        return json.load(fp)
+
+def socket_round_trip(channel, queue_sv, inprogress_sv):
+    time_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return channel.request_script(time_str, queue_sv.read(), [], inprogress_sv.read(),
+                                  WAIT_TIMEOUT)
+
+def bench(round_trip):
+    latencies = []
+    for trip in range(NUM_TRIPS):
+        start = time.time()
+        script = round_trip()
+        latencies.append(time.time() - start)
+        assert script[0]['object'] == 'after_%d' % QUEUE_LENGTH
+    latencies.sort()
+    return latencies
+
+if __name__ == '__main__':
+    base_dir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(base_dir, 'inbox'))
+    os.mkdir(os.path.join(base_dir, 'queue'))
+    fifo_fname = os.path.join(base_dir, 'obstac_fifo.txt')
+    socket_fname = os.path.join(base_dir, 'obstac.sock')
+    os.mkfifo(fifo_fname)
+
+    exposure = {'expType': 'object', 'object': 'queued', 'seqid': '', 'exptime': 90,
+                'wait': 'False', 'count': 1, 'filter': 'i', 'program': 'bench',
+                'RA': 120.0, 'dec': -30.0}
+    queue_sv = FakeSharedVariable([exposure]*QUEUE_LENGTH)
+    inprogress_sv = FakeSharedVariable([exposure])
+
+    results = []
+    for mode in ('fifo', 'socket'):
+        config_fname = os.path.join(base_dir, '%s.conf' % mode)
+        with open(config_fname, 'w') as fp:
+            fp.write(CONFIG_TEMPLATE % {
+                'dir': base_dir,
+                'socket': 'socket = %s' % socket_fname if mode == 'socket' else ''})
+
+        if mode == 'fifo':
+            fifo = os.open(fifo_fname, os.O_RDWR | os.O_NONBLOCK)
+            watcher = InboxWatcher(os.path.join(base_dir, 'inbox', 'queue.json'))
+            round_trip = lambda: fifo_round_trip(base_dir, fifo, watcher,
+                                                 queue_sv, inprogress_sv)
+        else:
+            channel = ChannelServer(socket_fname)
+            round_trip = lambda: socket_round_trip(channel, queue_sv, inprogress_sv)
+
+        scheduler = Process(target=run_scheduler, args=(config_fname,))
+        scheduler.start()
+        try:
+            if mode == 'socket':
+                while not channel.accept():
+                    time.sleep(0.01)
+            results.append((mode, bench(round_trip)))
+        finally:
+            scheduler.terminate()
+            scheduler.join()
+
+    channel.close()
+    watcher.close()
+    os.close(fifo)
+    shutil.rmtree(base_dir)
+
+    print("%-8s %12s %12s %12s" % ('mode', 'median (ms)', 'p90 (ms)', 'max (ms)'))
+    for mode, latencies in results:
+        print("%-8s %12.3f %12.3f %12.3f" % (mode, 1000*latencies[len(latencies)//2],
+                                             1000*latencies[int(0.9*len(latencies))],
+                                             1000*latencies[-1]))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Compare the JSON encoding and decoding of queues in each serializer mode
+
+`indent=4` is how queue and script files were written before the
+serializer was introduced.
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/bench_serializer.py
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import sys
+import json
+import timeit
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'python'))
+from obstac.Serializer import Serializer, FAST_ENCODER_AVAILABLE
+
+class IndentSerializer(object):
+    """The old way of writing queue files"""
+    mode = 'indent=4'
+
+    def dumps(self, obj):
+        return json.dumps(obj, indent=4)
+
+    def loads(self, text):
+        return json.loads(text)
+
+def make_queue(num_exposures, rng):
+    return [{'expType': 'object', 'object': 'DES survey hex %d' % i,
+             'seqid': 'Sequence of %d' % num_exposures, 'exptime': 90,
+             'wait': 'False', 'count': 1, 'filter': rng.choice(['g', 'r', 'i', 'z', 'Y']),
+             'program': 'survey', 'RA': rng.uniform(0, 360), 'dec': rng.uniform(-70, 5)}
+            for i in range(num_exposures)]
+
+def best_time(function, num_exposures):
+    repeats = max(3, 10000 // num_exposures)
+    return min(timeit.repeat(function, number=repeats, repeat=5))/repeats
+
+def bench(serializer, queue):
+    text = serializer.dumps(queue)
+    assert serializer.loads(text) == queue
+    encode_time = best_time(lambda: serializer.dumps(queue), len(queue))
+    decode_time = best_time(lambda: serializer.loads(text), len(queue))
+    return encode_time, decode_time, len(text)
+
+if __name__ == '__main__':
+    rng = numpy.random.RandomState(6563)
+    serializers = [IndentSerializer(), Serializer('pretty'), Serializer('compact')]
+    if FAST_ENCODER_AVAILABLE:
+        serializers.append(Serializer('fast'))
+    else:
+        print("ujson is not available (or not exact); skipping fast mode")
+
+    print("%10s %10s %12s %12s %10s" % ('exposures', 'mode', 'encode (ms)',
+                                        'decode (ms)', 'bytes'))
+    for num_exposures in (10, 100, 1000):
+        queue = make_queue(num_exposures, rng)
+        for serializer in serializers:
+            encode_time, decode_time, size = bench(serializer, queue)
+            print("%10d %10s %12.3f %12.3f %10d" % (num_exposures, serializer.mode,
+                                                    1000*encode_time, 1000*decode_time,
+                                                    size))
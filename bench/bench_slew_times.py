@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Compare Instrument.slew_time and obs_duration with their batch versions
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/bench_slew_times.py
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'python'))
+from obstac.Instrument import Instrument
+
+def bench(num_fields, rng):
+    ra = rng.uniform(0, 360, num_fields)
+    dec = numpy.degrees(numpy.arcsin(rng.uniform(-1, 0.3, num_fields)))
+    exptime = rng.choice([30, 90, 300], num_fields)
+
+    instrument = Instrument((120.0, -30.0))
+
+    start = time.time()
+    scalar = [instrument.obs_duration(r, d, e) for r, d, e in zip(ra, dec, exptime)]
+    scalar_time = time.time() - start
+
+    start = time.time()
+    batch = instrument.obs_durations(ra, dec, exptime)
+    batch_time = time.time() - start
+
+    assert numpy.array_equal(numpy.array(scalar), batch)
+    return scalar_time, batch_time
+
+if __name__ == '__main__':
+    rng = numpy.random.RandomState(6563)
+    print("%10s %12s %12s %10s" % ('fields', 'scalar (s)', 'batch (s)', 'speedup'))
+    for num_fields in (10**3, 10**4, 10**5, 10**6):
+        scalar_time, batch_time = bench(num_fields, rng)
+        print("%10d %12.4f %12.4f %10.1f" % (num_fields, scalar_time, batch_time,
+                                             scalar_time/batch_time))
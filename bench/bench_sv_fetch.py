@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Compare reading EXPOSUREQUEUE and INPROGRESS one after the other and at once
+
+Uses the stand-in shared variables in bench/fakesispi, with reads made
+slow to stand in for a loaded SVE server.
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/bench_sv_fetch.py
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, 'fakesispi'))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'python'))
+from sve.pythonclient import SVE, SVEError, SharedVariable, \
+    set_value, set_read_delay, break_subscription
+from obstac.SnapshotFetcher import SnapshotFetcher
+
+NUM_CYCLES = 30
+QUEUE_DELAY = 0.040
+INPROGRESS_DELAY = 0.025
+STUCK_DELAY = 2.0
+TIMEOUT = 0.2
+
+def read_sequentially(ocs_queue_sv, inprogress_sv):
+    """Read the shared variables the way autoobs used to"""
+    values = []
+    for shared_variable in (ocs_queue_sv, inprogress_sv):
+        try:
+            values.append(shared_variable.read())
+        except SVEError:
+            shared_variable.subscribe()
+            values.append(shared_variable.read())
+    return values
+
+def read_concurrently(fetcher):
+    fetched = fetcher.fetch()
+    return [fetched['EXPOSUREQUEUE'].value, fetched['INPROGRESS'].value]
+
+def bench(read, resubscribe=False):
+    latencies = []
+    for cycle in range(NUM_CYCLES):
+        if resubscribe:
+            break_subscription('OCS', 'EXPOSUREQUEUE')
+            break_subscription('OCS', 'INPROGRESS')
+        start = time.time()
+        queue, in_progress = read()
+        latencies.append(time.time() - start)
+        assert len(queue) == 100 and len(in_progress) == 1
+    latencies.sort()
+    return latencies[len(latencies)//2]
+
+if __name__ == '__main__':
+    exposure = {'expType': 'object', 'object': 'queued', 'exptime': 90, 'count': 1,
+                'filter': 'i', 'program': 'bench', 'RA': 120.0, 'dec': -30.0}
+    set_value('OCS', 'EXPOSUREQUEUE', [exposure]*100)
+    set_value('OCS', 'INPROGRESS', [exposure])
+    set_read_delay('OCS', 'EXPOSUREQUEUE', QUEUE_DELAY)
+    set_read_delay('OCS', 'INPROGRESS', INPROGRESS_DELAY)
+
+    sve = SVE()
+    ocs_queue_sv = SharedVariable('OCS', 'EXPOSUREQUEUE', sve)
+    inprogress_sv = SharedVariable('OCS', 'INPROGRESS', sve)
+    fetcher = SnapshotFetcher({'EXPOSUREQUEUE': ocs_queue_sv, 'INPROGRESS': inprogress_sv},
+                              retry_errors=(SVEError,))
+
+    print("Reads take %.0f ms (EXPOSUREQUEUE) and %.0f ms (INPROGRESS)"
+          % (1000*QUEUE_DELAY, 1000*INPROGRESS_DELAY))
+    print("%-28s %16s %16s" % ('', 'sequential (ms)', 'concurrent (ms)'))
+    for label, resubscribe in (('median snapshot', False),
+                               ('median, resubscribing', True)):
+        sequential = bench(lambda: read_sequentially(ocs_queue_sv, inprogress_sv), resubscribe)
+        concurrent = bench(lambda: read_concurrently(fetcher), resubscribe)
+        print("%-28s %16.1f %16.1f" % (label, 1000*sequential, 1000*concurrent))
+
+    # INPROGRESS hangs: the queue should still arrive in time
+    set_read_delay('OCS', 'INPROGRESS', STUCK_DELAY)
+    fetcher = SnapshotFetcher({'EXPOSUREQUEUE': ocs_queue_sv, 'INPROGRESS': inprogress_sv},
+                              default_timeout=TIMEOUT, retry_errors=(SVEError,))
+    start = time.time()
+    read_sequentially(ocs_queue_sv, inprogress_sv)
+    sequential = time.time() - start
+    start = time.time()
+    fetched = fetcher.fetch()
+    concurrent = time.time() - start
+    assert len(fetched['EXPOSUREQUEUE'].value) == 100
+    assert fetched['INPROGRESS'].error is not None
+    print("%-28s %16.1f %16.1f" % ('INPROGRESS stuck %.0f s' % STUCK_DELAY,
+                                   1000*sequential, 1000*concurrent))
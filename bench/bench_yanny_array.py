@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Compare reading a chain as a list of dictionaries with reading it as a numpy record array
+
+Each way is run in a fresh interpreter, which reads the exposure
+chain of a synthetic par file (see make_par_file.py) and totals the
+exposure time of the primary exposures, and reports its peak memory.
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/bench_yanny_array.py [num_rows]
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import sys
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.join(BENCH_DIR, '..', 'python')
+
+SETUP = """
+import sys, time, resource
+sys.path[:0] = [%r, %r]
+from make_par_file import par_string
+from YannyReader import YannyReader
+reader = YannyReader(string=par_string(%d))
+base_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.time()
+"""
+
+REPORT = """
+print('%.2f %.2f %.1f' % (read_time, time.time() - start - read_time,
+                          (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_memory)/1024.0))
+"""
+
+# (label, code reading the chain, code selecting from it)
+CASES = (
+    ('list of dictionaries',
+     "exposures = reader.read_chain('EXP')",
+     "total = sum(x['expTime'] for x in exposures if x['flavor'] == 'Pri')"),
+    ('record array',
+     "exposures = reader.read_chain_array('EXP')",
+     "total = exposures.expTime[exposures.flavor == reader.enum['FLAVOR'].index('Pri')].sum()"),
+)
+
+def run_case(num_rows, read, select):
+    code = (SETUP % (BENCH_DIR, PYTHON_DIR, num_rows) + read
+            + "\nread_time = time.time() - start\n" + select + REPORT)
+    return [float(x) for x in subprocess.check_output([sys.executable, '-c', code]).split()]
+
+if __name__ == '__main__':
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print("%d rows" % num_rows)
+    print("%-22s %10s %12s %14s" % ('', 'read (s)', 'select (s)', 'memory (MB)'))
+    for label, read, select in CASES:
+        read_time, select_time, memory = run_case(num_rows, read, select)
+        print("%-22s %10.2f %12.3f %14.0f" % (label, read_time, select_time, memory))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""Compare reading every chain of a par file by reparsing the file per chain with one scan
+
+The old way parses the whole file with pyparsing for the header and
+again for each chain; `YannyReader` now scans it once, noting where
+the rows of each chain start, and parses only the rows of the chains
+read.
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/bench_yanny_chains.py [num_rows]
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'python'))
+import YannyReader
+from make_par_file import par_string
+
+def reparse_per_chain(s):
+    grammar = YannyReader.make_grammar(YannyReader.typedef_section(s))
+    header = YannyReader.parse_header(s, grammar.one_enum_def_parser,
+                                      grammar.one_struct_def_parser, grammar.struct_parser)
+    return header, dict((struct_name,
+                         YannyReader.read_chain(s, struct_name, grammar.one_enum_def_parser,
+                                                grammar.one_struct_def_parser,
+                                                grammar.one_header_assignment_parser,
+                                                grammar.struct_parser))
+                        for struct_name in grammar.struct)
+
+def scan_once(s):
+    reader = YannyReader.YannyReader(string=s, grammar_cache=YannyReader.GrammarCache())
+    return reader.header, reader.read_chains()
+
+if __name__ == '__main__':
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    s = par_string(num_rows)
+
+    results = []
+    for label, read in (('reparsing per chain', reparse_per_chain),
+                        ('one scan', scan_once)):
+        start = time.time()
+        results.append(read(s))
+        print("%-22s %8.2f s" % (label, time.time() - start))
+
+    print("same results: %s" % (results[0] == results[1]))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""Compare reading par files that share typedefs with and without the grammar cache
+
+Reads a night's worth of small synthetic par files (see
+make_par_file.py), each with the same typedefs and different rows,
+first making the parsers for every file, then reusing them.
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/bench_yanny_grammar.py
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'python'))
+from YannyReader import YannyReader, GrammarCache, typedef_section, make_grammar
+from make_par_file import par_string
+
+NUM_FILES = 20
+NUM_ROWS = 20
+
+def read_all(par_strings, grammar_cache):
+    start = time.time()
+    for s in par_strings:
+        YannyReader(string=s, grammar_cache=grammar_cache)
+    return (time.time() - start)/len(par_strings)
+
+if __name__ == '__main__':
+    par_strings = [par_string(NUM_ROWS, seed) for seed in range(NUM_FILES)]
+
+    start = time.time()
+    for s in par_strings:
+        make_grammar(typedef_section(s))
+    grammar_time = (time.time() - start)/len(par_strings)
+
+    uncached = read_all(par_strings, GrammarCache(max_size=0))
+    cache = GrammarCache()
+    cached = read_all(par_strings, cache)
+
+    print("%d files of %d rows, with the same typedefs" % (NUM_FILES, NUM_ROWS))
+    print("making the parsers:     %6.1f ms per file" % (1000*grammar_time))
+    print("reading, no cache:      %6.1f ms per file" % (1000*uncached))
+    print("reading, with cache:    %6.1f ms per file (%d hits, %d misses)"
+          % (1000*cached, cache.hits, cache.misses))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Time decoding the rows of a large par file, with and without pyparsing
+
+Writes a synthetic par file with a million exposure rows (see
+make_par_file.py), reads it, and decodes every row of the exposure
+chain with the fast row decoder. pyparsing is far too slow to parse
+them all, so it is timed on a sample of the rows, and the two are
+compared per row.
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/bench_yanny_rows.py [num_rows]
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import sys
+import time
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'python'))
+import YannyReader
+from make_par_file import write_par_file
+
+NUM_SAMPLE_ROWS = 2000
+
+if __name__ == '__main__':
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    fd, par_file_name = tempfile.mkstemp(suffix='.par')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            write_par_file(fp, num_rows)
+        print("%d rows, %.0f MB" % (num_rows, os.path.getsize(par_file_name)/1e6))
+
+        start = time.time()
+        reader = YannyReader.YannyReader(file_name=par_file_name,
+                                         grammar_cache=YannyReader.GrammarCache())
+        scan_time = time.time() - start
+
+        start = time.time()
+        exposures = reader.read_chain('EXP')
+        decode_time = time.time() - start
+    finally:
+        os.remove(par_file_name)
+
+    decoder = reader.row_decoder['EXP']
+    sample = [YannyReader.logical_line(reader.s, row_start)[0]
+              for row_start in reader.row_starts['EXP'][:NUM_SAMPLE_ROWS]]
+    start = time.time()
+    parsed = [YannyReader.parse_row(reader.struct_parser['EXP'], text) for text in sample]
+    pyparsing_time = (time.time() - start)/len(sample)
+    fast_time = decode_time/len(exposures)
+
+    print("%-34s %8.2f s" % ('reading the file and scanning it:', scan_time))
+    print("%-34s %8.2f s (%d left to pyparsing)"
+          % ('decoding %d rows:' % len(exposures), decode_time, decoder.fallbacks))
+    print("%-34s %8.1f us" % ('per row, fast decoder:', 1e6*fast_time))
+    print("%-34s %8.1f us (%d rows, %.0f s for all of them)"
+          % ('per row, pyparsing:', 1e6*pyparsing_time, len(sample), pyparsing_time*len(exposures)))
+    print("speedup: %.0fx, same results for the sample: %s"
+          % (pyparsing_time/fast_time, parsed == exposures[:len(sample)]))
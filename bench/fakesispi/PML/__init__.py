@@ -0,0 +1,4 @@
+"""Stand-in for the SISPI message layer
+
+:Organization: Fermi National Accelerator Laboratory
+"""
@@ -0,0 +1,57 @@
+"""Stand-in for the SISPI message layer
+
+Commands sent through a `PML_Connection` are recorded in `commands`.
+A handler set with `set_handler` is called with the command's
+arguments, and its return value is returned to the sender.
+`set_available(False)` stands in for the server going down: making
+connections and sending commands fail with `PMLError` until it is
+available again.
+
+>>> set_handler('OCS', 'loadq', lambda fname: 'loaded %s' % fname)
+>>> ocs = PML_Connection('OCS', 'OCS')
+>>> ocs('loadq', '/tmp/queue.json')
+'loaded /tmp/queue.json'
+>>> commands[-1]
+('OCS', 'loadq', ('/tmp/queue.json',))
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+commands = []
+_handlers = {}
+_available = [True]
+
+class PMLError(Exception):
+    pass
+
+def set_available(available):
+    """Bring the (pretend) PML server up or down"""
+    _available[0] = available
+
+def _check_available(target):
+    if not _available[0]:
+        raise PMLError("Cannot reach %s" % target)
+
+def set_handler(target, command, handler):
+    """Have commands sent to a target call a function"""
+    _handlers[(target, command)] = handler
+
+def reset():
+    """Forget recorded commands and handlers"""
+    del commands[:]
+    _handlers.clear()
+
+class PML_Connection(object):
+    def __init__(self, target, source, *args, **kwargs):
+        _check_available(target)
+        self.target = target
+        self.source = source
+
+    def __call__(self, command, *args):
+        _check_available(self.target)
+        commands.append((self.target, command, args))
+        handler = _handlers.get((self.target, command))
+        if handler is not None:
+            return handler(*args)
+        return None
@@ -0,0 +1,4 @@
+"""Stand-in for the SISPI application framework
+
+:Organization: Fermi National Accelerator Laboratory
+"""
@@ -0,0 +1,53 @@
+"""Stand-in for the SISPI application framework
+
+An `Application` has a `config` dictionary (the role's parameters from
+the SISPI ``ini`` file), logs through the logging module, and runs its
+`init` and `main` methods in the calling thread when `run` is called.
+`shutdown` makes `wait_for_shutdown` return.
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import logging
+import threading
+
+from sve.pythonclient import SharedVariable
+
+class Application(object):
+    commands = []
+
+    def __init__(self, name=None, config=None):
+        self.name = self.__class__.__name__.upper() if name is None else name
+        self.config = {} if config is None else config
+        self.logger = logging.getLogger(self.name)
+        self.shutdown_event = threading.Event()
+
+    def debug(self, message):
+        self.logger.debug(message)
+
+    def info(self, message):
+        self.logger.info(message)
+
+    def warn(self, message):
+        self.logger.warning(message)
+
+    def error(self, message):
+        self.logger.error(message)
+
+    def shared_variable(self, name, source=None):
+        return SharedVariable(self.name if source is None else source, name)
+
+    def wait_for_shutdown(self):
+        while not self.shutdown_event.is_set():
+            self.shutdown_event.wait(1.0)
+
+    def shutdown(self):
+        self.shutdown_event.set()
+
+    def run(self):
+        self.init()
+        self.main()
+
+    def init(self):
+        pass
@@ -0,0 +1,24 @@
+"""Stand-ins for the SISPI modules autoobs uses, for use off the mountain
+
+Put this directory at the front of ``sys.path`` (or ``PYTHONPATH``) to
+import `sve.pythonclient`, `PML.core` and `SISPIlib.application`
+without SISPI. Shared variables live in this process, and their reads
+can be made slow, or made to fail until they are subscribed again,
+and `set_server_available` takes the pretend SVE and PML servers down
+(and brings them back up).
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+from __future__ import absolute_import
+__docformat__ = "restructuredtext en"
+
+import os
+
+FAKESISPI_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def set_server_available(available):
+    """Bring the pretend SVE and PML servers up or down together"""
+    from sve import pythonclient
+    from PML import core
+    pythonclient.set_available(available)
+    core.set_available(available)
@@ -0,0 +1,4 @@
+"""Stand-in for the SISPI shared variable engine client
+
+:Organization: Fermi National Accelerator Laboratory
+"""
@@ -0,0 +1,139 @@
+"""Stand-in for the SISPI shared variable engine client
+
+Shared variables are kept in this process. `set_value` changes one
+(calling subscribers' callbacks on another thread, as SVE does),
+`set_read_delay` makes reads of it slow, and `break_subscription`
+makes reads fail with `SVEError` until it is subscribed again.
+`set_available(False)` stands in for the SVE server going down:
+everything fails with `SVEError` until it is available again. Shared
+variables read through an `SVE` client that has been closed fail too,
+and `open_clients` counts the clients not yet closed.
+
+>>> queue_sv = SharedVariable('OCS', 'EXPOSUREQUEUE', SVE())
+>>> set_value('OCS', 'EXPOSUREQUEUE', [{'expType': 'dark'}])
+>>> queue_sv.read()
+[{'expType': 'dark'}]
+>>> break_subscription('OCS', 'EXPOSUREQUEUE')
+>>> queue_sv.read()
+Traceback (most recent call last):
+    ...
+SVEError: Not subscribed to OCS.EXPOSUREQUEUE
+>>> queue_sv.subscribe()
+>>> queue_sv.read()
+[{'expType': 'dark'}]
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import copy
+import time
+import threading
+
+class SVEError(Exception):
+    pass
+
+class _Variable(object):
+    def __init__(self):
+        self.value = None
+        self.read_delay = 0.0
+        self.generation = 0
+        self.callbacks = []
+        self.reads = 0
+
+_variables = {}
+_lock = threading.Lock()
+_available = [True]
+
+def set_available(available):
+    """Bring the (pretend) SVE server up or down
+
+    Taking it down drops all subscriptions, as a real server restart does.
+    """
+    _available[0] = available
+    if not available:
+        with _lock:
+            for variable in _variables.values():
+                variable.generation += 1
+                variable.callbacks = []
+
+def _check_available():
+    if not _available[0]:
+        raise SVEError("SVE server not available")
+
+def _variable(source, name):
+    with _lock:
+        return _variables.setdefault((source, name), _Variable())
+
+def set_value(source, name, value):
+    """Change the value of a shared variable, and call its subscribers' callbacks"""
+    variable = _variable(source, name)
+    variable.value = copy.deepcopy(value)
+    for shared_variable, callback in list(variable.callbacks):
+        thread = threading.Thread(target=callback, args=(shared_variable,))
+        thread.daemon = True
+        thread.start()
+
+def set_read_delay(source, name, delay):
+    """Make each read of a shared variable take `delay` seconds"""
+    _variable(source, name).read_delay = delay
+
+def break_subscription(source, name):
+    """Make reads of a shared variable fail until it is subscribed again"""
+    _variable(source, name).generation += 1
+
+def read_count(source, name):
+    """Return the number of times a shared variable has been read"""
+    return _variable(source, name).reads
+
+def reset():
+    """Forget all shared variables and clients"""
+    with _lock:
+        _variables.clear()
+        del _clients[:]
+
+_clients = []
+
+def open_clients():
+    """Return the number of SVE clients made and not closed"""
+    return len([client for client in _clients if not client.closed])
+
+class SVE(object):
+    def __init__(self, *args, **kwargs):
+        self.closed = False
+        _clients.append(self)
+
+    def close(self):
+        self.closed = True
+
+class SharedVariable(object):
+    def __init__(self, source, name, sve=None):
+        _check_available()
+        self.source = source
+        self.name = name
+        self.sve = sve
+        self.variable = _variable(source, name)
+        self.generation = self.variable.generation
+
+    def read(self):
+        self.variable.reads += 1
+        if self.variable.read_delay > 0:
+            time.sleep(self.variable.read_delay)
+        _check_available()
+        if self.sve is not None and self.sve.closed:
+            raise SVEError("SVE client closed")
+        if self.generation != self.variable.generation:
+            raise SVEError("Not subscribed to %s.%s" % (self.source, self.name))
+        return copy.deepcopy(self.variable.value)
+
+    def subscribe(self, callback=None):
+        _check_available()
+        self.generation = self.variable.generation
+        if callback is not None:
+            self.variable.callbacks.append((self, callback))
+
+    def publish(self):
+        pass
+
+    def write(self, value):
+        set_value(self.source, self.name, value)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Write a synthetic Yanny par file, like an SDSS mdReport, for benchmarks
+
+The file has a few header keywords, two enums, an exposure struct
+with numeric, enum, string and array fields, a comment struct, and
+as many exposure rows as asked for (with a comment row every 50).
+
+:Organization: Fermi National Accelerator Laboratory
+
+Run from the top of the product::
+
+    python bench/make_par_file.py 1000000 /tmp/exposures.par
+"""
+__docformat__ = "restructuredtext en"
+
+import sys
+import random
+
+HEADER = """# Synthetic observing log
+mjd 53436
+telescope APO20
+parametersDir /p/parameters # where they live
+version v5_4_1
+
+typedef enum {
+    Pri,
+    Sec,
+    Bias,
+    Flat
+} FLAVOR;
+
+typedef enum {
+    START,
+    END
+} RUNMARK;
+
+typedef struct {
+    int expId;
+    double mjd;
+    FLAVOR flavor;
+    char targetName[40];
+    float expTime;
+    double ra;
+    double dec;
+    short filterPos;
+    long seqNo;
+    RUNMARK mark;
+    float seeing[4];
+    char comment[80];
+} EXP;
+
+typedef struct {
+    double mjd;
+    char text[200];
+} MTCOMMENT;
+
+"""
+
+FLAVORS = ('Pri', 'Sec', 'Bias', 'Flat')
+TARGETS = ('Bias', 'Flat', 'M31', 'NGC_1300', '"Abell 2218"', 'SA_95')
+COMMENTS = ('""', '"nominal"', '"clouds to the west"', '"{braced text}"', 'ok')
+
+def exposure_row(exp_id, rng):
+    return 'EXP %d %.5f %s %s %.1f %.6f %.6f %d %d %s {%.2f %.2f %.2f %.2f} %s\n' % (
+        exp_id, 53435.9 + exp_id*1e-4, rng.choice(FLAVORS), rng.choice(TARGETS),
+        rng.choice((0.0, 30.0, 53.9, 90.0)), rng.uniform(0, 360), rng.uniform(-90, 90),
+        rng.randint(0, 6), exp_id*3, rng.choice(('START', 'END')),
+        rng.uniform(0.8, 2), rng.uniform(0.8, 2), rng.uniform(0.8, 2), rng.uniform(0.8, 2),
+        rng.choice(COMMENTS))
+
+def comment_row(exp_id, rng):
+    return 'MTCOMMENT %.5f "log entry %d: %s"\n' % (
+        53435.9 + exp_id*1e-4, exp_id, rng.choice(('dome open', 'focus', 'wind 20mph')))
+
+def write_par_file(fp, num_rows, seed=6):
+    """Write a par file with `num_rows` exposure rows"""
+    rng = random.Random(seed)
+    fp.write(HEADER)
+    lines = []
+    for exp_id in xrange(num_rows):
+        lines.append(exposure_row(exp_id, rng))
+        if exp_id % 50 == 0:
+            lines.append(comment_row(exp_id, rng))
+        if len(lines) >= 10000:
+            fp.write(''.join(lines))
+            lines = []
+    fp.write(''.join(lines))
+
+def par_string(num_rows, seed=6):
+    """Return the contents of a par file with `num_rows` exposure rows"""
+    from StringIO import StringIO
+    fp = StringIO()
+    write_par_file(fp, num_rows, seed)
+    return fp.getvalue()
+
+if __name__ == '__main__':
+    num_rows = int(sys.argv[1])
+    with open(sys.argv[2], 'w') as fp:
+        write_par_file(fp, num_rows)
@@ -48,20 +48,33 @@ Bias
 """
 __docformat__ = "restructuredtext en"
 
+import re
 import urllib2
+import hashlib
+from array import array
 from string import translate
+from collections import namedtuple, OrderedDict
+
+import numpy
 
 from pyparsing import Forward
 from pyparsing import LineStart, LineEnd
 from pyparsing import Keyword, CaselessKeyword, Literal, Word, QuotedString, quotedString, nestedExpr, White
 from pyparsing import alphas, nums, alphanums, printables, CharsNotIn
 from pyparsing import Optional, And, Or, Combine, NotAny, Regex
-from pyparsing import Group, OneOrMore, ZeroOrMore, oneOf, delimitedList
+from pyparsing import Group, OneOrMore, ZeroOrMore, oneOf, delimitedList, Suppress
 from pyparsing import cStyleComment, restOfLine, lineEnd
 from pyparsing import removeQuotes, stringEnd
 from pyparsing import Dict
+from pyparsing import ParseResults
 
 hash_comment = Literal("#") + restOfLine
+# Parsers ignore comments by keeping a list of expressions to skip,
+# which ignore() adds to (in the parser and everything in it) unless
+# given a Suppress it already has. Always ignore these, so parsers
+# shared between calls do not collect more copies with each one.
+ignored_hash_comment = Suppress(hash_comment)
+ignored_c_comment = Suppress(cStyleComment)
 semicolon = Literal(";").suppress()
 comma = Literal(",").suppress()
 left_brace = Literal("{").suppress()
@@ -75,7 +88,9 @@ struct_declaration_start = Literal('typedef struct')
 # Some old SDSS par files leave spaces between a \ and a newline, even
 # when it is intended to be a line continuation, so we need to deal with it
 linecont = Optional(Regex('\\\ *\n'))
-length_spec = Optional(nestedExpr("[","]") | nestedExpr("<",">")).suppress()
+# The dimensions of array fields, such as the 40 in "char name[40]"
+dimension = (Literal("[").suppress() + Optional(Word(alphanums+'_'), default='') + Literal("]").suppress()) \
+    | (Literal("<").suppress() + Optional(Word(alphanums+'_'), default='') + Literal(">").suppress())
 
 numsign = oneOf('+ -')
 integer = Combine(Optional(numsign) + Word( nums ))
@@ -181,17 +196,42 @@ def parse_enum_defs(s, parsers=None):
     'MAPLE'
     """
     type_parser = {} if parsers is None else parsers
+    for enum_name, values in parse_enum_values(s).items():
+        type_parser[enum_name] = oneOf( values )
+
+    return type_parser
+
+def parse_enum_values(s):
+    """Find the values of all of the enums defined in a string
+
+    :Parameters:
+        - `s`: the string to parse
+
+    @return: a dictionary with the list of values of each enum, in the order defined
+
+    >>> test_string = \"""a foo
+    ... typedef enum {
+    ...         START,
+    ...         END
+    ... } RUNMARK;
+    ...
+    ... typedef struct {
+    ...         float x;
+    ...         RUNMARK m
+    ... } GOO
+    ... \"""
+    >>> parse_enum_values(test_string)
+    {'RUNMARK': ['START', 'END']}
+    """
     one_enum_def_parser = make_one_enum_def_parser()
     not_enum = ( (value_name | struct_declaration_start | possible_type_name | right_brace) + restOfLine).suppress()
     
     enum_def_parser = ZeroOrMore( Group(one_enum_def_parser) | not_enum ) + stringEnd
-    enum_def_parser.ignore(hash_comment)
-    enum_def_parser.ignore(cStyleComment)
+    enum_def_parser.ignore(ignored_hash_comment)
+    enum_def_parser.ignore(ignored_c_comment)
     
-    for enum in enum_def_parser.parseString(s):
-        type_parser[enum['enum_name']] = oneOf( enum['values'].asList() )
-
-    return type_parser
+    return dict((enum['enum_name'], enum['values'].asList())
+                for enum in enum_def_parser.parseString(s))
 
 
 def make_one_struct_def_parser(type_parsers = None):
@@ -221,13 +261,15 @@ def make_one_struct_def_parser(type_parsers = None):
     Field name: humidity        type name: double
     Field name: pressure        type name: double
     Field name: temperature     type name: double
+    >>> print parsed_string['fields'][3]['dimensions'].asList()
+    ['4']
     >>>
     """
     if type_parsers is None:
         type_parsers = base_type_parsers
     type_name = oneOf( type_parsers.keys() )
-    pafn = Combine(field_name + length_spec + length_spec)
-    field_declaration = Group( type_name('type_name') + pafn('field_name') )
+    field_declaration = Group( type_name('type_name') + field_name('field_name') \
+                                   + Group(ZeroOrMore(dimension))('dimensions') )
     field_list = Group( delimitedList(field_declaration, delim=';') )
         
     one_struct_def_parser = struct_declaration_start \
@@ -243,7 +285,7 @@ def parse_struct_defs(s, type_parsers = None):
         - `s`: the string to parse
         - `type_parsers`: a list of type parsers that can be used
 
-    @return: a tuple with two dictionaries, one that describes the structs, the other stores the parsers
+    @return: a tuple with two dictionaries, one that describes the structs (the name, type name, and list of dimensions of each field), the other stores the parsers
 
     >>> test_string = \"""# A sample file
     ... a foo
@@ -303,15 +345,17 @@ def parse_struct_defs(s, type_parsers = None):
     not_struct = ( (value_name | enum_declaration_start | possible_type_name | right_brace) + restOfLine).suppress()
     
     struct_def_parser = ZeroOrMore( Group(one_struct_def_parser) | not_struct) + stringEnd
-    struct_def_parser.ignore(hash_comment)
-    struct_def_parser.ignore(cStyleComment)
+    struct_def_parser.ignore(ignored_hash_comment)
+    struct_def_parser.ignore(ignored_c_comment)
     
     struct = {}
     struct_parser = {}
     for this_struct in struct_def_parser.parseString(s):
         struct_name = this_struct['struct_name'].upper()
         struct[struct_name] = \
-            [{'field_name': f['field_name'], 'type_name': f['type_name']} for f in this_struct['fields']]
+            [{'field_name': f['field_name'], 'type_name': f['type_name'],
+              'dimensions': [int(d) if d.isdigit() else None for d in f['dimensions']]}
+             for f in this_struct['fields']]
         struct_parser[struct_name] = \
             Group(CaselessKeyword(this_struct['struct_name']) \
                       + And( [linecont+type_parsers[f['type_name']](f['field_name']) 
@@ -338,7 +382,7 @@ def make_one_header_assignment_parser(struct_parsers):
     """
     all_struct_parsers = Or([struct_parsers[s] for s in struct_parsers.keys()] )
     one_header_assignment_parser = NotAny(all_struct_parsers) + Group(value_name('name') + restOfLine('value')) 
-    one_header_assignment_parser.ignore(hash_comment)
+    one_header_assignment_parser.ignore(ignored_hash_comment)
     return one_header_assignment_parser
 
 def parse_header(s, enum_def_parser, struct_def_parser, struct_parsers):
@@ -389,8 +433,8 @@ def parse_header(s, enum_def_parser, struct_def_parser, struct_parsers):
                         [struct_parsers[k] for k in struct_parsers.keys()]).suppress()
     
     header_parser = ZeroOrMore(not_header | one_header_assignment_parser) + stringEnd
-    header_parser.ignore(hash_comment)
-    header_parser.ignore(cStyleComment)
+    header_parser.ignore(ignored_hash_comment)
+    header_parser.ignore(ignored_c_comment)
     header = {}
     for d in header_parser.parseString(s):
         header[d['name']] = d['value'].partition('#')[0].lstrip().rstrip()
@@ -459,40 +503,582 @@ def read_chain(s, struct_name, enum_def_parser, struct_def_parser, header_assign
                                 header_assignment_parser,                                        
                                 struct_def_parser] ).suppress()
     this_list_parser = ZeroOrMore(not_this_list_parser | struct_parsers[struct_name] ) + stringEnd
-    this_list_parser.ignore(hash_comment)
-    this_list_parser.ignore(cStyleComment)
+    this_list_parser.ignore(ignored_hash_comment)
+    this_list_parser.ignore(ignored_c_comment)
     raw_results = this_list_parser.parseString(s)
     
     results = []
     for row_result in raw_results:
         dict_result = {}
         for field, value in row_result.items():
-            dict_result[field]=value
+            dict_result[field]=plain_value(value)
         results.append(dict_result)
         
     return results
 
 
+comment_re = re.compile(r'/\*.*?\*/|#[^\n]*', re.S)
+typedef_re = re.compile(r'typedef\s+(?:enum|struct)\s*\{[^}]*\}\s*\w+\s*;?')
+
+def typedef_section(s):
+    """Return the typedefs in a string, without comments, one per line
+
+    This finds the typedefs without parsing the string, so parsers
+    for files with the same typedefs can be reused.
+
+    :Parameters:
+        - `s`: the string with the typedefs
+
+    @return: a string with the typedefs
+
+    >>> test_string = \"""a foo
+    ... typedef struct { # a comment
+    ...         float x; /* another } comment */
+    ...         int y
+    ... } GOO
+    ...
+    ... GOO 3.4 6
+    ... \"""
+    >>> typedef_section(test_string).split()
+    ['typedef', 'struct', '{', 'float', 'x;', 'int', 'y', '}', 'GOO']
+    """
+    return '\n'.join(typedef_re.findall(comment_re.sub('', s)))
+
+# The parsers made from the typedefs of a par file
+YannyGrammar = namedtuple('YannyGrammar', ['one_enum_def_parser', 'enum', 'type_parser',
+                                           'one_struct_def_parser', 'struct', 'struct_parser',
+                                           'one_header_assignment_parser', 'row_decoder'])
+
+def make_grammar(typedefs):
+    """Make the parsers for a par file from its typedefs
+
+    :Parameters:
+        - `typedefs`: the typedefs, as returned by `typedef_section`
+
+    @return: a `YannyGrammar` with the parsers
+    """
+    one_enum_def_parser = make_one_enum_def_parser()
+    enum = parse_enum_values(typedefs)
+    type_parser = parse_enum_defs(typedefs, base_type_parsers)
+    one_struct_def_parser = make_one_struct_def_parser(type_parser)
+    struct, struct_parser = parse_struct_defs(typedefs, type_parser)
+    one_header_assignment_parser = make_one_header_assignment_parser(struct_parser)
+    row_decoder = dict((struct_name, RowDecoder(struct[struct_name], enum, struct_parser[struct_name]))
+                       for struct_name in struct)
+    return YannyGrammar(one_enum_def_parser, enum, type_parser, one_struct_def_parser,
+                        struct, struct_parser, one_header_assignment_parser, row_decoder)
+
+class GrammarCache(object):
+    """Keep the parsers made for recently read typedefs, so files that share them can reuse them
+
+    The parsers are looked up by a hash of the typedefs. When there
+    are more than `max_size` sets of them, the least recently used
+    are dropped.
+
+    >>> cache = GrammarCache(max_size=2)
+    >>> goo = "typedef struct { float x; int y } GOO;"
+    >>> moo = "typedef struct { int i } MOO;"
+    >>> grammar = cache.grammar(goo + "\\nGOO 3.4 6\\n")
+    >>> cache.grammar(goo + "\\nGOO 1.1 7\\n") is grammar
+    True
+    >>> moo_grammar = cache.grammar(moo)
+    >>> foo_grammar = cache.grammar("typedef struct { char s } FOO;")
+    >>> cache.grammar(goo) is grammar
+    False
+    >>> cache.hits, cache.misses
+    (1, 4)
+    """
+
+    def __init__(self, max_size=16):
+        """Create an empty cache
+
+        :Parameters:
+            - `max_size`: the most sets of parsers to keep
+        """
+        self.max_size = max_size
+        self.grammars = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def grammar(self, s):
+        """Return the parsers for the typedefs in a string, making them if needed
+
+        :Parameters:
+            - `s`: the string with the typedefs (usually the whole par file)
+
+        @return: a `YannyGrammar` with the parsers
+        """
+        typedefs = typedef_section(s)
+        key = hashlib.sha1(typedefs).hexdigest()
+        if key in self.grammars:
+            grammar = self.grammars.pop(key)
+            self.hits += 1
+        else:
+            grammar = make_grammar(typedefs)
+            self.misses += 1
+        self.grammars[key] = grammar
+        while len(self.grammars) > self.max_size:
+            self.grammars.popitem(last=False)
+        return grammar
+
+# The pieces of a logical line that need care when finding its end.
+# Quotes and # only start strings and comments at the start of a word.
+line_piece_re = re.compile(r"""
+      (?<![^\s{])"(?:[^"\\]|\\.)*"     # a double quoted string, which may span lines
+    | (?<![^\s{])'(?:[^'\\]|\\.)*'     # a single quoted string, which may span lines
+    | /\*.*?\*/                        # a C comment, which may span lines
+    | (?<![^\s{])\#[^\n]*              # a comment to the end of the line
+    | \\[ \t]*\n                       # a line continuation (sometimes with spaces after the \)
+    | \n                               # the end of the line
+    """, re.S | re.X)
+
+typedef_end_re = re.compile(r'\}\s*\w+[ \t]*;?')
+header_line_re = re.compile(r'\s*([A-Za-z]\w*)(.*)')
+
+def logical_line(s, start):
+    """Return one logical line of a par file, and where the next one starts
+
+    Comments are dropped, and lines continued with a \\\\ (or by a
+    quoted string) are joined.
+
+    :Parameters:
+        - `s`: the contents of the par file
+        - `start`: the index in `s` at which the line starts
+
+    @return: a tuple with the text of the line, and the index in `s` of the next line
+
+    >>> test_string = \"""GOO 3.4 \\\\
+    ...  6 # a comment
+    ... GOO "a # b" /* c */ 7
+    ... \"""
+    >>> logical_line(test_string, 0)
+    ('GOO 3.4   6 ', 25)
+    >>> logical_line(test_string, 25)
+    ('GOO "a # b"   7', 47)
+    """
+    end = s.find('\n', start)
+    if end < 0:
+        end = len(s)
+    line = s[start:end]
+    # Only comments, backslashes, and quoted strings left open can make
+    # the logical line differ from the line as written
+    if not ('#' in line or '\\' in line or '/*' in line
+            or line.count('"') % 2 or line.count("'") % 2):
+        return line, end + 1
+
+    pieces = []
+    pos = start
+    while True:
+        match = line_piece_re.search(s, pos)
+        if match is None:
+            pieces.append(s[pos:])
+            return ''.join(pieces), len(s) + 1
+        pieces.append(s[pos:match.start()])
+        pos = match.end()
+        piece = match.group()
+        if piece == '\n':
+            return ''.join(pieces), pos
+        elif piece[0] in '"\'':
+            pieces.append(piece)
+        elif piece[0] in '/\\':
+            pieces.append(' ')
+
+def scan_par_file(s, struct_names):
+    """Find the header and the rows of every chain in a par file, in one pass
+
+    Each logical line is either a header keyword assignment, part of
+    a typedef, or a row of a struct. Rows are not parsed, just noted
+    by the index at which they start.
+
+    :Parameters:
+        - `s`: the contents of the par file
+        - `struct_names`: the (upper case) names of the structs
+
+    @return: a tuple with a dictionary of the header keyword assignments, and a dictionary with an array of the indexes of the rows of each struct
+
+    >>> test_string = \"""# A sample file
+    ... a foo
+    ... bar baz goo # no more
+    ...
+    ... typedef struct {
+    ...         float x;
+    ...         int y
+    ... } GOO
+    ...
+    ... GOO 3.4 6
+    ... goo 4.22 \\\\
+    ...    103
+    ... \"""
+    >>> header, rows = scan_par_file(test_string, ['GOO'])
+    >>> print sorted(header.items())
+    [('a', 'foo'), ('bar', 'baz goo')]
+    >>> print [test_string[i:i+3] for i in rows['GOO']]
+    ['GOO', 'goo']
+    >>> test_string = \"""a foo
+    ... typedef struct { float x; /* a } comment */ int y } GOO;
+    ... GOO 3.4 6
+    ... \"""
+    >>> header, rows = scan_par_file(test_string, ['GOO'])
+    >>> print sorted(header.items())
+    [('a', 'foo')]
+    >>> print len(rows['GOO'])
+    1
+    """
+    header = {}
+    rows = dict((struct_name, array('l')) for struct_name in struct_names)
+    pos = 0
+    while pos < len(s):
+        text, next_pos = logical_line(s, pos)
+        words = text.split(None, 1)
+        keyword = words[0] if words else ''
+        if keyword.upper() in rows:
+            rows[keyword.upper()].append(pos)
+        elif keyword == 'typedef':
+            # Look for the closing } only outside comments
+            typedef = text
+            while typedef_end_re.search(typedef) is None and next_pos < len(s):
+                text, next_pos = logical_line(s, next_pos)
+                typedef += '\n' + text
+        elif keyword:
+            # Header values are the rest of the line as written, up to any #
+            match = header_line_re.match(s, pos) or header_line_re.match(text)
+            if match is not None:
+                header[match.group(1)] = match.group(2).partition('#')[0].strip()
+        pos = next_pos
+
+    return header, rows
+
+def plain_value(value):
+    """Return a value parsed from a row as a python scalar or list
+
+    >>> plain_value(ParseResults([44]))
+    44
+    >>> plain_value(ParseResults([[1.5, 2.5]]))
+    [1.5, 2.5]
+    >>> plain_value('MAPLE')
+    'MAPLE'
+    """
+    if isinstance(value, ParseResults):
+        value = value.asList()
+        if len(value) == 1:
+            value = value[0]
+    return value
+
+def parse_row(struct_parser, text):
+    """Parse one row of a chain
+
+    :Parameters:
+        - `struct_parser`: the parser for rows of the struct
+        - `text`: the row, as returned by `logical_line`
+
+    @return: a dictionary with the values of the fields of the row
+    """
+    row = struct_parser.parseString(text)[0]
+    return dict((field, plain_value(value)) for field, value in row.items())
+
+# Patterns for the values of fields in the rows the fast decoder handles:
+# numbers, unquoted words, quoted strings without escapes that stay on
+# one line, and lists of numbers or unquoted words in braces
+int_re = r'[+-]?\d+'
+decimal_re = r'[+-]?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?'
+word_re = r'[^\s{}"\'][^\s{}]*'
+char_re = r'"[^"\\\n]*"|\'[^\'\\\n]*\'|' + word_re
+
+def list_re(item_re):
+    return r'\{\s*((?:(?:%s)(?:\s+(?:%s))*)?)\s*\}' % (item_re, item_re)
+
+def unquote(value):
+    return value[1:-1] if value[0] in '"\'' else value
+
+def convert_list(convert, items):
+    # Lists of one value are read as the value, as the parsers do
+    values = [convert(item) for item in items.split()]
+    return values[0] if len(values) == 1 else values
+
+class RowDecoder(object):
+    """Decode rows of a struct without pyparsing, when they are simple enough
+
+    Most rows are just numbers, enum values, words, and quoted
+    strings, with lists of them in braces; these are matched with one
+    regular expression made from the struct definition, and their
+    fields converted directly. Anything else, such as nested braces,
+    strings with escapes or running over several lines, or values the
+    expression does not expect, is left to the pyparsing parser for
+    the struct, which counts in `fallbacks`.
+
+    >>> test_string = \"""typedef enum {
+    ...         OAK,
+    ...         MAPLE
+    ... } TREETYPE;
+    ...
+    ... typedef struct {
+    ...         int i;
+    ...         TREETYPE s;
+    ...         float x[2];
+    ...         char name[20]
+    ... } TREE;
+    ... \"""
+    >>> grammar = make_grammar(test_string)
+    >>> decode = RowDecoder(grammar.struct['TREE'], grammar.enum, grammar.struct_parser['TREE'])
+    >>> print sorted(decode('TREE 42 MAPLE {1.5 2} "big leaf"').items())
+    [('i', 42), ('name', 'big leaf'), ('s', 'MAPLE'), ('x', [1.5, 2.0])]
+    >>> print sorted(decode('tree 3 OAK {4} {"a b" {c}}').items())
+    [('i', 3), ('name', ['"a b"', 'c']), ('s', 'OAK'), ('x', 4.0)]
+    >>> decode.fallbacks
+    1
+    """
+
+    def __init__(self, fields, enums, struct_parser):
+        """Make the decoder for a struct
+
+        :Parameters:
+            - `fields`: the fields of the struct, as returned by `parse_struct_defs`
+            - `enums`: the values of each enum, as returned by `parse_enum_values`
+            - `struct_parser`: the pyparsing parser for rows of the struct
+        """
+        self.struct_parser = struct_parser
+        self.fallbacks = 0
+        self.field_names = [field['field_name'] for field in fields]
+        self.converters = []
+        field_res = []
+        for field in fields:
+            type_name = field['type_name']
+            if type_name in enums:
+                value_re = '|'.join(re.escape(v) for v in enums[type_name])
+                # Enums are never lists, but keep two groups for each field
+                field_res.append(r'\s+(%s)()' % value_re)
+                convert = str
+            else:
+                value_re, item_re, convert = {'int': (int_re, int_re, int),
+                                              'short': (int_re, int_re, int),
+                                              'long': (int_re, int_re, int),
+                                              'float': (decimal_re, decimal_re, float),
+                                              'double': (decimal_re, decimal_re, float),
+                                              'char': (char_re, word_re, unquote)}[type_name]
+                field_res.append(r'\s+(?:(%s)|%s)' % (value_re, list_re(item_re)))
+            self.converters.append(convert)
+        # Rows start with the struct name, which the scan has already checked
+        self.row_re = re.compile(r'\s*\S+' + ''.join(field_res) + r'\s*$')
+
+    def __call__(self, text):
+        """Decode one row
+
+        :Parameters:
+            - `text`: the row, as returned by `logical_line`
+
+        @return: a dictionary with the values of the fields of the row
+        """
+        return dict(zip(self.field_names, self.values(text)))
+
+    def values(self, text):
+        """Decode one row into the values of its fields
+
+        :Parameters:
+            - `text`: the row, as returned by `logical_line`
+
+        @return: a list of the values of the fields, in the order they are defined
+        """
+        match = self.row_re.match(text)
+        if match is None:
+            self.fallbacks += 1
+            row = parse_row(self.struct_parser, text)
+            return [row[field_name] for field_name in self.field_names]
+
+        values = match.groups()
+        return [convert(value) if value is not None else convert_list(convert, items)
+                for convert, value, items in zip(self.converters, values[::2], values[1::2])]
+
+# Rows decoded at a time when reading a chain into an array
+ARRAY_BLOCK_SIZE = 10000
+
+numpy_types = {'double': 'f8', 'float': 'f4', 'int': 'i4', 'short': 'i2', 'long': 'i8'}
+
+def chain_dtype(fields, enums):
+    """Return the numpy dtype for rows of a struct
+
+    Numeric fields with fixed dimensions become sub-arrays, and enums
+    small integers: the index of the value in the enum's list of
+    values. Strings of fixed length become fixed length strings, and
+    anything of unknown size an object.
+
+    :Parameters:
+        - `fields`: the fields of the struct, as returned by `parse_struct_defs`
+        - `enums`: the values of each enum, as returned by `parse_enum_values`
+
+    @return: a numpy dtype
+
+    >>> fields = [{'field_name': 'i', 'type_name': 'int', 'dimensions': []},
+    ...           {'field_name': 'x', 'type_name': 'float', 'dimensions': [2]},
+    ...           {'field_name': 's', 'type_name': 'TREETYPE', 'dimensions': []},
+    ...           {'field_name': 'name', 'type_name': 'char', 'dimensions': [20]},
+    ...           {'field_name': 'tags', 'type_name': 'char', 'dimensions': [3, 8]},
+    ...           {'field_name': 'note', 'type_name': 'char', 'dimensions': []}]
+    >>> chain_dtype(fields, {'TREETYPE': ['OAK', 'MAPLE']})
+    dtype([('i', '<i4'), ('x', '<f4', (2,)), ('s', 'u1'), ('name', 'S20'), ('tags', 'S8', (3,)), ('note', 'O')])
+    """
+    descr = []
+    for field in fields:
+        type_name, dimensions = field['type_name'], field['dimensions']
+        if type_name in enums:
+            descr.append((field['field_name'], numpy.min_scalar_type(len(enums[type_name]) - 1)))
+        elif None in dimensions or (type_name == 'char' and not dimensions):
+            descr.append((field['field_name'], object))
+        elif type_name == 'char':
+            descr.append((field['field_name'], 'S%d' % dimensions[-1], tuple(dimensions[:-1])))
+        else:
+            descr.append((field['field_name'], numpy_types[type_name], tuple(dimensions)))
+    return numpy.dtype(descr)
+
+default_grammar_cache = GrammarCache()
+
 class YannyReader(object):
+    """Read a Yanny par file
 
-    def __init__(self, string=None, file_name=None, url=None):
+    The file is scanned once, when the reader is created, to read the
+    header and find the rows of every chain; rows are only parsed when
+    their chain is read.
+
+    >>> test_string = \"""a foo
+    ... typedef enum {
+    ...         OAK,
+    ...         MAPLE
+    ... } TREETYPE;
+    ...
+    ... typedef struct {
+    ...         float x;
+    ...         int y
+    ... } GOO
+    ...
+    ... typedef struct {
+    ...         int i;
+    ...         TREETYPE s
+    ... } TREE;
+    ...
+    ... GOO 3.4 6
+    ... TREE 42 MAPLE
+    ... TREE 44 OAK # the big one
+    ... GOO 4.22 103
+    ... \"""
+    >>> r = YannyReader(string=test_string)
+    >>> print r.header
+    {'a': 'foo'}
+    >>> print r.read_chain('TREE')[1]['i']
+    44
+    >>> chains = r.read_chains()
+    >>> print [(g['x'], g['y']) for g in chains['GOO']]
+    [(3.4, 6), (4.22, 103)]
+    """
+
+    def __init__(self, string=None, file_name=None, url=None, grammar_cache=None):
         if not string is None:
             self.s = string
         elif not file_name is None:
             self.s = open(file_name,'r').read()
         elif not url is None:
             self.s = urllib2.urlopen(url).read()
-        self.one_enum_def_parser = make_one_enum_def_parser()
-        self.type_parser = parse_enum_defs(self.s, base_type_parsers)
-        self.one_struct_def_parser = make_one_struct_def_parser(self.type_parser)
-        self.struct, self.struct_parser = parse_struct_defs(self.s, self.type_parser)
-        self.one_header_assignment_parser = make_one_header_assignment_parser(self.struct_parser)
-        self.header = parse_header(self.s, self.one_enum_def_parser, self.one_struct_def_parser,
-                                   self.struct_parser)
+
+        # Files with the same typedefs share parsers
+        if grammar_cache is None:
+            grammar_cache = default_grammar_cache
+        grammar = grammar_cache.grammar(self.s)
+        self.one_enum_def_parser = grammar.one_enum_def_parser
+        self.type_parser = grammar.type_parser
+        self.one_struct_def_parser = grammar.one_struct_def_parser
+        self.struct, self.struct_parser = grammar.struct, grammar.struct_parser
+        self.one_header_assignment_parser = grammar.one_header_assignment_parser
+        self.enum, self.row_decoder = grammar.enum, grammar.row_decoder
+        self.header, self.row_starts = scan_par_file(self.s, self.struct.keys())
 
     def read_chain(self, struct_name):
-        return read_chain(self.s, struct_name, self.one_enum_def_parser, self.one_struct_def_parser,
-                          self.one_header_assignment_parser, self.struct_parser)
+        """Return a list of dictionaries with the contents of one chain
+
+        :Parameters:
+            - `struct_name`: the name of the struct in the chain
+
+        @return: a list of dictionaries, one for each row
+        """
+        struct_name = struct_name.upper()
+        decode = self.row_decoder[struct_name]
+        return [decode(logical_line(self.s, start)[0]) for start in self.row_starts[struct_name]]
+
+    def read_chain_array(self, struct_name):
+        """Return the contents of one chain as a numpy record array
+
+        The dtype comes from the struct definition (see `chain_dtype`).
+        Enum fields hold the index of each value in the list of values
+        of the enum in `enum`, and fixed length strings are cut to
+        their declared lengths.
+
+        :Parameters:
+            - `struct_name`: the name of the struct in the chain
+
+        @return: a numpy record array, with one record for each row
+
+        >>> test_string = \"""typedef enum {
+        ...         OAK,
+        ...         MAPLE
+        ... } TREETYPE;
+        ...
+        ... typedef struct {
+        ...         int i;
+        ...         TREETYPE s;
+        ...         float x[2];
+        ...         char name[20]
+        ... } TREE;
+        ...
+        ... TREE 42 MAPLE {1.5 2} "big leaf"
+        ... TREE 44 OAK {0.5 3} red
+        ... TREE 3 MAPLE {1 -1} ""
+        ... \"""
+        >>> r = YannyReader(string=test_string)
+        >>> trees = r.read_chain_array('TREE')
+        >>> print trees.i
+        [42 44  3]
+        >>> maples = trees[trees.s == r.enum['TREETYPE'].index('MAPLE')]
+        >>> print maples.x.sum(axis=1)
+        [3.5 0. ]
+        >>> print list(numpy.array(r.enum['TREETYPE'])[trees.s])
+        ['MAPLE', 'OAK', 'MAPLE']
+        >>> print list(trees.name)
+        ['big leaf', 'red', '']
+        """
+        struct_name = struct_name.upper()
+        fields = self.struct[struct_name]
+        decoder = self.row_decoder[struct_name]
+        row_starts = self.row_starts[struct_name]
+        dtype = chain_dtype(fields, self.enum)
+        enum_code = dict((type_name, dict((value, i) for i, value in enumerate(values)))
+                         for type_name, values in self.enum.items())
+
+        # Fill the array a block of rows at a time, so the decoded
+        # values of only one block are kept as python objects
+        chain = numpy.zeros(len(row_starts), dtype=dtype)
+        for first in xrange(0, len(row_starts), ARRAY_BLOCK_SIZE):
+            rows = [decoder.values(logical_line(self.s, start)[0])
+                    for start in row_starts[first:first + ARRAY_BLOCK_SIZE]]
+            block = chain[first:first + len(rows)]
+            for field, column in zip(fields, zip(*rows)):
+                field_name, type_name = field['field_name'], field['type_name']
+                if type_name in enum_code:
+                    column = [enum_code[type_name][value] for value in column]
+                elif dtype[field_name].hasobject:
+                    # Fill these one at a time, so lists stay lists
+                    for i, value in enumerate(column):
+                        block[field_name][i] = value
+                    continue
+                elif dtype[field_name].shape:
+                    # Arrays of one value are read as the value
+                    column = [value if isinstance(value, list) else [value] for value in column]
+                block[field_name] = column
+
+        return chain.view(numpy.recarray)
+
+    def read_chains(self):
+        """Return the contents of every chain
+
+        @return: a dictionary with the list of rows of each struct
+        """
+        return dict((struct_name, self.read_chain(struct_name)) for struct_name in self.struct)
 
 if __name__=='__main__':
     import doctest, sys
@@ -13,20 +13,42 @@ import pdb
 import signal
 import datetime
 import time
-from tempfile import mkstemp
+import hashlib
 from SISPIlib.application import Application
-from threading import Event, Thread
+from threading import Thread, Lock
 import json
 import PML
 from PML.core import PML_Connection
 from sve.pythonclient import SVEError, SVE, SharedVariable
 import obstac.debug
+from obstac.debug import debug
+from obstac.InboxWatcher import InboxWatcher
+from obstac.SettleDetector import SettleDetector
+from obstac.CoalescingTrigger import CoalescingTrigger
+from obstac.SocketChannel import ChannelServer, ChannelError
+from obstac.Serializer import Serializer
+from obstac.Publisher import Publisher, Publication
+from obstac.SnapshotFetcher import SnapshotFetcher, FetchTimeout
+from obstac.ConnectionManager import ConnectionManager, ConnectionUnavailable
+from obstac.CycleMetrics import CycleMetrics
 
 WAIT_TIMEOUT = 25
 EXPOSURE_START_WAIT = 5
+# Seconds after which a script that could not be sent to OCS is no
+# longer sent when it reconnects
+PENDING_SCRIPT_MAX_AGE = 60
+
+def snapshot_digest(snapshot):
+    """Return a digest of the contents of a shared variable snapshot"""
+    return hashlib.sha1(json.dumps(snapshot, sort_keys=True)).hexdigest()
+
+def loaded_script_fname(loaded_dir):
+    """Return a new datestamped path in which to archive a loaded script"""
+    time_str = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    return os.path.join(loaded_dir, 'queue_%s.json' % time_str)
 
 class AutoObs(Application):
-    commands = ['enable', 'disable', 'is_enabled', 'start_debug']
+    commands = ['enable', 'disable', 'is_enabled', 'get_metrics', 'start_debug']
 
     def init(self):
         signal.signal(signal.SIGUSR1, self.debug_signal_handler)
@@ -44,7 +66,8 @@ class AutoObs(Application):
         self.info("Received: enable %s" % dummy)
         self.enabled = True
         self.sv_enabled.write(self.enabled)
-        self.update_event.set()
+        self.schedule_requested = True
+        self.update_trigger.set()
 
     def disable(self, dummy=''):
         self.info("Received: disable %s" % dummy)
@@ -54,10 +77,13 @@ class AutoObs(Application):
     def is_enabled(self, dummy=''):
         return self.enabled
 
+    def get_metrics(self, dummy=''):
+        return self.metrics.report()
+
     def trigger_update(self, ocs_queue):
-        self.debug("Update trigger pulled")
+        debug("Update trigger pulled")
         ocs_queue.read()
-        self.update_event.set()
+        self.update_trigger.set()
 
     def update_queue(self):
         
@@ -67,7 +93,19 @@ class AutoObs(Application):
                   'obstac_previous_queue': '/tmp/obstac_previous_queue.json',
                   'obstac_inprogress': '/tmp/obstac_inprogress.json',
                   'obstac_loaded': '/tmp',
-                  'obstac_fifo': '/tmp/obstac_fifo.json'}
+                  'obstac_fifo': '/tmp/obstac_fifo.json',
+                  'obstac_settle_mode': 'fixed',
+                  'obstac_settle_quiet': 1.0,
+                  'obstac_settle_max': EXPOSURE_START_WAIT,
+                  'obstac_settle_poll': 0.25,
+                  'obstac_trigger_debounce': 0.5,
+                  'obstac_trigger_max_wait': 5.0,
+                  'obstac_skip_unchanged_trigger': False,
+                  'obstac_socket': '',
+                  'obstac_serializer': 'compact',
+                  'obstac_fsync': False,
+                  'obstac_queue_read_timeout': 5.0,
+                  'obstac_inprogress_read_timeout': 5.0}
         for key in config:
             if key in self.config:
                 config[key] = self.config[key]
@@ -77,149 +115,268 @@ class AutoObs(Application):
                 self.warn("%s not found in config file, using default of %s" %
                           (key, config[key]))
 
+        # Collapse bursts of queue callbacks into one update
+        self.update_trigger.debounce = float(config['obstac_trigger_debounce'])
+        self.update_trigger.max_wait = float(config['obstac_trigger_max_wait'])
+
+        # Queue, in progress and script files are written compactly
+        # unless people need to read them
+        serializer = Serializer(config['obstac_serializer'])
+        self.info("Writing JSON in %s mode" % serializer.mode)
+        publisher = Publisher(fsync=str(config['obstac_fsync']).lower()
+                              in ('true', 'yes', 'on', '1'))
+
         # Make sure the fifo file exists, and open it
         if not os.path.exists(config['obstac_fifo']):
             os.mkfifo(config['obstac_fifo'])
         obstac_fifo = posix.open(config['obstac_fifo'], posix.O_RDWR | posix.O_NONBLOCK)
-        
-        # Prepare OCS connection
-        
-        ocs_established = False
-        ocs_attempts = 0
-        max_ocs_attempts = 10
-
-        while not ocs_established and (ocs_attempts < max_ocs_attempts):
-            try:
-                ocs = PML_Connection('OCS', 'OCS')
-                ocs_established = True
-                self.info("Established connection to OCS queue manager")
-            except:
-                self.warn("Failed to establish connection to OCS queue manager")
-                ocs_established = False
-                ocs_attempts = ocs_attempts + 1
-                sleep(2)
-
-        inprogress_established = False
-        inprogress_attempts = 0
-        max_inprogress_attempts = 10
-
-        # Subscribe to inprogress shared variable
-
-        sve = SVE()
-        while not inprogress_established and (inprogress_attempts < max_inprogress_attempts):
-            try:
-                inprogress_sv = SharedVariable("OCS", "INPROGRESS", sve)
-                ocs_queue_sv = SharedVariable("OCS", "EXPOSUREQUEUE", sve)
-                inprogress_established = True
-                self.info("Connected to INPROGRESS and EXPOSUREQUEUE shared variables")
-            except:
-                self.warn("Failed to subscribe to INPROGRESS and EXPOSUREQUEUE shared variables")
-                inprogress_established = False
-                inprogress_attempts = inprogress_attempts + 1
-                sleep(2)
 
+        # Talk to schedulers that connect to the socket directly,
+        # falling back on the fifo for those that do not
+        if config['obstac_socket']:
+            channel = ChannelServer(config['obstac_socket'])
+            self.info("Listening for a scheduler on %s" % config['obstac_socket'])
+        else:
+            channel = None
+
+        # Wake up as soon as the scheduler delivers its script
+        inbox_watcher = InboxWatcher(config['obstac_inbox'])
+        self.info("Watching for scheduler scripts using %s" % inbox_watcher.mode)
+        
+        # Connect to the OCS queue manager and shared variables. The
+        # connection manager makes (and, if they fail, remakes) the
+        # connections in the background, so updates never wait for them.
+        #
+        # The OCS connection is only used to load scripts, and there is
+        # no command to check it with that OCS would not act on. A script
+        # is only sent again if it was never sent, because there was no
+        # connection; it is then sent when OCS reconnects, unless a newer
+        # one has been loaded since. After any other error OCS may have
+        # acted on it, so it is not sent again.
+        pending_scripts = []
+        load_lock = Lock()
+
+        def load_pending_script(ocs_connection):
+            with load_lock:
+                if not pending_scripts:
+                    return
+                fname, pending_time = pending_scripts.pop()
+                if time.time() - pending_time > PENDING_SCRIPT_MAX_AGE:
+                    self.warn("Reconnected to OCS too late to load %s" % fname)
+                    return
+                self.info("Reconnected to OCS; asking SISPI to load %s" % fname)
+                try:
+                    ocs_connection('loadq', fname)
+                except Exception as e:
+                    self.error("Could not ask OCS to load %s: %s" % (fname, str(e)))
+                    self.connections.mark_failed('OCS', e, ocs_connection)
+
+        def load_script(fname):
+            self.info("Asking SISPI to load %s" % fname)
+            with load_lock:
+                del pending_scripts[:]
+                try:
+                    with self.metrics.phase('loadq'):
+                        ocs('loadq', fname)
+                except ConnectionUnavailable:
+                    self.warn("Not connected to the OCS queue manager; will load %s when reconnected"
+                              % fname)
+                    pending_scripts.append((fname, time.time()))
+                except Exception as e:
+                    self.connections.mark_failed('OCS', e)
+                    raise
+
+        ocs = self.connections.add('OCS', lambda: PML_Connection('OCS', 'OCS'),
+                                   on_connect=load_pending_script)
+
+        # Both shared variables are read through one SVE client. It has
+        # no check of its own, so it is checked by reading them through
+        # the fetcher (so never at the same time as an update reads
+        # them), unless an update has read them both recently anyway. If
+        # it fails, both are made again from a new client, and the old
+        # one is closed.
+        def check_sve(sve):
+            now = time.time()
+            if all(now - fetcher.last_read.get(name, 0) < self.connections.health_interval
+                   for name in fetcher.workers):
+                return
+            for result in fetcher.fetch().values():
+                if result.error is not None and \
+                        not isinstance(result.error, (FetchTimeout, ConnectionUnavailable)):
+                    raise result.error
+
+        self.connections.add('SVE', SVE, health_check=check_sve)
+        inprogress_sv = self.connections.add(
+            'INPROGRESS', lambda sve: SharedVariable("OCS", "INPROGRESS", sve),
+            depends_on=('SVE',))
+        ocs_queue_sv = self.connections.add(
+            'EXPOSUREQUEUE', lambda sve: SharedVariable("OCS", "EXPOSUREQUEUE", sve),
+            depends_on=('SVE',))
+
+        # Read both shared variables at once, each with its own
+        # timeout, subscribing again if the SVE connection was lost
+        fetcher = SnapshotFetcher(
+            {'EXPOSUREQUEUE': ocs_queue_sv, 'INPROGRESS': inprogress_sv},
+            timeouts={'EXPOSUREQUEUE': float(config['obstac_queue_read_timeout']),
+                      'INPROGRESS': float(config['obstac_inprogress_read_timeout'])},
+            retry_errors=(SVEError,))
+
+        # Give OCS a chance to start the next exposure and update the
+        # queue before we look at it.
+        def queue_state():
+            fetched = fetcher.fetch()
+            if any(result.error is not None for result in fetched.values()):
+                return None
+            return (fetched['EXPOSUREQUEUE'].value, fetched['INPROGRESS'].value)
+
+        self.settle_detector = SettleDetector(queue_state,
+                                              mode=config['obstac_settle_mode'],
+                                              quiet_period=float(config['obstac_settle_quiet']),
+                                              max_wait=float(config['obstac_settle_max']),
+                                              poll_interval=float(config['obstac_settle_poll']))
+
+        # Digests of the last snapshots written, so we can avoid
+        # rewriting (and maybe re-triggering on) unchanged ones
+        skip_unchanged_trigger = str(config['obstac_skip_unchanged_trigger']).lower() \
+            in ('true', 'yes', 'on', '1')
+        queue_digest = None
+        in_progress_digest = None
+
+        # The latest snapshots, to send to a scheduler on the socket
+        current_queue = None
+        previous_queue = None
+        current_in_progress = None
 
         # Infinite loop up update
         while True:
-            self.debug("Waiting for event")
-            self.update_event.wait()
-            self.debug("Waiting %s seconds" % EXPOSURE_START_WAIT)
-            sleep(EXPOSURE_START_WAIT)
-            self.debug("Clearing event")
-            self.update_event.clear()
+            self.metrics.start_cycle()
+            debug("Waiting for event")
+            with self.metrics.phase('event_wait'):
+                generation = self.update_trigger.wait()
+            debug("Handling trigger %d (%d suppressed so far)",
+                  generation, self.update_trigger.suppressed)
+            debug("Waiting up to %s seconds for the queue to settle (%s)",
+                  config['obstac_settle_max'], config['obstac_settle_mode'])
+            with self.metrics.phase('settle'):
+                waited = self.settle_detector.wait()
+            self.info("Waited %.2f seconds for the queue to settle" % waited)
+            # The read below answers callbacks that arrived while settling
+            generation = self.update_trigger.fold(generation)
             start_time = time.time()
+            snapshot_changed = False
+            publications = []
             try:
-                self.debug("Retrieving and writing EXPOSUREQUEUE")
-                try:
-                    ocs_queue = ocs_queue_sv.read()
-                except SVEError as e:
-                    try:
-                        ocs_queue_sv.subscribe()
-                        self.info("Subscribed to EXPOSUREQUEUE shared variable")
-                        ocs_queue = ocs_queue_sv.read()
-                    except Exception as e:
-                        self.error("Could not get queue contents: " + str(e))
-                        ocs_queue = None
-
-                # Make sure the write is atomic, and that we store the
-                # most recent So, start by writing into a temp file,
-                # then move files back in time, making the temp file
-                # current.
+                debug("Retrieving EXPOSUREQUEUE and INPROGRESS")
+                with self.metrics.phase('sv_read'):
+                    fetched = fetcher.fetch()
+                for name, result in fetched.iteritems():
+                    if result.resubscribed:
+                        self.info("Subscribed to %s shared variable" % name)
+                    if result.error is not None:
+                        self.error("Could not read %s: %s" % (name, str(result.error)))
+                        if not isinstance(result.error, (FetchTimeout, ConnectionUnavailable)):
+                            self.connections.mark_failed('SVE', result.error)
+                ocs_queue = fetched['EXPOSUREQUEUE'].value
+                in_progress = fetched['INPROGRESS'].value
+
+                queue_changed = False
                 if ocs_queue is not None:
-                    queue_fp, queue_fname = mkstemp(
-                        dir=os.path.dirname(config['obstac_current_queue']))
-                    os.close(queue_fp)
-                    with open(queue_fname, 'w') as fp:
-                        json.dump(ocs_queue, fp, indent=4)
-                    os.chmod(queue_fname, 0o666)
-                    try:
-                        os.remove(config['obstac_previous_queue'])
-                    except OSError:
-                        pass
-                    try:
-                        os.rename(config['obstac_current_queue'],
-                                  config['obstac_previous_queue'])
-                    except OSError:
-                        pass
-                    
-                    os.rename(queue_fname, config['obstac_current_queue'])
-                
-                self.info("Retrieving and writing exposures in progress")
-                try:
-                    in_progress = inprogress_sv.read()
-                except SVEError as e:
-                    try:
-                        inprogress_sv.subscribe()
-                        self.info("Subscribed to INPROGRESS shared variable")
-                        in_progress = inprogress_sv.read()
-                    except Exception as e:
-                        self.error("Could not get exposures in progress: " + str(e))
-                        in_progress = None
-
-                # Make sure the write is atomic
+                    new_queue_digest = snapshot_digest(ocs_queue)
+                    if new_queue_digest == queue_digest:
+                        debug("EXPOSUREQUEUE unchanged, not rewriting it")
+                    else:
+                        queue_changed = True
+                        # The current queue becomes the previous one
+                        publications.append(Publication(config['obstac_current_queue'],
+                                                        serializer.dumps(ocs_queue),
+                                                        config['obstac_previous_queue']))
+
+                in_progress_changed = False
                 if in_progress is not None:
-                    inprogress_fp, inprogress_fname = mkstemp(
-                        dir=os.path.dirname(config['obstac_inprogress']))
-                    os.close(inprogress_fp)
-                    with open(inprogress_fname, 'w') as fp:
-                        json.dump(in_progress, fp, indent=4)
-                    os.chmod(inprogress_fname, 0o666)
-                    try:
-                        os.remove(config['obstac_inprogress'])
-                    except OSError:
-                        pass
-                    os.rename(inprogress_fname, config['obstac_inprogress'])
+                    new_in_progress_digest = snapshot_digest(in_progress)
+                    if new_in_progress_digest == in_progress_digest:
+                        debug("INPROGRESS unchanged, not rewriting it")
+                    else:
+                        in_progress_changed = True
+                        publications.append(Publication(config['obstac_inprogress'],
+                                                        serializer.dumps(in_progress),
+                                                        None))
+
+                # Replace the queue files atomically, and together, so
+                # the scheduler sees a consistent snapshot
+                if len(publications) > 0:
+                    with self.metrics.phase('file_write'):
+                        publisher.publish_generation(publications)
+
+                # Only remember a snapshot once it has been written, so
+                # one that could not be is written on the next update
+                if queue_changed:
+                    queue_digest = new_queue_digest
+                    previous_queue = current_queue
+                    current_queue = ocs_queue
+                    snapshot_changed = True
+                if in_progress_changed:
+                    in_progress_digest = new_in_progress_digest
+                    current_in_progress = in_progress
+                    snapshot_changed = True
 
                 # To avoid filling up the FIFO buffer if there is nothing
                 # reading it, read from the FIFO until all lines are gone
                 # before writing a new line.
                 time_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 read_bytes = None
-                while read_bytes is None or read_bytes > 0:
-                    try:
-                        read_line = os.read(obstac_fifo, len(time_str)+1)
-                    except OSError:
-                        read_line = ""
-                    read_bytes = len(read_line)
+                with self.metrics.phase('fifo_drain'):
+                    while read_bytes is None or read_bytes > 0:
+                        try:
+                            read_line = os.read(obstac_fifo, len(time_str)+1)
+                        except OSError:
+                            read_line = ""
+                        read_bytes = len(read_line)
                     
+                if self.enabled and self.update_trigger.should_skip(generation):
+                    self.info("Queue changed again during update; leaving the scheduler for the next update")
+                    continue
+
+                schedule_requested = self.schedule_requested
+                self.schedule_requested = False
+                if self.enabled and skip_unchanged_trigger \
+                        and not (snapshot_changed or schedule_requested):
+                    self.info("Queue and exposures in progress unchanged; not triggering the scheduler")
+                    continue
+
+                if self.enabled and channel is not None and channel.accept():
+                    self.info("Sending the queue to the scheduler over %s" % config['obstac_socket'])
+                    try:
+                        with self.metrics.phase('scheduler_response'):
+                            sispi_queue = channel.request_script(
+                                time_str, current_queue, previous_queue, current_in_progress,
+                                WAIT_TIMEOUT - (time.time() - start_time))
+                    except ChannelError as e:
+                        self.warn("Lost connection to the scheduler (%s), using the FIFO" % str(e))
+                    else:
+                        if sispi_queue is None:
+                            self.info("No new scheduler script provided")
+                            continue
+
+                        self.info("Script from scheduler received!")
+                        if len(sispi_queue) > 0:
+                            loaded_fname = loaded_script_fname(config['obstac_loaded'])
+                            with self.metrics.phase('file_write'):
+                                publisher.publish(loaded_fname, serializer.dumps(sispi_queue))
+                            load_script(loaded_fname)
+
+                        self.info("update succeeded")
+                        continue
+
                 if self.enabled:
                     self.info("Sending the timestamp to the FIFO to the scheduler")
-                    os.write(obstac_fifo, time_str + "\n")
+                    with self.metrics.phase('fifo_signal'):
+                        os.write(obstac_fifo, time_str + "\n")
                     self.info("Waiting for scheduler to provide a queue")
-                    while not os.path.exists(config['obstac_inbox']):
-                        if (time.time() - start_time) > WAIT_TIMEOUT:
-                            break
-                        self.debug("Still waiting...")
-                        sleep(1)
-
-                    if os.path.exists(config['obstac_inbox']):
-                        # If the file is older than the trigger, do not load it, but keep waiting
-                        while start_time > os.path.getmtime(config['obstac_inbox']):
-                            if (time.time() - start_time) > WAIT_TIMEOUT:
-                                break
-                            self.debug("Still waiting...")
-                            sleep(1)
-                        
+                    # If the file is older than the trigger, do not load it, but keep waiting
+                    with self.metrics.phase('scheduler_response'):
+                        inbox_watcher.wait(start_time, WAIT_TIMEOUT)
+
                     # If we reached here because we timed out, do not attempt
                     # to process the file that doesn't exist
                     if not os.path.exists(config['obstac_inbox']):
@@ -233,29 +390,29 @@ class AutoObs(Application):
                     # the archived location to OCS, so we are not
                     # in danger of OCS trying to read the file
                     # after we've moved it.
-                    time_str = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-                    loaded_fname = os.path.join(config['obstac_loaded'],
-                                                'queue_%s.json' % time_str)
-                    os.rename(config['obstac_inbox'], loaded_fname)
+                    loaded_fname = loaded_script_fname(config['obstac_loaded'])
+                    with self.metrics.phase('inbox_rename'):
+                        os.rename(config['obstac_inbox'], loaded_fname)
                     try:
                         with open(loaded_fname, 'r') as fp:
-                            sispi_queue = json.load(fp)
+                            sispi_queue = serializer.load(fp)
                     except:
                         self.error("Could not read scheduler queue file")
                         sispi_queue = []
                         # It's SISPI's job to complain about it
-                        ocs('loadq', loaded_fname)
+                        load_script(loaded_fname)
                             
                     if len(sispi_queue) > 0:
-                        self.info("Asking SISPI to load %s" % loaded_fname)
-                        ocs('loadq', loaded_fname)
+                        load_script(loaded_fname)
 
                 self.info("update succeeded")
             except Exception, msg:
                 self.warn("update failed: %s" % msg)
                 raise
-                self.update_event.set()
+                self.update_trigger.set()
                 sleep(1)
+            finally:
+                self.metrics.end_cycle()
 
     def main(self):
         self.info("The automated observing driver is starting up now.")
@@ -266,29 +423,39 @@ class AutoObs(Application):
 
         self.enabled = False
         self.sv_enabled.write(self.enabled)
+        self.schedule_requested = False
+
+        self.update_trigger = CoalescingTrigger()
+
+        # Timings of the phases of each update, reported by get_metrics
+        # and (if a file is given) written out periodically
+        self.metrics = CycleMetrics(
+            fname=self.config.get('obstac_metrics_file', '') or None,
+            dump_interval=float(self.config.get('obstac_metrics_interval', 60.0)))
+
+        # Long-lived connections, kept open (and reopened) in the background
+        self.connections = ConnectionManager(
+            initial_delay=float(self.config.get('obstac_reconnect_initial', 1.0)),
+            max_delay=float(self.config.get('obstac_reconnect_max', 60.0)),
+            health_interval=float(self.config.get('obstac_health_interval', 30.0)))
+
+        def subscribe_to_queue():
+            ocs_queue = self.shared_variable('EXPOSUREQUEUE','OCS')
+            ocs_queue.subscribe(callback=self.trigger_update)
+            self.info("Established callback to OCS queue")
+            # The queue may have changed while we were not subscribed
+            self.update_trigger.set()
+            return ocs_queue
+
+        # If the subscription is lost, no callbacks arrive to tell us,
+        # so check it
+        self.connections.add('callback', subscribe_to_queue,
+                             health_check=lambda ocs_queue: ocs_queue.read())
 
-        callback_established = False
-        callback_attempts = 0
-        max_callback_attempts = 10
-        self.update_event = Event()
-
-        
         self.update_thread = Thread(name="UpdateQueue",target=self.update_queue)
         self.update_thread.daemon = True
         self.update_thread.start()
-
-        while not callback_established and (callback_attempts < max_callback_attempts):
-            try:
-                ocs_queue = self.shared_variable('EXPOSUREQUEUE','OCS')
-                ocs_queue.subscribe(callback=self.trigger_update)
-                callback_established = True
-                self.info("Established callback to OCS queue")
-            except:
-                self.warn("Failed to establish callback to OCS queue")
-                callback_established = False
-                callback_attempts = callback_attempts + 1
-                sleep(2)
-
+        self.connections.start()
 
 
         self.info("Waiting for shutdown event.")
@@ -0,0 +1,173 @@
+"""Collapse bursts of queue change notifications into single updates
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import time
+from threading import Condition
+
+class CoalescingTrigger(object):
+    """Collapse bursts of triggers into single updates
+
+    Used like a `threading.Event` shared between callbacks that `set`
+    it and an update thread that `wait` s on it, except that `wait`
+    returns only when no trigger has been pulled for `debounce`
+    seconds (or `max_wait` seconds after the first trigger of the
+    burst), and clears itself on return.
+
+    Each trigger increments a generation counter. `wait` returns the
+    generation it is handling. An update thread that waits for the
+    queue to settle before reading it calls `fold` when it is done
+    waiting, so triggers pulled while it waited are answered by the
+    read that follows, rather than starting another update. It can then
+    check with `should_skip` whether newer triggers arrived while it was
+    working, and leave acting on the queue to the next update.
+
+    >>> trigger = CoalescingTrigger(debounce=0.01, max_wait=1.0)
+    >>> for i in range(5):
+    ...     trigger.set()
+    >>> trigger.wait()
+    5
+    >>> trigger.suppressed
+    4
+    >>> trigger.should_skip(5)
+    False
+    >>> trigger.set()
+    >>> trigger.should_skip(5)
+    True
+    """
+
+    def __init__(self, debounce=0.5, max_wait=5.0):
+        """Create a trigger
+
+        :Parameters:
+            - `debounce`: seconds without a trigger before a burst is over
+            - `max_wait`: the most seconds after the start of a burst to wait
+        """
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.condition = Condition()
+        self.generation = 0
+        self.handled_generation = 0
+        self.burst_start = None
+        self.handled_burst_start = None
+        self.last_pull = None
+        self.suppressed = 0
+        # Newer triggers only preempt an update until this time, which
+        # is not put off by updates that were skipped, so a steady
+        # stream of triggers cannot keep the scheduler from running
+        self.skip_deadline = None
+        self.skipping = False
+
+    def set(self):
+        """Pull the trigger"""
+        with self.condition:
+            now = time.time()
+            self.generation += 1
+            self.last_pull = now
+            if self.burst_start is None:
+                self.burst_start = now
+            self.condition.notify_all()
+
+    def is_set(self):
+        """Return True if there are triggers not yet returned by `wait`"""
+        with self.condition:
+            return self.generation != self.handled_generation
+
+    def wait(self):
+        """Wait for a burst of triggers to end
+
+        :Returns:
+            the generation of the last trigger in the burst
+        """
+        with self.condition:
+            while self.generation == self.handled_generation:
+                # Wait with a timeout so that KeyboardInterrupt still works
+                self.condition.wait(60)
+
+            while True:
+                now = time.time()
+                ready_time = min(self.last_pull + self.debounce,
+                                 self.burst_start + self.max_wait)
+                if now >= ready_time:
+                    break
+                self.condition.wait(ready_time - now)
+
+            self.suppressed += self.generation - self.handled_generation - 1
+            self.handled_generation = self.generation
+            self.handled_burst_start = self.burst_start
+            self.burst_start = None
+            self._start_skip_deadline()
+            return self.generation
+
+    def fold(self, generation):
+        """Fold triggers pulled since `wait` returned `generation` into it
+
+        Call this once the update has finished waiting for the queue to
+        settle, just before reading it: the triggers pulled while it
+        waited are answered by that read, so they are counted as
+        suppressed and not returned by the next `wait`, and
+        `should_skip` only gives way to triggers pulled after this.
+
+        This is the default autoobs configuration, with the settle (a
+        fixed wait) as long as `max_wait`:
+
+        >>> from obstac.SettleDetector import SettleDetector
+        >>> from threading import Timer
+        >>> trigger = CoalescingTrigger(debounce=0.01, max_wait=0.2)
+        >>> settle = SettleDetector(None, mode='fixed', max_wait=0.2)
+        >>> trigger.set()
+        >>> generation = trigger.wait()
+        >>> Timer(0.05, trigger.set).start()
+        >>> waited = settle.wait()
+        >>> generation = trigger.fold(generation)
+        >>> generation, trigger.is_set(), trigger.should_skip(generation)
+        (2, False, False)
+        >>> trigger.set()
+        >>> trigger.should_skip(generation)
+        True
+
+        :Parameters:
+            - `generation`: the generation returned by `wait`
+
+        :Returns:
+            the generation now being handled
+        """
+        with self.condition:
+            if self.generation != generation:
+                self.suppressed += self.generation - generation
+                self.handled_generation = self.generation
+                self.burst_start = None
+            self._start_skip_deadline()
+            return self.generation
+
+    def _start_skip_deadline(self):
+        if not self.skipping:
+            self.skip_deadline = time.time() + self.max_wait
+
+    def should_skip(self, generation):
+        """Check whether an update should give way to a newer trigger
+
+        If the trigger has been pulled since `wait` (or `fold`)
+        returned `generation`, the update of that generation should be
+        abandoned (and is counted as suppressed), unless more than
+        `max_wait` seconds have passed since then, or since the last
+        update that was not skipped was handed its generation.
+
+        :Parameters:
+            - `generation`: the generation returned by `wait`
+
+        :Returns:
+            True if the update should be skipped
+        """
+        with self.condition:
+            if self.generation == generation or time.time() >= self.skip_deadline:
+                self.skipping = False
+                return False
+            # Count the next wait's max_wait from the start of this burst
+            if self.handled_burst_start is not None:
+                self.burst_start = min(self.burst_start, self.handled_burst_start)
+            self.skipping = True
+            self.suppressed += 1
+            return True
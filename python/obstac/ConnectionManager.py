@@ -0,0 +1,377 @@
+"""Keep long-lived connections (such as to PML and SVE) open, reconnecting in the background
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import time
+import random
+import threading
+from collections import namedtuple
+
+from obstac.debug import debug
+
+# The state of one connection, as reported by ConnectionManager.status
+ConnectionStatus = namedtuple('ConnectionStatus', ['connected', 'failures', 'last_error'])
+
+class ConnectionUnavailable(Exception):
+    """A managed connection is not (yet) established"""
+    pass
+
+def close_handle(handle):
+    """Close a handle that is no longer used, if it has a close method"""
+    close = getattr(handle, 'close', None)
+    if close is not None:
+        close()
+
+def backoff_delay(failures, initial_delay=1.0, max_delay=60.0, jitter=0.5, rng=random):
+    """Return the time to wait before the next attempt to connect
+
+    The delay doubles with each consecutive failure, up to `max_delay`,
+    and is then reduced by a random fraction of up to `jitter`, so
+    clients that lost a server together do not all retry together.
+
+    :Parameters:
+        - `failures`: the number of consecutive failed attempts
+        - `initial_delay`: the delay after the first failure (seconds)
+        - `max_delay`: the longest delay (seconds)
+        - `jitter`: the largest fraction by which to shorten the delay
+        - `rng`: the source of random numbers (defaults to the random module)
+
+    >>> [backoff_delay(n, jitter=0) for n in range(1, 9)]
+    [1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 60.0, 60.0]
+    >>> 2.0 <= backoff_delay(3) <= 4.0
+    True
+    """
+    delay = min(max_delay, initial_delay * 2.0**(failures - 1))
+    return delay * (1.0 - jitter*rng.random())
+
+class ManagedConnection(object):
+    """One connection, and the state of attempts to keep it open"""
+
+    def __init__(self, name, connect, health_check=None, close=close_handle, depends_on=(),
+                 on_connect=None):
+        self.name = name
+        self.connect = connect
+        self.health_check = health_check
+        self.close = close
+        self.depends_on = tuple(depends_on)
+        self.on_connect = on_connect
+        self.handle = None
+        self.failures = 0
+        self.last_error = None
+        self.next_attempt = 0.0
+        self.ready = threading.Event()
+
+class ConnectionProxy(object):
+    """Use whatever handle a managed connection currently has
+
+    Attributes (and calls) are looked up on the current handle, so
+    code holding the proxy picks up new connections automatically.
+
+    :Raises:
+        - `ConnectionUnavailable`: if the connection is not established
+    """
+
+    def __init__(self, manager, name):
+        self._manager = manager
+        self._name = name
+
+    def _handle(self):
+        handle = self._manager.get(self._name)
+        if handle is None:
+            raise ConnectionUnavailable("No connection to %s" % self._name)
+        return handle
+
+    def __getattr__(self, attribute):
+        return getattr(self._handle(), attribute)
+
+    def __call__(self, *args, **kwargs):
+        return self._handle()(*args, **kwargs)
+
+class ConnectionManager(object):
+    """Keep long-lived connections open, reconnecting in the background
+
+    Each connection is made by calling the function given to `add`.
+    A background thread makes the connections, checks their health
+    every `health_interval` seconds, and reconnects (with jittered
+    exponential backoff) any that fail a check or are reported with
+    `mark_failed`, closing the handles they replace. `get` never waits
+    for a reconnect unless asked to.
+
+    A connection can be made from the handles of others (such as
+    shared variables from an SVE client), given as `depends_on` to
+    `add`. It is made once they are connected, and when one of them
+    fails, it is dropped and made again from the new handle.
+
+    >>> attempts = []
+    >>> def connect():
+    ...     attempts.append(time.time())
+    ...     if len(attempts) < 3:
+    ...         raise IOError("server down")
+    ...     return 'connection %d' % len(attempts)
+    >>> manager = ConnectionManager(initial_delay=0.01, max_delay=0.05)
+    >>> proxy = manager.add('OCS', connect)
+    >>> print manager.get('OCS')
+    None
+    >>> manager.start()
+    >>> manager.get('OCS', timeout=5)
+    'connection 3'
+    >>> proxy.upper()
+    'CONNECTION 3'
+    >>> manager.mark_failed('OCS', IOError("lost"))
+    >>> manager.get('OCS', timeout=5)
+    'connection 4'
+    >>> manager.status()['OCS']
+    ConnectionStatus(connected=True, failures=0, last_error=None)
+    >>> manager.stop()
+    """
+
+    def __init__(self, initial_delay=1.0, max_delay=60.0, jitter=0.5, health_interval=30.0):
+        """Set up the manager (call `start` to start connecting)
+
+        :Parameters:
+            - `initial_delay`: seconds to wait after a first failure to connect
+            - `max_delay`: the longest time to wait between attempts
+            - `jitter`: the largest fraction by which delays are shortened
+            - `health_interval`: seconds between health checks
+        """
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.health_interval = health_interval
+        self.connections = {}
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def add(self, name, connect, health_check=None, close=close_handle, depends_on=(),
+            on_connect=None):
+        """Manage a connection
+
+        :Parameters:
+            - `name`: the name of the connection
+            - `connect`: a function that makes the connection, returning
+              its handle, or raising an exception if it cannot; it is
+              called with the handles of the connections in `depends_on`
+            - `health_check`: a function called with the handle, which
+              raises an exception (or returns False) if the connection
+              no longer works (optional)
+            - `close`: a function called with each handle that is
+              dropped (defaults to calling its close method, if any)
+            - `depends_on`: the names of connections from whose handles
+              this one is made (optional)
+            - `on_connect`: a function called with each new handle, in
+              the manager's thread, once it is connected (optional)
+
+        :Returns:
+            a `ConnectionProxy` for the connection
+
+        >>> class Client(object):
+        ...     def __init__(self, number):
+        ...         self.number = number
+        ...         self.closed = False
+        ...     def close(self):
+        ...         self.closed = True
+        >>> clients = []
+        >>> def connect_client():
+        ...     clients.append(Client(len(clients) + 1))
+        ...     return clients[-1]
+        >>> manager = ConnectionManager(initial_delay=0.01)
+        >>> queue = manager.add('QUEUE', lambda client: ('queue', client.number),
+        ...                     depends_on=('CLIENT',))
+        >>> client = manager.add('CLIENT', connect_client)
+        >>> manager.start()
+        >>> manager.get('QUEUE', timeout=5)
+        ('queue', 1)
+        >>> manager.mark_failed('CLIENT', IOError("lost"))
+        >>> manager.get('QUEUE', timeout=5)
+        ('queue', 2)
+        >>> [c.closed for c in clients]
+        [True, False]
+        >>> manager.stop()
+        """
+        with self.condition:
+            self.connections[name] = ManagedConnection(name, connect, health_check,
+                                                       close, depends_on, on_connect)
+            self.condition.notify()
+        return ConnectionProxy(self, name)
+
+    def get(self, name, timeout=0.0):
+        """Return the handle of a connection
+
+        :Parameters:
+            - `name`: the name of the connection
+            - `timeout`: the longest time to wait for the connection to be
+              established, in seconds (defaults to 0: do not wait)
+
+        :Returns:
+            the handle, or None if the connection is not established
+        """
+        connection = self.connections[name]
+        if timeout > 0:
+            connection.ready.wait(timeout)
+        return connection.handle
+
+    def proxy(self, name):
+        """Return a `ConnectionProxy` for a connection"""
+        return ConnectionProxy(self, name)
+
+    def mark_failed(self, name, error=None, handle=None):
+        """Report that a connection no longer works, so it is reconnected
+
+        :Parameters:
+            - `name`: the name of the connection
+            - `error`: the exception showing it failed (optional)
+            - `handle`: the handle that failed (optional); if given, and
+              the connection has already been replaced, nothing is done
+        """
+        with self.condition:
+            connection = self.connections[name]
+            if connection.handle is None or (handle is not None and handle is not connection.handle):
+                return
+            dropped = self.drop(connection, error)
+            self.condition.notify()
+
+        # Close those made from others before the others
+        for connection, old_handle in reversed(dropped):
+            self.close(connection, old_handle)
+
+    def drop(self, connection, error):
+        # Forget a connection's handle, and those of connections made
+        # from it (with the lock held), returning what was dropped
+        debug("Connection to %s failed (%s), reconnecting", connection.name, error)
+        dropped = [(connection, connection.handle)]
+        connection.handle = None
+        connection.ready.clear()
+        connection.last_error = error
+        connection.next_attempt = time.time()
+        for dependent in self.connections.values():
+            if connection.name in dependent.depends_on and dependent.handle is not None:
+                dropped.extend(self.drop(dependent, ConnectionUnavailable(
+                    "%s failed (%s)" % (connection.name, error))))
+        return dropped
+
+    def close(self, connection, handle):
+        if connection.close is None:
+            return
+        try:
+            connection.close(handle)
+        except Exception as e:
+            debug("Could not close old connection to %s (%s)", connection.name, e)
+
+    def status(self):
+        """Return a dictionary with the `ConnectionStatus` of each connection"""
+        with self.condition:
+            return dict((name, ConnectionStatus(connection.handle is not None,
+                                                connection.failures, connection.last_error))
+                        for name, connection in self.connections.iteritems())
+
+    def start(self):
+        """Start connecting, in a background thread"""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(name="ConnectionManager", target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the background thread (leaving connections as they are)"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                now = time.time()
+                due = [c for c in self.connections.values() if c.next_attempt <= now]
+                if len(due) == 0:
+                    next_attempt = min([c.next_attempt for c in self.connections.values()]
+                                       + [now + self.health_interval])
+                    self.condition.wait(next_attempt - now)
+                    continue
+
+            for connection in due:
+                if connection.handle is None:
+                    self.reconnect(connection)
+                else:
+                    self.check(connection)
+
+    def reconnect(self, connection):
+        with self.condition:
+            dependency_handles = self.dependency_handles(connection)
+            if None in dependency_handles:
+                # Made when what it depends on is connected
+                connection.next_attempt = float('inf')
+                return
+
+        try:
+            handle = connection.connect(*dependency_handles)
+        except Exception as e:
+            with self.condition:
+                connection.failures += 1
+                connection.last_error = e
+                delay = backoff_delay(connection.failures, self.initial_delay,
+                                      self.max_delay, self.jitter)
+                connection.next_attempt = time.time() + delay
+            debug("Could not connect to %s (%s); trying again in %.1f seconds",
+                  connection.name, e, delay)
+            return
+
+        with self.condition:
+            stale = any(new is not old for new, old
+                        in zip(self.dependency_handles(connection), dependency_handles))
+            if stale:
+                # What it was made from failed while it was being made
+                connection.next_attempt = time.time()
+            else:
+                connection.handle = handle
+                connection.failures = 0
+                connection.last_error = None
+                connection.next_attempt = self.next_check_time(connection)
+                connection.ready.set()
+                for dependent in self.connections.values():
+                    if connection.name in dependent.depends_on and dependent.handle is None \
+                            and dependent.next_attempt == float('inf'):
+                        dependent.next_attempt = time.time()
+        if stale:
+            self.close(connection, handle)
+            return
+        debug("Connected to %s", connection.name)
+        if connection.on_connect is not None:
+            try:
+                connection.on_connect(handle)
+            except Exception as e:
+                debug("Error after connecting to %s (%s)", connection.name, e)
+
+    def dependency_handles(self, connection):
+        return [self.connections[name].handle for name in connection.depends_on]
+
+    def check(self, connection):
+        handle = connection.handle
+        try:
+            healthy = connection.health_check(handle) is not False
+            error = None if healthy else ConnectionUnavailable("health check failed")
+        except Exception as e:
+            error = e
+
+        if error is not None:
+            self.mark_failed(connection.name, error, handle)
+            return
+
+        with self.condition:
+            if connection.handle is handle:
+                connection.next_attempt = self.next_check_time(connection)
+
+    def next_check_time(self, connection):
+        if connection.health_check is None:
+            return float('inf')
+        return time.time() + self.health_interval
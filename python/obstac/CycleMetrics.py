@@ -0,0 +1,251 @@
+"""Time the phases of autoobs update cycles, and keep histograms of the timings
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+from obstac import logger
+from obstac.Publisher import Publisher
+from obstac.Serializer import Serializer
+
+try:
+    from time import monotonic
+except ImportError:
+    # python 2 has no monotonic clock in the standard library, so
+    # call clock_gettime ourselves, using the wall clock if we cannot
+    try:
+        import ctypes
+
+        class _timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        CLOCK_MONOTONIC = 1
+        # clock_gettime is in the C library already loaded (or, with
+        # older C libraries, in librt); looking libraries up with
+        # ctypes.util.find_library would run ldconfig
+        try:
+            _clock_gettime = ctypes.CDLL(None, use_errno=True).clock_gettime
+        except AttributeError:
+            _clock_gettime = ctypes.CDLL('librt.so.1', use_errno=True).clock_gettime
+        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+        def monotonic():
+            """Return the time in seconds on a clock that never goes backwards"""
+            timespec = _timespec()
+            if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec)) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, "clock_gettime failed")
+            return timespec.tv_sec + timespec.tv_nsec * 1e-9
+        monotonic()
+    except (ImportError, OSError, AttributeError, TypeError):
+        monotonic = time.time
+
+# Upper bounds of histogram buckets, in seconds
+BUCKET_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+                 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+class LatencyHistogram(object):
+    """A histogram of durations, in buckets with fixed upper bounds
+
+    >>> histogram = LatencyHistogram()
+    >>> for seconds in (0.003, 0.004, 0.15, 0.4, 7200):
+    ...     histogram.add(seconds)
+    >>> histogram.count, histogram.max
+    (5, 7200)
+    >>> histogram.quantile(0.5)
+    0.2
+    >>> histogram.buckets()
+    [(0.005, 2), (0.2, 1), (0.5, 1), (None, 1)]
+    """
+
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        """Create an empty histogram
+
+        :Parameters:
+            - `bounds`: increasing upper bounds of the buckets (in seconds);
+              longer durations go into an overflow bucket
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        """Count one duration"""
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, fraction):
+        """Return the upper bound of the bucket holding a quantile
+
+        The longest duration counted is returned instead if it is
+        smaller (or if the quantile is in the overflow bucket).
+
+        :Parameters:
+            - `fraction`: the quantile, between 0 and 1
+
+        :Returns:
+            the quantile in seconds, or None if nothing has been counted
+        """
+        if self.count == 0:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return min(bound, self.max)
+        return self.max
+
+    def buckets(self):
+        """Return (upper bound, count) for each bucket with anything in it
+
+        The upper bound of the overflow bucket is None.
+        """
+        return [(bound, count)
+                for bound, count in zip(self.bounds + (None,), self.counts)
+                if count > 0]
+
+    def summary(self):
+        """Return a dictionary summarizing the histogram"""
+        return {'count': self.count,
+                'mean': self.total/self.count if self.count > 0 else None,
+                'max': self.max,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'buckets': self.buckets()}
+
+class CycleMetrics(object):
+    """Time the phases of update cycles
+
+    Call `start_cycle` at the start of each cycle, time each phase
+    with `phase`, and call `end_cycle` when the cycle is done. A phase
+    timed more than once in a cycle counts once, with the total time.
+    Each phase gets a histogram of its timings, as does the cycle as
+    a whole (``cycle``), not counting phases in `idle_phases` (time
+    spent waiting for something to do).
+
+    If a metrics file is given, `end_cycle` writes a summary of the
+    histograms to it, at most once every `dump_interval` seconds.
+
+    >>> clock = iter([0.0, 0.0, 100.0, 100.0, 101.5, 101.5, 101.75, 102.0]).next
+    >>> metrics = CycleMetrics(clock=clock)
+    >>> metrics.start_cycle()
+    >>> with metrics.phase('event_wait'):
+    ...     pass
+    >>> with metrics.phase('settle'):
+    ...     pass
+    >>> with metrics.phase('sv_read'):
+    ...     pass
+    >>> metrics.end_cycle()
+    >>> sorted(metrics.last_cycle.items())
+    [('cycle', 2.0), ('event_wait', 100.0), ('settle', 1.5), ('sv_read', 0.25)]
+    >>> metrics.summary()['phases']['settle']['p50']
+    1.5
+    """
+
+    def __init__(self, fname=None, dump_interval=60.0, idle_phases=('event_wait',),
+                 publisher=None, serializer=None, clock=monotonic):
+        """Start collecting metrics
+
+        :Parameters:
+            - `fname`: the file to write summaries to (optional)
+            - `dump_interval`: the shortest time between writes to `fname` (seconds)
+            - `idle_phases`: phases not counted in the time of the whole cycle
+            - `publisher`: the `Publisher` with which to write `fname`
+            - `serializer`: the `Serializer` with which to format `fname`
+            - `clock`: the function returning the time (defaults to a monotonic clock)
+        """
+        self.fname = fname
+        self.dump_interval = dump_interval
+        self.idle_phases = idle_phases
+        self.publisher = publisher if publisher is not None else Publisher()
+        self.serializer = serializer if serializer is not None else Serializer('pretty')
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.cycles = 0
+        self.current = {}
+        self.cycle_start = None
+        self.last_cycle = {}
+        self.last_dump = None
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase of the current cycle (use as a context manager)"""
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.current[name] = self.current.get(name, 0.0) + (self.clock() - start)
+
+    def add(self, name, seconds):
+        """Add a duration measured some other way to the current cycle"""
+        self.current[name] = self.current.get(name, 0.0) + seconds
+
+    def start_cycle(self):
+        """Start timing a cycle"""
+        self.current = {}
+        self.cycle_start = self.clock()
+
+    def end_cycle(self):
+        """Add the timings of the current cycle to the histograms"""
+        if self.cycle_start is None:
+            return
+        now = self.clock()
+        timings = dict(self.current)
+        idle = sum(timings.get(name, 0.0) for name in self.idle_phases)
+        timings['cycle'] = (now - self.cycle_start) - idle
+        self.cycle_start = None
+
+        with self.lock:
+            for name, seconds in timings.iteritems():
+                if name not in self.histograms:
+                    self.histograms[name] = LatencyHistogram()
+                self.histograms[name].add(seconds)
+            self.cycles += 1
+            self.last_cycle = timings
+
+        if self.fname and (self.last_dump is None
+                           or now - self.last_dump >= self.dump_interval):
+            self.last_dump = now
+            self.dump()
+
+    def summary(self):
+        """Return a dictionary summarizing all histograms"""
+        with self.lock:
+            return {'cycles': self.cycles,
+                    'time': time.time(),
+                    'last_cycle': dict(self.last_cycle),
+                    'phases': dict((name, histogram.summary())
+                                   for name, histogram in self.histograms.iteritems())}
+
+    def report(self):
+        """Return the summary formatted as JSON"""
+        return self.serializer.dumps(self.summary())
+
+    def dump(self, fname=None):
+        """Write the summary to a file
+
+        Failing to write it is logged, not raised, so that it cannot
+        stop the updates being timed.
+
+        :Parameters:
+            - `fname`: the file to write (defaults to the one given when created)
+
+        >>> CycleMetrics().dump('/nonexistent/metrics.json')
+        """
+        fname = fname if fname is not None else self.fname
+        try:
+            self.publisher.publish(fname, self.report())
+        except (IOError, OSError) as e:
+            logger.warning("Could not write cycle metrics to %s (%s)", fname, e)
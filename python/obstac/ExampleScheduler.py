@@ -20,31 +20,28 @@ from collections import OrderedDict
 from argparse import ArgumentParser
 from ConfigParser import ConfigParser
 
-from obstac import Scheduler
+from obstac import Scheduler, install_debugger_signal
 
 class ExampleScheduler(Scheduler):
 
     def make_script(self):
         # This method get called when autoobs is first enabled, and when
         # time the SISPI OCS queue is changed while the autoobs is still
-        # enabled
-        with open(self.queue_fname, 'r') as fp:
-            sispi_queue = json.load(fp)
+        # enabled. Scheduler has already loaded the queue files.
+        sispi_queue = self.queue if self.queue is not None else []
+        in_progress = self.in_progress
 
         logging.debug("Found %d exposure(s) on the SISPI/OCS queue." % len(sispi_queue))
-            
-        with open(self.in_progress_fname, 'r') as fp:
-            in_progress = json.load(fp)
+        logging.debug("%d exposure(s) added and %d removed since the previous queue."
+                      % (len(self.queue_diff.added), len(self.queue_diff.removed)))
 
         # If we don't want to add anything, return an empty list
-        if len(sispi_queue) >= self.min_queue_len:
-            logging.info("Queue is already %d exposures long, not adding anything"
-                         % len(sispi_queue))
-            # Add an empty script so autoobs knows the scheduler "passed"
-            with open(self.output_fname, 'w') as fp:
-                json.dump([], fp, indent=4)
-            os.chmod(self.output_fname, 0o666)
-            return
+        queue_time = self.queue_empty_time() - time.time()
+        if queue_time >= self.min_queue_time:
+            logging.info("Queue already has %d exposures, lasting %d seconds; not adding anything"
+                         % (len(sispi_queue), queue_time))
+            # Return an empty script so autoobs knows the scheduler "passed"
+            return []
 
         try:
             self.expid += 1
@@ -73,20 +70,19 @@ class ExampleScheduler(Scheduler):
         # In this case, it is a list of just one exposure, but
         # it can be any number.
         exposures = [exposure]
-        
-        with open(self.output_fname, 'w') as fp:
-            logging.info("Sending %d exposure(s) to the SISPI/OCS queue." % len(exposures))
-            json.dump(exposures, fp, indent=4)
-        os.chmod(self.output_fname, 0o666)
+
+        logging.info("Sending %d exposure(s) to the SISPI/OCS queue." % len(exposures))
+        return exposures
 
             
 if __name__ == "__main__":
     logging.basicConfig(format='%(asctime)s %(message)s',
                         level=logging.DEBUG)
+    install_debugger_signal()
 
     parser = ArgumentParser('Simple sample scheduler')
     parser.add_argument("config", help="the configuration file")
     args = parser.parse_args()
     scheduler = ExampleScheduler(args.config)
-    scheduler.min_queue_len = 5
+    scheduler.min_queue_time = 600
     scheduler()
@@ -0,0 +1,312 @@
+"""A compact, columnar representation of a SISPI exposure queue
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import json
+from numbers import Integral, Real
+from collections import OrderedDict
+
+import numpy
+
+from obstac.Instrument import Coords, unit_vectors
+
+# Exposure keys kept in numpy columns. Any other keys (and values of
+# unexpected types) are kept as they are, so scripts round-trip exactly.
+STRING_COLUMNS = ('expType', 'filter', 'program')
+NUMERIC_COLUMNS = ('exptime', 'count', 'RA', 'dec')
+
+EXPOSURE_DTYPE = numpy.dtype([('expType', 'i4'), ('filter', 'i4'), ('program', 'i4'),
+                              ('exptime', 'f8'), ('count', 'f8'),
+                              ('RA', 'f8'), ('dec', 'f8'),
+                              ('layout', 'i4')])
+
+# Values used for exposures without a given key
+MISSING = {'expType': -1, 'filter': -1, 'program': -1,
+           'exptime': 0.0, 'count': 1.0, 'RA': numpy.nan, 'dec': numpy.nan}
+
+class InternTable(object):
+    """Map values to small integer codes, and back
+
+    >>> table = InternTable()
+    >>> table.code('g'), table.code('r'), table.code('g')
+    (0, 1, 0)
+    >>> table[1]
+    'r'
+    >>> print table.find('i')
+    None
+    """
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        """Return the code for a value, assigning a new one if needed"""
+        try:
+            return self.codes[value]
+        except KeyError:
+            code = len(self.values)
+            self.values.append(value)
+            self.codes[value] = code
+            return code
+
+    def find(self, value):
+        """Return the code for a value, or None if it has none"""
+        return self.codes.get(value)
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+# Shared by all queues, so codes can be compared between them
+strings = InternTable()
+layouts = InternTable()
+
+def _kind(key, value):
+    """Return how a value is stored: 's' (string column), 'i' or 'f'
+    (numeric column, int or float), or 'x' (kept as it is)"""
+    if key in STRING_COLUMNS:
+        if isinstance(value, basestring):
+            return 's'
+    elif key in NUMERIC_COLUMNS and not isinstance(value, bool):
+        if isinstance(value, Integral):
+            return 'i'
+        if isinstance(value, Real):
+            return 'f'
+    return 'x'
+
+class ExposureQueue(object):
+    """A SISPI exposure queue, held in numpy structured arrays
+
+    The exposure type, filter, program, exposure time, count and
+    pointing of each exposure are kept in `rows`, a numpy structured
+    array, with strings replaced by codes in a table shared by all
+    queues. `to_script` returns the exposures exactly as they were
+    given, ready to be written out for ocs('loadq', ...).
+
+    >>> script = [
+    ...     {'expType': 'object', 'object': 'a', 'exptime': 90, 'count': 1,
+    ...      'filter': 'g', 'program': 'survey', 'RA': 12.0, 'dec': -3.0},
+    ...     {'expType': 'object', 'object': 'b', 'exptime': 90, 'count': 2,
+    ...      'filter': 'r', 'program': 'survey', 'RA': 40.0, 'dec': 0.0},
+    ...     {'expType': 'dark', 'exptime': 30.5, 'count': 1}]
+    >>> queue = ExposureQueue(script)
+    >>> len(queue)
+    3
+    >>> queue.to_script() == script
+    True
+    >>> queue.rows['exptime'].tolist()
+    [90.0, 90.0, 30.5]
+    >>> sorted(queue.filter_counts().items())
+    [('g', 1), ('r', 2)]
+    >>> queue.last_pointing()
+    Coords(RA=40.0, dec=0.0)
+    >>> queue.mask('program', 'survey').tolist()
+    [True, True, False]
+    >>> print queue[1:].to_script()[0]['object']
+    b
+    """
+
+    def __init__(self, script=()):
+        """Load a queue
+
+        :Parameters:
+            - `script`: a list of exposures (dictionaries), as found in
+              SISPI script files and the OCS EXPOSUREQUEUE shared variable
+        """
+        num_exposures = len(script)
+        columns = dict((key, [MISSING[key]]*num_exposures)
+                       for key in STRING_COLUMNS + NUMERIC_COLUMNS)
+        layout_codes = [0]*num_exposures
+        self.extras = [None]*num_exposures
+
+        for i, exposure in enumerate(script):
+            layout = []
+            for key, value in exposure.iteritems():
+                kind = _kind(key, value)
+                layout.append((key, kind))
+                if kind == 's':
+                    columns[key][i] = strings.code(value)
+                elif kind == 'x':
+                    if self.extras[i] is None:
+                        self.extras[i] = {}
+                    self.extras[i][key] = value
+                else:
+                    columns[key][i] = value
+            layout_codes[i] = layouts.code(tuple(layout))
+
+        self.rows = numpy.empty(num_exposures, dtype=EXPOSURE_DTYPE)
+        for key, values in columns.iteritems():
+            self.rows[key] = values
+        self.rows['layout'] = layout_codes
+
+    @classmethod
+    def from_file(cls, fname):
+        """Load a queue from a JSON file, such as those autoobs writes
+
+        :Parameters:
+            - `fname`: the name of the file
+        """
+        with open(fname, 'r') as fp:
+            return cls(json.load(fp))
+
+    @classmethod
+    def from_rows(cls, rows, extras):
+        """Make a queue from rows and extras already in queue form"""
+        queue = cls()
+        queue.rows = rows
+        queue.extras = extras
+        return queue
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        """Return an exposure (for an integer index) or a queue (for a slice)"""
+        if isinstance(index, slice):
+            return self.from_rows(self.rows[index], self.extras[index])
+        return self.exposure(index)
+
+    def exposure(self, index):
+        """Return one exposure, as it was given"""
+        row = self.rows[index]
+        extras = self.extras[index]
+        exposure = OrderedDict()
+        for key, kind in layouts[row['layout']]:
+            if kind == 's':
+                exposure[key] = strings[row[key]]
+            elif kind == 'i':
+                exposure[key] = int(row[key])
+            elif kind == 'f':
+                exposure[key] = float(row[key])
+            else:
+                exposure[key] = extras[key]
+        return exposure
+
+    def to_script(self):
+        """Return the exposures, as they were given
+
+        :Returns:
+            a list of exposures (ordered dictionaries), which can be
+            dumped as JSON into a SISPI script
+        """
+        columns = dict((key, self.rows[key].tolist())
+                       for key in STRING_COLUMNS + NUMERIC_COLUMNS)
+        script = []
+        for i, layout_code in enumerate(self.rows['layout'].tolist()):
+            exposure = OrderedDict()
+            for key, kind in layouts[layout_code]:
+                if kind == 's':
+                    exposure[key] = strings[columns[key][i]]
+                elif kind == 'i':
+                    exposure[key] = int(columns[key][i])
+                elif kind == 'f':
+                    exposure[key] = columns[key][i]
+                else:
+                    exposure[key] = self.extras[i][key]
+            script.append(exposure)
+        return script
+
+    def mask(self, column, value):
+        """Find exposures with a given value in a string column
+
+        :Parameters:
+            - `column`: one of `STRING_COLUMNS`
+            - `value`: the value to look for
+
+        :Returns:
+            a boolean array, True for exposures with the value
+        """
+        code = strings.find(value)
+        if code is None:
+            return numpy.zeros(len(self), dtype=bool)
+        return self.rows[column] == code
+
+    @property
+    def has_pointing(self):
+        """A boolean array, True for exposures with an RA and declination"""
+        return numpy.isfinite(self.rows['RA']) & numpy.isfinite(self.rows['dec'])
+
+    def slew_times(self, instrument):
+        """Calculate the time to slew to each exposure
+
+        The telescope starts where the instrument is pointed, and
+        stays put for exposures without a pointing (such as darks).
+
+        :Parameters:
+            - `instrument`: an `Instrument`, with its coordinates set
+
+        :Returns:
+            an array with the time to slew before each exposure, in seconds
+        """
+        slew = numpy.zeros(len(self), dtype=int)
+        pointed = numpy.flatnonzero(self.has_pointing)
+        if len(pointed) == 0:
+            return slew
+
+        vectors = unit_vectors(self.rows['RA'][pointed], self.rows['dec'][pointed])
+        start_vectors = numpy.empty_like(vectors)
+        start_vectors[0] = instrument.unit_vector
+        start_vectors[1:] = vectors[:-1]
+        slew[pointed] = instrument.slew_times_between(start_vectors, vectors)
+        return slew
+
+    def durations(self, instrument):
+        """Calculate the duration of each exposure, as `Instrument.obs_duration` does
+
+        :Parameters:
+            - `instrument`: an `Instrument`, with its coordinates set
+
+        :Returns:
+            an array with the duration of each exposure, in seconds
+
+        >>> from obstac.Instrument import Instrument
+        >>> instrument = Instrument((12.0, 0.0))
+        >>> queue = ExposureQueue([
+        ...     {'expType': 'object', 'exptime': 120, 'RA': 12, 'dec': -3},
+        ...     {'expType': 'object', 'exptime': 90, 'count': 2, 'RA': 40, 'dec': 0},
+        ...     {'expType': 'dark', 'exptime': 30}])
+        >>> queue.durations(instrument).tolist()
+        [148.0, 300.0, 56.0]
+        >>> queue.total_duration(instrument)
+        504.0
+        """
+        return instrument.obs_durations_from_slew_times(self.slew_times(instrument),
+                                                        self.rows['exptime'],
+                                                        self.rows['count'])
+
+    def total_duration(self, instrument):
+        """Calculate the time to take every exposure in the queue
+
+        :Parameters:
+            - `instrument`: an `Instrument`, with its coordinates set
+
+        :Returns:
+            the total duration, in seconds
+        """
+        return float(self.durations(instrument).sum())
+
+    def filter_counts(self):
+        """Count the exposures (including repeats) in each filter
+
+        :Returns:
+            a dictionary with the number of exposures in each filter
+        """
+        codes = self.rows['filter']
+        known = codes >= 0
+        totals = numpy.bincount(codes[known], weights=self.rows['count'][known])
+        return dict((strings[code], int(totals[code]))
+                    for code in numpy.flatnonzero(totals))
+
+    def last_pointing(self):
+        """Return the pointing of the last exposure with one
+
+        :Returns:
+            the `Coords` of the last pointed exposure, or None if there are none
+        """
+        pointed = numpy.flatnonzero(self.has_pointing)
+        if len(pointed) == 0:
+            return None
+        row = self.rows[pointed[-1]]
+        return Coords(float(row['RA']), float(row['dec']))
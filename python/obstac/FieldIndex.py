@@ -0,0 +1,172 @@
+"""Spatial index of candidate fields, for finding the fields cheapest to slew to
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+from math import radians, sin
+
+import numpy
+
+from obstac.Instrument import Instrument, unit_vectors
+
+def chord_length(angle):
+    """Return the length of the chord between unit vectors separated by an angle
+
+    :Parameters:
+        - `angle`: the angle between the vectors (degrees)
+
+    :Returns:
+        the length of the chord
+
+    >>> print "%3.1f" % chord_length(60)
+    1.0
+    """
+    return 2.0*sin(radians(min(angle, 180.0))/2.0)
+
+class FieldIndex(object):
+    """Spatial index of candidate fields, for finding the fields cheapest to slew to
+
+    Fields are binned by their Cartesian unit vectors into cubic cells,
+    so that a query need only look at fields in cells near the current
+    pointing. Because slew time never decreases with distance, fields
+    returned in order of distance are also in order of slew time.
+
+    >>> ra = [30.0, 31.0, 33.0, 40.0, 200.0]
+    >>> dec = [-45.0, -45.0, -44.0, -45.0, 10.0]
+    >>> fields = FieldIndex(ra, dec)
+    >>> telescope = Instrument((30.0, -45.0))
+    >>> indexes, slew_times = fields.within(telescope)
+    >>> print indexes.tolist(), slew_times.tolist()
+    [0, 1, 2] [23, 24, 27]
+    >>> print fields.nearest(telescope, 4)[0].tolist()
+    [0, 1, 2, 3]
+    >>> fields.remove(0)
+    >>> print fields.nearest(telescope, 2)[0].tolist()
+    [1, 2]
+    """
+
+    def __init__(self, ra, dec, cell_size=None):
+        """Index a list of fields
+
+        :Parameters:
+            - `ra`: an array of field RAs (degrees)
+            - `dec`: an array of field declinations (degrees)
+            - `cell_size`: the edge of an index cell, in unit vector
+              coordinates (defaults to the chord of the longest short slew)
+        """
+        self.cell_size = chord_length(Instrument.longest_short_slew) \
+            if cell_size is None else cell_size
+        self.vectors = numpy.empty((0, 3), dtype=float)
+        self.active = numpy.empty(0, dtype=bool)
+        self.cells = {}
+        self.add_fields(ra, dec)
+
+    def __len__(self):
+        return int(self.active.sum())
+
+    def _cell(self, vector):
+        return tuple(numpy.floor((vector + 1.0)/self.cell_size).astype(int))
+
+    def add_fields(self, ra, dec):
+        """Add fields to the index
+
+        :Parameters:
+            - `ra`: an array of field RAs (degrees)
+            - `dec`: an array of field declinations (degrees)
+
+        :Returns:
+            an array with the indexes of the new fields
+        """
+        new_vectors = unit_vectors(ra, dec).reshape(-1, 3)
+        first = len(self.vectors)
+        self.vectors = numpy.concatenate((self.vectors, new_vectors))
+        self.active = numpy.concatenate(
+            (self.active, numpy.zeros(len(new_vectors), dtype=bool)))
+        indexes = numpy.arange(first, len(self.vectors))
+        for index in indexes:
+            self.restore(index)
+        return indexes
+
+    def remove(self, index):
+        """Remove a field (for example, one that has been completed) from the index
+
+        :Parameters:
+            - `index`: the index of the field
+        """
+        if self.active[index]:
+            self.cells[self._cell(self.vectors[index])].discard(index)
+            self.active[index] = False
+
+    def restore(self, index):
+        """Return a removed field to the index
+
+        :Parameters:
+            - `index`: the index of the field
+        """
+        if not self.active[index]:
+            self.cells.setdefault(self._cell(self.vectors[index]), set()).add(index)
+            self.active[index] = True
+
+    def _candidates(self, center, chord):
+        if chord >= 2.0:
+            return numpy.flatnonzero(self.active)
+
+        low = numpy.floor((center - chord + 1.0)/self.cell_size).astype(int)
+        high = numpy.floor((center + chord + 1.0)/self.cell_size).astype(int)
+        candidates = []
+        for i in range(low[0], high[0]+1):
+            for j in range(low[1], high[1]+1):
+                for k in range(low[2], high[2]+1):
+                    cell = self.cells.get((i, j, k))
+                    if cell:
+                        candidates.extend(cell)
+        return numpy.array(candidates, dtype=int)
+
+    def _sorted_within(self, instrument, radius):
+        center = numpy.array(instrument.unit_vector)
+        chord = chord_length(radius)
+        indexes = self._candidates(center, chord)
+        offsets = self.vectors[indexes] - center
+        chord2 = (offsets*offsets).sum(axis=1)
+        keep = chord2 <= chord*chord
+        indexes, chord2 = indexes[keep], chord2[keep]
+        slew_times = instrument.slew_times_from_unit_vectors(self.vectors[indexes])
+        order = numpy.lexsort((indexes, chord2, slew_times))
+        return indexes[order], slew_times[order]
+
+    def within(self, instrument, radius=None):
+        """Find the fields within a given distance of the current pointing
+
+        :Parameters:
+            - `instrument`: the `Instrument`, pointed at the current position
+            - `radius`: the largest distance to include (degrees);
+              defaults to the instrument's longest short slew
+
+        :Returns:
+            a tuple of arrays with the indexes of the fields and the
+            times to slew to them, in order of increasing slew time
+        """
+        if radius is None:
+            radius = instrument.longest_short_slew
+        return self._sorted_within(instrument, radius)
+
+    def nearest(self, instrument, count):
+        """Find the fields cheapest to slew to from the current pointing
+
+        :Parameters:
+            - `instrument`: the `Instrument`, pointed at the current position
+            - `count`: the number of fields to return
+
+        :Returns:
+            a tuple of arrays with the indexes of the fields and the
+            times to slew to them, in order of increasing slew time
+        """
+        radius = instrument.longest_short_slew
+        while True:
+            indexes, slew_times = self._sorted_within(instrument, radius)
+            # Everything closer than the radius has been found, so if we
+            # have enough, they are the closest.
+            if len(indexes) >= count or radius >= 180.0:
+                return indexes[:count], slew_times[:count]
+            radius *= 2.0
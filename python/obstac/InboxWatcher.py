@@ -0,0 +1,152 @@
+"""Wait for a scheduler to deliver a script into the obstac inbox
+
+On Linux, the watcher uses inotify (through ctypes) to wake as soon as
+a file is closed after writing or renamed into the inbox directory.
+Elsewhere, or if inotify cannot be set up, it falls back to polling
+the inbox with a short interval.
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import errno
+import select
+import time
+import ctypes
+import ctypes.util
+
+from obstac.debug import debug
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# File systems take modification times from a coarse kernel clock,
+# which can lag time.time() by up to a clock tick
+MTIME_RESOLUTION = 0.02
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+class InboxWatcher(object):
+    """Wait for a scheduler to deliver a script into the obstac inbox
+
+    >>> import shutil, tempfile
+    >>> inbox_dir = tempfile.mkdtemp()
+    >>> watcher = InboxWatcher(os.path.join(inbox_dir, 'queue.json'))
+    >>> start_time = time.time()
+    >>> watcher.wait(start_time, 0.1)
+    False
+    >>> with open(watcher.fname, 'w') as fp:
+    ...     fp.write('[]')
+    >>> watcher.wait(start_time, 0.1)
+    True
+    >>> watcher.close()
+    >>> shutil.rmtree(inbox_dir)
+    """
+
+    def __init__(self, fname, poll_interval=0.05):
+        """Start watching for an inbox file
+
+        :Parameters:
+            - `fname`: the path of the inbox file
+            - `poll_interval`: seconds between checks when inotify is not available
+        """
+        self.fname = fname
+        self.poll_interval = poll_interval
+        self.fd = None
+        if _libc is not None:
+            self._start_inotify()
+
+    @property
+    def mode(self):
+        """The method used to watch for the inbox file: 'inotify' or 'poll'"""
+        return 'poll' if self.fd is None else 'inotify'
+
+    def _start_inotify(self):
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            debug("Could not initialize inotify, errno %d", ctypes.get_errno())
+            return
+
+        dirname = os.path.dirname(os.path.abspath(self.fname))
+        watch = _libc.inotify_add_watch(fd, dirname.encode(),
+                                        IN_CLOSE_WRITE | IN_MOVED_TO)
+        if watch < 0:
+            debug("Could not watch %s with inotify, errno %d", dirname, ctypes.get_errno())
+            os.close(fd)
+            return
+
+        self.fd = fd
+
+    def _drain(self):
+        # We only care that something happened in the directory, not
+        # what it was, so just empty the queue of events.
+        while True:
+            try:
+                if len(os.read(self.fd, 4096)) == 0:
+                    break
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+
+    def is_fresh(self, start_time):
+        """Check whether there is a script in the inbox not older than start_time
+
+        :Parameters:
+            - `start_time`: the time (as from time.time()) of the trigger
+        """
+        try:
+            return start_time - MTIME_RESOLUTION <= os.path.getmtime(self.fname)
+        except OSError:
+            return False
+
+    def wait(self, start_time, timeout):
+        """Wait for a scheduler to deliver a script not older than start_time
+
+        :Parameters:
+            - `start_time`: the time (as from time.time()) of the trigger
+            - `timeout`: the number of seconds after start_time to give up
+
+        :Returns:
+            True if a fresh script is in the inbox, False if we timed out
+        """
+        deadline = start_time + timeout
+        while True:
+            if self.is_fresh(start_time):
+                return True
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            if self.fd is None:
+                time.sleep(min(self.poll_interval, remaining))
+                continue
+
+            try:
+                readable = select.select([self.fd], [], [], remaining)[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if readable:
+                self._drain()
+
+    def close(self):
+        """Stop watching the inbox"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -6,17 +6,43 @@
 __docformat__ = "restructuredtext en"
 
 from math import *
+import numpy
 from ConfigParser import NoOptionError, NoSectionError
 from collections import namedtuple
 
 Coords = namedtuple('Coords',['RA','dec'])
 HourAngleLimit = namedtuple('HourAngleLimit',['dec','east','west','window'])
 
+def unit_vectors(ra, dec):
+    """Calculate Cartesian unit vectors for locations on the sky
+
+    Catalogs can calculate these once and pass them to
+    `Instrument.slew_times_from_unit_vectors` many times.
+
+    :Parameters:
+        - `ra`: an array of RAs (degrees)
+        - `dec`: an array of declinations (degrees)
+
+    :Returns:
+        an array of shape (N, 3) with the unit vectors
+
+    >>> print unit_vectors([0, 90], [0, 0]).round(6).tolist()
+    [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]
+    """
+    ra = numpy.radians(numpy.asarray(ra, dtype=float))
+    dec = numpy.radians(numpy.asarray(dec, dtype=float))
+    cos_dec = numpy.cos(dec)
+    return numpy.column_stack((numpy.cos(ra)*cos_dec,
+                               numpy.sin(ra)*cos_dec,
+                               numpy.sin(dec)))
+
 class Instrument(object): 
     """Model the instrument (telescope and camera)
 
     """
 
+    __slots__ = ('ra', 'dec', 'unit_vector')
+
     longitude = -70.815
     latitude = -30.16527778
     readout_time = 26
@@ -63,6 +89,10 @@ class Instrument(object):
         ra, dec = coords
         self.ra = radians(ra)
         self.dec = radians(dec)
+        # Every slew starts here, so only work this out when we move
+        self.unit_vector = (cos(self.ra)*cos(self.dec),
+                            sin(self.ra)*cos(self.dec),
+                            sin(self.dec))
 
 
     def slew_time(self, ra, dec):
@@ -90,9 +120,7 @@ class Instrument(object):
         dec = radians(dec)
 
         # Following slatec
-        v1 = (cos(self.ra)*cos(self.dec),
-              sin(self.ra)*cos(self.dec),
-              sin(self.dec))
+        v1 = self.unit_vector
         v2 = (cos(ra)*cos(dec),
               sin(ra)*cos(dec),
               sin(dec))
@@ -113,6 +141,88 @@ class Instrument(object):
 
         return t
 
+    def slew_times(self, ra, dec):
+        """Calculate the times to slew to many locations on the sky at once
+
+        This gives the same results as calling `slew_time` on each
+        location in turn, but does the work with numpy arrays.
+
+        :Parameters:
+            - `ra`: an array of destination RAs
+            - `dec`: an array of destination declinations
+
+        :Returns:
+            an array with the time to slew to each location, in seconds
+
+        >>> t = Instrument()
+        >>> t.coords = 30,-45
+        >>> t.slew_times([30, 120, 30], [-44, -45, -30])
+        array([ 25, 164,  65])
+        >>> [t.slew_time(30, -44), t.slew_time(120, -45), t.slew_time(30, -30)]
+        [25, 164, 65]
+        """
+        return self.slew_times_from_unit_vectors(unit_vectors(ra, dec))
+
+    def slew_times_from_unit_vectors(self, vectors):
+        """Calculate the times to slew to many locations given as unit vectors
+
+        :Parameters:
+            - `vectors`: an array of shape (N, 3) with Cartesian unit
+              vectors of the destinations, as returned by `unit_vectors`
+
+        :Returns:
+            an array with the time to slew to each location, in seconds
+
+        >>> t = Instrument()
+        >>> t.coords = 30,-45
+        >>> fields = unit_vectors([30, 120, 30], [-44, -45, -30])
+        >>> t.slew_times_from_unit_vectors(fields)
+        array([ 25, 164,  65])
+        """
+        return self.slew_times_between(self.unit_vector, vectors)
+
+    def slew_times_between(self, start_vectors, vectors):
+        """Calculate the times to slew between many pairs of locations
+
+        :Parameters:
+            - `start_vectors`: an array of shape (N, 3) (or a single
+              vector) with Cartesian unit vectors of the starting locations
+            - `vectors`: an array of shape (N, 3) with Cartesian unit
+              vectors of the destinations
+
+        :Returns:
+            an array with the time to slew from each start to its
+            destination, in seconds
+
+        >>> t = Instrument()
+        >>> starts = unit_vectors([30, 30, 120], [-45, -44, -45])
+        >>> ends = unit_vectors([30, 120, 30], [-44, -45, -30])
+        >>> t.slew_times_between(starts, ends)
+        array([ 25, 165, 185])
+        """
+        start_vectors = numpy.asarray(start_vectors, dtype=float)
+        vectors = numpy.asarray(vectors, dtype=float)
+
+        # Following slatec, with the same order of operations as slew_time
+        dx = start_vectors[..., 0] - vectors[:, 0]
+        dy = start_vectors[..., 1] - vectors[:, 1]
+        dz = start_vectors[..., 2] - vectors[:, 2]
+        s2 = dx*dx
+        s2 += dy*dy
+        s2 += dz*dz
+        s2 /= 4.0
+        c2 = 1.0-s2
+        angle = numpy.degrees(2.0 * numpy.arctan2(numpy.sqrt(s2),
+                                                  numpy.sqrt(numpy.maximum(0.0, c2))))
+
+        # Using fit to Feb 2013 data
+        t = numpy.where(angle > self.longest_short_slew,
+                        self.long_slew_zp + angle*self.long_slew_slope,
+                        self.short_slew_zp + angle*self.short_slew_slope)
+
+        # round half away from zero, as the builtin round does
+        return numpy.floor(t + 0.5).astype(int)
+
     def obs_duration(self, ra, dec, exposure_time, repetitions = 1):
         """Calculate the duration of an exposure
 
@@ -159,3 +269,61 @@ class Instrument(object):
 
         return duration
 
+    def obs_durations(self, ra, dec, exposure_time, repetitions = 1):
+        """Calculate the durations of many exposures at once
+
+        This gives the same results as calling `obs_duration` on each
+        exposure in turn, but does the work with numpy arrays.
+
+        :Parameters:
+            - `ra`: an array of RAs of the observations
+            - `dec`: an array of Declinations of the observations
+            - `exposure_time`: the exposure time (per exposure) (in seconds),
+              either a scalar or an array
+            - `repetitions`: number of exposures (defualts to 1), either a
+              scalar or an array
+
+        :Returns:
+            an array with the duration of each exposure, in seconds
+
+        >>> a = Instrument()
+        >>> a.coords = 12.0, 0.0
+        >>> a.obs_durations([12, 40], [-3, 0], [120, 90], [1, 2])
+        array([148, 300])
+        >>> [a.obs_duration(12, -3, 120, 1), a.obs_duration(40, 0, 90, 2)]
+        [148, 300]
+        """
+        return self.obs_durations_from_slew_times(self.slew_times(ra, dec),
+                                                  exposure_time, repetitions)
+
+    def obs_durations_from_slew_times(self, slew, exposure_time, repetitions = 1):
+        """Calculate the durations of many exposures, given their slew times
+
+        :Parameters:
+            - `slew`: an array with the time to slew to each observation
+            - `exposure_time`: the exposure time (per exposure) (in seconds),
+              either a scalar or an array
+            - `repetitions`: number of exposures (defualts to 1), either a
+              scalar or an array
+
+        :Returns:
+            an array with the duration of each exposure, in seconds
+
+        >>> a = Instrument()
+        >>> a.obs_durations_from_slew_times([0, 40], [120, 90], [1, 2])
+        array([146, 246])
+        """
+        slew = numpy.asarray(slew)
+        exposure_time = numpy.asarray(exposure_time)
+        repetitions = numpy.asarray(repetitions)
+        if self.serial:
+            duration = slew \
+                + repetitions*(exposure_time+self.readout_time) \
+                + self.overhead
+        else:
+            duration = numpy.maximum(slew, self.readout_time) \
+                + (repetitions-1)*self.readout_time \
+                + repetitions*exposure_time \
+                + self.overhead
+
+        return duration
@@ -0,0 +1,144 @@
+"""Publish files atomically, so readers never see them partly written
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import errno
+from tempfile import mkstemp
+from collections import namedtuple
+
+# A file to publish: its name, contents, and (optionally) the name to
+# keep its previous contents under
+Publication = namedtuple('Publication', ['fname', 'data', 'previous_fname'])
+
+def fsync_directory(dirname):
+    """Flush a directory, so renames in it survive a crash"""
+    fd = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class Publisher(object):
+    """Publish files atomically, so readers never see them partly written
+
+    Each file is written into a temporary file in the same directory
+    through a single file descriptor, and renamed into place. When the
+    previous contents are kept, they are moved aside with a hard link,
+    so both the file and its previous version always exist.
+
+    >>> import shutil, tempfile
+    >>> queue_dir = tempfile.mkdtemp()
+    >>> current = os.path.join(queue_dir, 'current.json')
+    >>> previous = os.path.join(queue_dir, 'previous.json')
+    >>> in_progress = os.path.join(queue_dir, 'inprogress.json')
+    >>> publisher = Publisher(fsync=True)
+    >>> publisher.publish(current, '[1]', previous)
+    >>> publisher.publish_generation([Publication(current, '[2]', previous),
+    ...                               Publication(in_progress, '[]', None)])
+    >>> [open(f).read() for f in (current, previous, in_progress)]
+    ['[2]', '[1]', '[]']
+    >>> sorted(os.listdir(queue_dir))
+    ['current.json', 'inprogress.json', 'previous.json']
+    >>> oct(os.stat(current).st_mode & 0o777)
+    '0666'
+    >>> shutil.rmtree(queue_dir)
+    """
+
+    def __init__(self, fsync=False, mode=0o666):
+        """Choose how to publish files
+
+        :Parameters:
+            - `fsync`: flush each file, and the directories it is
+              renamed in, to disk before returning (defaults to False)
+            - `mode`: the permissions to give published files
+              (defaults to 0666, so other accounts can replace them)
+        """
+        self.fsync = fsync
+        self.mode = mode
+
+    def _write_temp(self, fname, data):
+        dirname, basename = os.path.split(fname)
+        fd, temp_fname = mkstemp(dir=dirname or '.', prefix='.%s.' % basename)
+        try:
+            os.fchmod(fd, self.mode)
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            written = 0
+            while written < len(data):
+                written += os.write(fd, buffer(data, written))
+            if self.fsync:
+                os.fsync(fd)
+        except:
+            os.close(fd)
+            os.remove(temp_fname)
+            raise
+        os.close(fd)
+        return temp_fname
+
+    def _keep_previous(self, fname, previous_fname):
+        link_fname = '%s.%d.link' % (previous_fname, os.getpid())
+        try:
+            os.link(fname, link_fname)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                # Nothing published yet
+                return
+            if e.errno != errno.EEXIST:
+                # No hard links here (perhaps a different file system),
+                # so fall back on moving the file
+                os.rename(fname, previous_fname)
+                return
+            os.remove(link_fname)
+            os.link(fname, link_fname)
+
+        os.rename(link_fname, previous_fname)
+        try:
+            # Only still there if previous_fname was already this file
+            os.remove(link_fname)
+        except OSError:
+            pass
+
+    def publish_generation(self, publications):
+        """Publish several files together
+
+        All files are written before any is renamed into place, so
+        they are published within the time it takes to do the renames,
+        and if any write fails none of the files are replaced.
+
+        :Parameters:
+            - `publications`: a list of `Publication` tuples
+        """
+        temp_fnames = []
+        try:
+            for publication in publications:
+                temp_fnames.append(self._write_temp(publication.fname, publication.data))
+        except:
+            for temp_fname in temp_fnames:
+                os.remove(temp_fname)
+            raise
+
+        dirnames = set()
+        for publication, temp_fname in zip(publications, temp_fnames):
+            if publication.previous_fname is not None:
+                self._keep_previous(publication.fname, publication.previous_fname)
+                dirnames.add(os.path.dirname(publication.previous_fname) or '.')
+            os.rename(temp_fname, publication.fname)
+            dirnames.add(os.path.dirname(publication.fname) or '.')
+
+        if self.fsync:
+            for dirname in dirnames:
+                fsync_directory(dirname)
+
+    def publish(self, fname, data, previous_fname=None):
+        """Publish a file
+
+        :Parameters:
+            - `fname`: the name of the file
+            - `data`: the new contents of the file (a string)
+            - `previous_fname`: a name to keep the old contents under
+              (optional; by default the old contents are discarded)
+        """
+        self.publish_generation([Publication(fname, data, previous_fname)])
@@ -0,0 +1,179 @@
+"""Estimate when the SISPI exposure queue will run dry
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import copy
+import time
+from collections import deque, namedtuple
+
+from obstac.SnapshotLoader import exposure_key
+
+# One queued exposure: where the telescope starts and ends up, and how
+# long the exposure takes (including the slew to it)
+QueueEntry = namedtuple('QueueEntry', ['key', 'start', 'end', 'duration'])
+
+def exposure_pointing(exposure):
+    """Return the pointing of an exposure
+
+    :Returns:
+        a tuple with the RA and declination, or None if the exposure
+        does not have one (such as a dark)
+    """
+    try:
+        return float(exposure['RA']), float(exposure['dec'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+class QueueEstimator(object):
+    """Estimate when the SISPI exposure queue will run dry
+
+    Durations are chained through the queue, with each exposure
+    starting where the one before it left the telescope. As exposures
+    are taken from the front of the queue and new ones are appended,
+    only the durations that change are worked out again.
+
+    >>> estimator = QueueEstimator()
+    >>> queue = [{'expType': 'object', 'exptime': 90, 'RA': 12, 'dec': -3},
+    ...          {'expType': 'object', 'exptime': 90, 'RA': 40, 'dec': 0},
+    ...          {'expType': 'dark', 'exptime': 30}]
+    >>> estimator.update(queue[1:], in_progress=queue[0], now=1000)
+    1356.0
+    >>> estimator.computed
+    3
+    >>> estimator.update(queue[1:] + queue[:1], in_progress=queue[0], now=1100)
+    1540.0
+    >>> estimator.computed
+    4
+    >>> estimator.update(queue[2:] + queue[:1], in_progress=queue[1], now=1200)
+    1556.0
+    >>> estimator.computed
+    5
+    """
+
+    def __init__(self, instrument=None):
+        """Start with an empty queue
+
+        :Parameters:
+            - `instrument`: the `Instrument` whose slew and readout model
+              is used (optional; defaults to a plain `Instrument`)
+        """
+        if instrument is None:
+            # Instrument needs numpy, so only import it if it is needed
+            from obstac.Instrument import Instrument
+            instrument = Instrument()
+        self.instrument = copy.copy(instrument)
+        self.entries = deque()
+        self.queue_duration = 0.0
+        self.last_pointing = None
+        self.in_progress_key = None
+        self.in_progress_end = None
+        self.computed = 0
+
+    def duration(self, exposure, start):
+        """Calculate the duration of an exposure, as `Instrument.obs_duration` does
+
+        :Parameters:
+            - `exposure`: the exposure (a dictionary in SISPI script format)
+            - `start`: the (RA, dec) the telescope starts at, or None if
+              the slew should not be counted
+
+        :Returns:
+            the duration, in seconds
+        """
+        self.computed += 1
+        exposure_time = float(exposure.get('exptime', 0))
+        repetitions = int(exposure.get('count', 1))
+        target = exposure_pointing(exposure)
+        if start is None or target is None:
+            duration = self.instrument.obs_durations_from_slew_times(0, exposure_time,
+                                                                     repetitions)
+        else:
+            self.instrument.coords = start
+            duration = self.instrument.obs_duration(target[0], target[1],
+                                                    exposure_time, repetitions)
+        return float(duration)
+
+    def _entry(self, key, exposure, start):
+        end = exposure_pointing(exposure)
+        return QueueEntry(key, start, start if end is None else end,
+                          self.duration(exposure, start))
+
+    def _update_in_progress(self, in_progress, now):
+        if isinstance(in_progress, list):
+            in_progress = in_progress[-1] if len(in_progress) > 0 else None
+        if not in_progress:
+            self.in_progress_key = None
+            self.in_progress_end = None
+            return
+
+        key = exposure_key(in_progress)
+        if key == self.in_progress_key:
+            return
+
+        # The slew is already done once an exposure is in progress, and
+        # we assume it started when we first saw it
+        self.in_progress_key = key
+        self.in_progress_end = now + self.duration(in_progress, None)
+        pointing = exposure_pointing(in_progress)
+        if pointing is not None:
+            self.last_pointing = pointing
+
+    def _consumed(self, keys):
+        """Find how many entries were taken from the front of the queue"""
+        old_keys = [entry.key for entry in self.entries]
+        for taken in xrange(len(old_keys)):
+            kept = len(old_keys) - taken
+            if kept <= len(keys) and old_keys[taken:] == keys[:kept]:
+                return taken
+        return len(old_keys)
+
+    def update(self, queue, in_progress=None, now=None):
+        """Update the estimate for a new snapshot of the queue
+
+        :Parameters:
+            - `queue`: the exposures on the SISPI/OCS queue
+            - `in_progress`: the exposure in progress (or a list of
+              them, of which the last is used), if any
+            - `now`: the current time (optional; defaults to time.time())
+
+        :Returns:
+            the time (as from time.time()) the queue is projected to run dry
+        """
+        now = time.time() if now is None else now
+        queue = [] if queue is None else queue
+        self._update_in_progress(in_progress, now)
+
+        keys = [exposure_key(exposure) for exposure in queue]
+        for i in xrange(self._consumed(keys)):
+            self.queue_duration -= self.entries.popleft().duration
+
+        # The first entry we kept now starts somewhere else, so work it
+        # out again, and any after it that start somewhere new as a result
+        start = self.last_pointing
+        i = 0
+        while i < len(self.entries) and self.entries[i].start != start:
+            self.queue_duration -= self.entries[i].duration
+            self.entries[i] = self._entry(keys[i], queue[i], start)
+            self.queue_duration += self.entries[i].duration
+            start = self.entries[i].end
+            i += 1
+
+        for i in xrange(len(self.entries), len(queue)):
+            start = self.entries[-1].end if len(self.entries) > 0 else self.last_pointing
+            self.entries.append(self._entry(keys[i], queue[i], start))
+            self.queue_duration += self.entries[-1].duration
+
+        return self.empty_time(now)
+
+    def empty_time(self, now=None):
+        """Return the time the queue is projected to run dry
+
+        :Parameters:
+            - `now`: the current time (optional; defaults to time.time())
+        """
+        now = time.time() if now is None else now
+        if self.in_progress_end is not None:
+            now = max(now, self.in_progress_end)
+        return now + self.queue_duration
@@ -6,66 +6,408 @@
 """
 __docformat__ = "restructuredtext en"
 
+import os
+import json
+import time
+import errno
+import heapq
+import select
+import socket
 import datetime
 import logging
+from itertools import count
 from abc import ABCMeta, abstractmethod
-from ConfigParser import ConfigParser
+from ConfigParser import ConfigParser, NoOptionError, NoSectionError
 
-logging.basicConfig(format='%(asctime)s %(message)s',
-                    level=logging.DEBUG)
+from obstac.SocketChannel import connect
+from obstac.SnapshotLoader import SnapshotLoader, queue_diff
+from obstac.QueueEstimator import QueueEstimator
+from obstac.Serializer import Serializer
+from obstac.Publisher import Publisher
+from obstac.CycleMetrics import CycleMetrics
+from obstac.SchedulerProfiler import SchedulerProfiler, AUTOOBS_TIMEOUT
+
+SOCKET_RETRY_INTERVAL = 5
 
 class Scheduler(object):
     __metaclass__ = ABCMeta
 
     def __init__(self, config_fname):
         self.configure(config_fname)
-        
+
+        # These are set to the contents of the queue files written by
+        # autoobs (or sent over the socket channel) before make_script
+        # is called. They may be shared between calls, so do not
+        # modify them.
+        self.queue = None
+        self.previous_queue = None
+        self.in_progress = None
+        self._queue_diff = None
+        self._queue_diff_of = (None, None)
+        self._queue_estimator = None
+
+        self.timers = []
+        self.timer_ids = count()
+
 
     def configure(self, config_fname):
-        config = ConfigParser() 
+        config = ConfigParser()
         config.read(config_fname)
 
         self.longitude = config.getfloat('observatory', 'longitude')
         self.latitude = config.getfloat('observatory', 'latitude')
 
         self.stale_time_delta = datetime.timedelta(0, config.getfloat('timeouts', 'fifo'))
-        
+
         self.output_fname = config.get('paths', 'outbox')
         self.queue_fname = config.get('paths', 'current_queue')
         self.previous_queue_fname = config.get('paths', 'previous_queue')
         self.in_progress_fname = config.get('paths', 'inprogress')
-        self.fifo_fname = config.get('paths', 'fifo')  
+        self.fifo_fname = config.get('paths', 'fifo')
+
+        try:
+            self.serializer = Serializer(config.get('format', 'serializer'))
+        except (NoSectionError, NoOptionError):
+            self.serializer = Serializer()
+
+        try:
+            fsync = config.getboolean('format', 'fsync')
+        except (NoSectionError, NoOptionError):
+            fsync = False
+        self.publisher = Publisher(fsync=fsync)
+
+        self.snapshot_loader = SnapshotLoader(self.queue_fname,
+                                              self.previous_queue_fname,
+                                              self.in_progress_fname,
+                                              self.serializer)
+
+        try:
+            self.socket_fname = config.get('paths', 'socket')
+        except NoOptionError:
+            self.socket_fname = None
+
+        # Timing (and profiling) of calls is off unless asked for
+        profile = dict(config.items('profile')) if config.has_section('profile') else {}
+        metrics_fname = profile.get('metrics_file', None)
+        self.profiler = SchedulerProfiler(
+            enabled=profile.get('enabled', 'false').lower() in ('true', 'yes', 'on', '1'),
+            slowest=int(profile.get('slowest', 0)),
+            profile_dir=profile.get('profile_dir', None),
+            timeout=float(profile.get('timeout', AUTOOBS_TIMEOUT)),
+            warn_fraction=float(profile.get('warn_fraction', 0.8)),
+            metrics=CycleMetrics(fname=metrics_fname, idle_phases=(),
+                                 dump_interval=float(profile.get('metrics_interval', 60.0)),
+                                 publisher=self.publisher))
+
+
+    @property
+    def queue_diff(self):
+        """The exposures added to and removed from the queue since its previous contents
+
+        This is only worked out when it is first needed for a given
+        pair of queues.
+        """
+        queue_diff_of = (self.previous_queue, self.queue)
+        if self._queue_diff is None or queue_diff_of[0] is not self._queue_diff_of[0] \
+                or queue_diff_of[1] is not self._queue_diff_of[1]:
+            self._queue_diff = queue_diff(self.previous_queue, self.queue)
+            self._queue_diff_of = queue_diff_of
+        return self._queue_diff
+
+
+    @property
+    def queue_estimator(self):
+        """The `QueueEstimator` used by `queue_empty_time`
+
+        This is only made when it is first needed, so schedulers that
+        do not use it do not wait for numpy to load.
+        """
+        if self._queue_estimator is None:
+            self._queue_estimator = QueueEstimator()
+        return self._queue_estimator
+
+
+    def queue_empty_time(self):
+        """Estimate when the SISPI/OCS queue will run dry
+
+        The estimate follows the telescope from the exposure in progress
+        through each queued exposure, and is updated incrementally
+        from the previous call.
+
+        :Returns:
+            the time (as from time.time()) the queue is projected to run dry
+        """
+        return self.queue_estimator.update(self.queue, self.in_progress)
 
 
     @abstractmethod
     def make_script(self):
+        """Choose exposures to add to the SISPI/OCS queue
+
+        When this is called, `self.queue`, `self.previous_queue` and
+        `self.in_progress` hold the current and previous contents of the
+        SISPI/OCS queue and the exposures in progress, and
+        `self.queue_diff` holds a `QueueDiff` with the exposures added
+        to and removed from the queue since the previous contents.
+
+        Either return the list of exposures (which may be empty), or
+        write it to `self.output_fname` and return None.
+        """
         pass
 
-    
+
+    def marker_age(self, time_string):
+        """Return the age of a trigger from autoobs
+
+        :Parameters:
+            - `time_string`: the time of the trigger, as '%Y-%m-%d %H:%M:%S'
+
+        :Returns:
+            the age, as a datetime.timedelta, or None if the time is invalid
+        """
+        try:
+            queue_time = datetime.datetime.strptime(time_string, '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            return None
+        return datetime.datetime.now()-queue_time
+
+
+    def marker_is_current(self, time_string):
+        """Check whether a trigger from autoobs is recent enough to act on
+
+        :Parameters:
+            - `time_string`: the time of the trigger, as '%Y-%m-%d %H:%M:%S'
+        """
+        marker_age = self.marker_age(time_string)
+        if marker_age is None:
+            logging.info("Invalid marker in FIFO: %s" % time_string)
+            return False
+
+        if marker_age > self.stale_time_delta:
+            logging.info("FIFO has time %s, more than %s ago; not calling scheduler" %
+                        (time_string, str(self.stale_time_delta)))
+            return False
+
+        return True
+
+
+    def write_script(self, sispi_script):
+        """Write a script into the autoobs inbox
+
+        :Parameters:
+            - `sispi_script`: the list of exposures
+        """
+        # autoobs never sees a partially written script
+        self.publisher.publish(self.output_fname, self.serializer.dumps(sispi_script))
+
+
+    def take_outbox(self, start_time):
+        """Remove and return a script make_script wrote into the outbox
+
+        :Parameters:
+            - `start_time`: the time (as from time.time()) make_script was called
+
+        :Returns:
+            the script, or an empty list if none was written after start_time
+        """
+        try:
+            if os.path.getmtime(self.output_fname) < start_time:
+                return []
+            with open(self.output_fname, 'r') as fp:
+                sispi_script = self.serializer.load(fp)
+            os.remove(self.output_fname)
+        except (OSError, IOError, ValueError) as e:
+            logging.info("Could not read script from %s: %s" % (self.output_fname, str(e)))
+            return []
+
+        return sispi_script
+
+
+    def add_timer(self, interval, callback, repeat=True):
+        """Arrange for a function to be called while waiting for autoobs
+
+        Schedulers can use timers to do background work (such as
+        precomputing candidate exposures) while idle. Callbacks are run
+        in the scheduler's main loop, so a trigger from autoobs is not
+        handled until any running callback returns: keep each call short.
+
+        :Parameters:
+            - `interval`: the number of seconds until (and between) calls
+            - `callback`: the function to call, with no arguments
+            - `repeat`: keep calling every `interval` seconds (defaults to True)
+        """
+        heapq.heappush(self.timers, (time.time() + interval, next(self.timer_ids),
+                                     interval if repeat else None, callback))
+
+
+    def run_timers(self):
+        """Call any timer callbacks that are due
+
+        :Returns:
+            the number of seconds until the next timer is due, or None
+            if there are no timers
+        """
+        now = time.time()
+        while len(self.timers) > 0 and self.timers[0][0] <= now:
+            due, timer_id, interval, callback = heapq.heappop(self.timers)
+            try:
+                callback()
+            except Exception:
+                logging.exception("Timer callback failed")
+            now = time.time()
+            if interval is not None:
+                heapq.heappush(self.timers, (max(due + interval, now), timer_id,
+                                             interval, callback))
+
+        if len(self.timers) == 0:
+            return None
+        return max(0.0, self.timers[0][0] - now)
+
+
+    def open_fifo(self):
+        """Open the named pipe autoobs writes markers into
+
+        The pipe is opened for both reading and writing, so it stays
+        open (and never reports end-of-file) whether or not autoobs has
+        it open, and reads from it never block.
+        """
+        if not os.path.exists(self.fifo_fname):
+            os.mkfifo(self.fifo_fname)
+            os.chmod(self.fifo_fname, 0o666)
+        return os.open(self.fifo_fname, os.O_RDWR | os.O_NONBLOCK)
+
+
+    def read_fifo(self, fifo_fd):
+        """Read all pending markers from the named pipe
+
+        :Returns:
+            the newest marker, or None if there was none
+        """
+        data = ''
+        while True:
+            try:
+                chunk = os.read(fifo_fd, 4096)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if len(chunk) == 0:
+                break
+            data += chunk
+
+        markers = [line.strip() for line in data.split('\n') if len(line.strip()) > 0]
+        if len(markers) > 1:
+            logging.info("Skipping %d older marker(s) in FIFO" % (len(markers) - 1))
+        return markers[-1] if len(markers) > 0 else None
+
+
+    def handle_fifo_marker(self, time_string):
+        """Call make_script in response to a marker in the named pipe"""
+        if not self.marker_is_current(time_string):
+            return
+
+        self.profiler.start_call(self.marker_age(time_string).total_seconds())
+        with self.profiler.phase('load'):
+            snapshot = self.snapshot_loader.load()
+        self.queue = snapshot.queue
+        self.previous_queue = snapshot.previous_queue
+        self.in_progress = snapshot.in_progress
+        with self.profiler.phase('select'):
+            new_sispi_script = self.profiler.profile(self.make_script)
+        if new_sispi_script is not None:
+            with self.profiler.phase('write'):
+                self.write_script(new_sispi_script)
+        self.profiler.finish_call()
+
+
+    def handle_socket_trigger(self, stream, message):
+        """Call make_script in response to a trigger on the socket channel, and reply"""
+        new_sispi_script = []
+        if self.marker_is_current(message['time']):
+            self.profiler.start_call(self.marker_age(message['time']).total_seconds())
+            self.queue = message['queue']
+            self.previous_queue = message['previous_queue']
+            self.in_progress = message['in_progress']
+            start_time = time.time()
+            with self.profiler.phase('select'):
+                new_sispi_script = self.profiler.profile(self.make_script)
+            if new_sispi_script is None:
+                with self.profiler.phase('write'):
+                    new_sispi_script = self.take_outbox(start_time)
+
+        with self.profiler.phase('write'):
+            stream.send({'type': 'script',
+                         'seq': message['seq'],
+                         'script': new_sispi_script})
+        self.profiler.finish_call()
+
+
+    def read_socket(self, stream):
+        """Read all pending messages from the socket channel
+
+        :Returns:
+            the newest trigger, or None if there was none
+        """
+        trigger = None
+        message = stream.receive(0)
+        while message is not None:
+            if message.get('type') == 'trigger':
+                if trigger is not None:
+                    logging.info("Skipping older trigger %s on socket" % trigger['seq'])
+                trigger = message
+            message = stream.receive(0)
+        return trigger
+
+
     def __call__(self):
+        # Log somewhere, unless the scheduler has already set up logging
+        logging.basicConfig(format='%(asctime)s %(message)s',
+                            level=logging.DEBUG)
         logging.info("Scheduler starting")
+        fifo_fd = self.open_fifo()
+        stream = None
+        next_connect_time = 0
+
+        logging.info("Waiting for autoobs")
         while True:
-            # open block until something is sent to the fifo
-            # (should by sent by obstac)
-            logging.info("Waiting for autoobs")
-            with open(self.fifo_fname, 'r') as fp:
-                time_string = fp.readline().strip()
+            if self.socket_fname is not None and stream is None \
+                    and time.time() >= next_connect_time:
+                try:
+                    stream = connect(self.socket_fname)
+                    logging.info("Connected to autoobs at %s" % self.socket_fname)
+                except socket.error as e:
+                    logging.debug("Could not connect to autoobs at %s (%s), using FIFO" %
+                                  (self.socket_fname, str(e)))
+                    next_connect_time = time.time() + SOCKET_RETRY_INTERVAL
 
-            logging.info("Triggered by autoobs")
+            timeout = self.run_timers()
+            if self.socket_fname is not None and stream is None:
+                reconnect_timeout = max(0.0, next_connect_time - time.time())
+                timeout = reconnect_timeout if timeout is None else min(timeout, reconnect_timeout)
 
-            if len(time_string) == 0:
-                continue
-            
+            readers = [fifo_fd] if stream is None else [fifo_fd, stream]
             try:
-                queue_time = datetime.datetime.strptime(time_string, '%Y-%m-%d %H:%M:%S')
-            except ValueError:
-                logging.info("Invalid marker in FIFO: %s" % time_string)
-                continue
-
-            marker_age =  datetime.datetime.now()-queue_time
-            if marker_age > self.stale_time_delta:
-                logging.info("FIFO has time %s, more than %s ago; not calling scheduler" %
-                            (time_string, str(self.stale_time_delta)))
-                continue
-
-            new_sispi_script = self.make_script()
+                readable = select.select(readers, [], [], timeout)[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if fifo_fd in readable:
+                time_string = self.read_fifo(fifo_fd)
+                if time_string is not None:
+                    logging.info("Triggered by autoobs")
+                    self.handle_fifo_marker(time_string)
+                    logging.info("Waiting for autoobs")
+
+            if stream is not None and stream in readable:
+                try:
+                    message = self.read_socket(stream)
+                    if message is not None:
+                        logging.info("Triggered by autoobs")
+                        self.handle_socket_trigger(stream, message)
+                        logging.info("Waiting for autoobs")
+                except (socket.error, EOFError, ValueError) as e:
+                    logging.info("Lost connection to autoobs: %s" % str(e))
+                    stream.close()
+                    stream = None
@@ -0,0 +1,185 @@
+"""Time the phases of scheduler calls, and profile the slowest of them
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import heapq
+import logging
+import tempfile
+import datetime
+from itertools import count
+from functools import wraps
+from contextlib import contextmanager
+
+from obstac.CycleMetrics import CycleMetrics
+
+# The number of seconds autoobs waits for a script (AutoObs.WAIT_TIMEOUT)
+AUTOOBS_TIMEOUT = 25.0
+
+@contextmanager
+def _untimed():
+    yield
+
+def timed(name):
+    """Time calls to a `Scheduler` method as a phase of scheduler calls
+
+    Schedulers can use this to see how the time spent in `make_script`
+    divides among their own steps::
+
+        class MyScheduler(Scheduler):
+            @timed('candidates')
+            def find_candidates(self):
+                ...
+
+    :Parameters:
+        - `name`: the name of the phase
+    """
+    def decorator(method):
+        @wraps(method)
+        def timed_method(self, *args, **kwargs):
+            with self.profiler.phase(name):
+                return method(self, *args, **kwargs)
+        return timed_method
+    return decorator
+
+class SchedulerProfiler(object):
+    """Time the phases of scheduler calls, and profile the slowest of them
+
+    Each call (from a trigger by autoobs to the script being handed
+    back) is timed with `CycleMetrics`, in phases: ``load`` (reading
+    the queue snapshot), ``select`` (`make_script`), ``write`` (writing
+    the script), and any marked with `timed`. The age of the trigger
+    when the scheduler woke up is kept as ``marker_age``. Triggers
+    carry times to the second, so this may be up to a second too long.
+
+    If the age of the trigger plus the time of the call comes within
+    `warn_fraction` of the time autoobs waits for a script, a warning
+    is logged. If `slowest` is more than 0, `make_script` is run under
+    cProfile, and the profiles of the slowest `slowest` calls are
+    kept in `profile_dir` (for reading with the `pstats` module).
+
+    A profiler that is not `enabled` does nothing.
+
+    >>> clock = iter([10.0, 10.0, 10.5, 10.5, 30.5, 30.5, 30.75, 31.0]).next
+    >>> profiler = SchedulerProfiler(metrics=CycleMetrics(idle_phases=(), clock=clock))
+    >>> profiler.start_call(marker_age=1.0)
+    >>> with profiler.phase('load'):
+    ...     pass
+    >>> with profiler.phase('select'):
+    ...     pass
+    >>> with profiler.phase('write'):
+    ...     pass
+    >>> profiler.finish_call()
+    22.0
+    >>> profiler.near_timeout(22.0)
+    True
+    >>> sorted(profiler.metrics.last_cycle.items())
+    [('cycle', 21.0), ('load', 0.5), ('marker_age', 1.0), ('select', 20.0), ('write', 0.25)]
+    """
+
+    def __init__(self, enabled=True, slowest=0, profile_dir=None, timeout=AUTOOBS_TIMEOUT,
+                 warn_fraction=0.8, metrics=None):
+        """Set up the profiler
+
+        :Parameters:
+            - `enabled`: time calls (defaults to True)
+            - `slowest`: the number of profiles of slow calls to keep
+              (defaults to 0: do not profile)
+            - `profile_dir`: the directory to keep profiles in
+              (defaults to the system temporary directory)
+            - `timeout`: the number of seconds autoobs waits for a script
+            - `warn_fraction`: the fraction of `timeout` after which to warn
+            - `metrics`: the `CycleMetrics` to collect timings with
+        """
+        self.enabled = enabled
+        self.slowest = slowest
+        self.profile_dir = profile_dir if profile_dir is not None else tempfile.gettempdir()
+        self.timeout = timeout
+        self.warn_fraction = warn_fraction
+        self.metrics = metrics if metrics is not None else CycleMetrics(idle_phases=())
+        self.profiles = []
+        self.profile_ids = count()
+
+    def phase(self, name):
+        """Time a phase of the current call (use as a context manager)"""
+        if not self.enabled:
+            return _untimed()
+        return self.metrics.phase(name)
+
+    def start_call(self, marker_age=None):
+        """Start timing a call
+
+        :Parameters:
+            - `marker_age`: the age of the trigger, in seconds (optional)
+        """
+        if not self.enabled:
+            return
+        self.metrics.start_cycle()
+        if marker_age is not None:
+            self.metrics.add('marker_age', marker_age)
+
+    def near_timeout(self, used):
+        """Check whether a call came close to the time autoobs waits"""
+        return used >= self.warn_fraction * self.timeout
+
+    def finish_call(self):
+        """Finish timing a call, warning if it came close to the autoobs timeout
+
+        :Returns:
+            the time from the trigger to the end of the call, in
+            seconds, or None if not `enabled` (or no call was started)
+        """
+        if not self.enabled or self.metrics.cycle_start is None:
+            return None
+        self.metrics.end_cycle()
+        timings = self.metrics.last_cycle
+        used = timings.get('marker_age', 0.0) + timings['cycle']
+        phases = ', '.join('%s %.2f' % (name, timings[name])
+                           for name in sorted(timings) if name != 'cycle')
+        if self.near_timeout(used):
+            logging.warning("Scheduler took %.2f of the %.0f seconds autoobs waits (%s)"
+                            % (used, self.timeout, phases))
+        else:
+            logging.info("Scheduler took %.2f seconds (%s)" % (used, phases))
+        return used
+
+    def profile(self, function, *args, **kwargs):
+        """Call a function, keeping its profile if it is one of the slowest calls
+
+        :Returns:
+            the return value of the function
+        """
+        if not (self.enabled and self.slowest > 0):
+            return function(*args, **kwargs)
+
+        import cProfile
+        profile = cProfile.Profile()
+        start = self.metrics.clock()
+        result = profile.runcall(function, *args, **kwargs)
+        self.keep_profile(profile, self.metrics.clock() - start, function.__name__)
+        return result
+
+    def keep_profile(self, profile, elapsed, name):
+        """Write a profile, if it is of one of the slowest calls, removing the fastest"""
+        if len(self.profiles) >= self.slowest and elapsed <= self.profiles[0][0]:
+            return
+
+        profile_id = next(self.profile_ids)
+        time_str = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        fname = os.path.join(self.profile_dir, '%s_%s_%d_%.3fs.prof'
+                             % (name, time_str, profile_id, elapsed))
+        try:
+            profile.dump_stats(fname)
+        except (IOError, OSError) as e:
+            logging.info("Could not write profile to %s: %s" % (fname, str(e)))
+            return
+        heapq.heappush(self.profiles, (elapsed, profile_id, fname))
+
+        while len(self.profiles) > self.slowest:
+            fastest_fname = heapq.heappop(self.profiles)[2]
+            try:
+                os.remove(fastest_fname)
+            except OSError:
+                pass
@@ -0,0 +1,92 @@
+"""Encode and decode queue snapshots and scripts as JSON
+
+Queue and script files are written compactly by default. Pretty
+printing (which, in python 2, also means using the slower pure python
+encoder) is available for files people need to read. If ujson is
+installed and gives back exactly the values it was given, the `fast`
+mode uses it.
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import json
+
+from obstac.debug import debug
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+SERIALIZER_MODES = ('compact', 'pretty', 'fast')
+
+def _fast_encoder_is_exact():
+    """Check whether ujson round-trips exposures without losing precision"""
+    probe = [{'expType': 'object', 'object': u'\u00e9t\u00e9 "1"', 'exptime': 90,
+              'RA': 0.1 + 0.2, 'dec': -30.16527778, 'wait': False}]
+    try:
+        return ujson.loads(ujson.dumps(probe)) == probe
+    except Exception:
+        return False
+
+FAST_ENCODER_AVAILABLE = ujson is not None and _fast_encoder_is_exact()
+
+class Serializer(object):
+    """Encode and decode queue snapshots and scripts as JSON
+
+    >>> script = [{'expType': 'object', 'exptime': 90, 'RA': 12.5, 'dec': -3.0}]
+    >>> serializer = Serializer('compact')
+    >>> text = serializer.dumps([{'exptime': 90}])
+    >>> text
+    '[{"exptime":90}]'
+    >>> serializer.loads(serializer.dumps(script)) == script
+    True
+    >>> print Serializer('pretty').dumps([{'exptime': 90}])
+    [
+        {
+            "exptime": 90
+        }
+    ]
+    >>> Serializer('fast').loads(Serializer('fast').dumps(script)) == script
+    True
+    """
+
+    def __init__(self, mode='compact'):
+        """Choose how to encode JSON
+
+        :Parameters:
+            - `mode`: one of `SERIALIZER_MODES`: 'compact' (the default)
+              for JSON without whitespace, 'pretty' for indented JSON,
+              or 'fast' to use ujson when available (falling back to
+              'compact' otherwise)
+        """
+        if mode not in SERIALIZER_MODES:
+            raise ValueError("Unknown serializer mode %s (expected one of %s)"
+                             % (mode, ', '.join(SERIALIZER_MODES)))
+        if mode == 'fast' and not FAST_ENCODER_AVAILABLE:
+            debug("No exact fast JSON encoder available; using compact JSON")
+            mode = 'compact'
+        self.mode = mode
+
+    def dumps(self, obj):
+        """Encode an object as a JSON string"""
+        if self.mode == 'fast':
+            return ujson.dumps(obj)
+        if self.mode == 'pretty':
+            return json.dumps(obj, indent=4, separators=(',', ': '))
+        return json.dumps(obj, separators=(',', ':'))
+
+    def loads(self, text):
+        """Decode an object from a JSON string"""
+        if self.mode == 'fast':
+            return ujson.loads(text)
+        return json.loads(text)
+
+    def dump(self, obj, fp):
+        """Encode an object as JSON into an open file"""
+        fp.write(self.dumps(obj))
+
+    def load(self, fp):
+        """Decode an object from JSON in an open file"""
+        return self.loads(fp.read())
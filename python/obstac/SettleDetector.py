@@ -0,0 +1,82 @@
+"""Wait for the SISPI/OCS queue to settle before acting on a change
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import time
+from collections import deque
+
+SETTLE_MODES = ('fixed', 'adaptive')
+
+class SettleDetector(object):
+    """Wait for a changing state to settle before acting on it
+
+    In 'fixed' mode, `wait` just sleeps for `max_wait` seconds. In
+    'adaptive' mode, it repeatedly calls `snapshot` and returns as soon
+    as the result has not changed for `quiet_period` seconds, or after
+    `max_wait` seconds, whichever comes first.
+
+    The time actually waited in each call is kept in `waits`.
+
+    >>> states = iter([1, 2, 2, 2, 2, 2, 2, 2])
+    >>> settle = SettleDetector(lambda: next(states), mode='adaptive',
+    ...                         quiet_period=0.02, max_wait=1.0, poll_interval=0.01)
+    >>> settle.wait() < 1.0
+    True
+    >>> len(settle.waits)
+    1
+    """
+
+    def __init__(self, snapshot, mode='fixed', quiet_period=1.0, max_wait=5.0,
+                 poll_interval=0.25, history=1000):
+        """Configure the detector
+
+        :Parameters:
+            - `snapshot`: a callable returning the current state, comparable with ==
+            - `mode`: 'fixed' or 'adaptive'
+            - `quiet_period`: seconds the state must be unchanged to be settled
+            - `max_wait`: the most seconds to wait
+            - `poll_interval`: seconds between calls to `snapshot`
+            - `history`: the number of waits to remember
+        """
+        if mode not in SETTLE_MODES:
+            raise ValueError("Unknown settle mode %s, must be one of %s"
+                             % (mode, ', '.join(SETTLE_MODES)))
+        self.snapshot = snapshot
+        self.mode = mode
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.waits = deque(maxlen=history)
+
+    def wait(self):
+        """Wait for the state to settle
+
+        :Returns:
+            the number of seconds waited
+        """
+        start_time = time.time()
+        if self.mode == 'fixed':
+            time.sleep(self.max_wait)
+        else:
+            self._wait_adaptive(start_time)
+
+        waited = time.time() - start_time
+        self.waits.append(waited)
+        return waited
+
+    def _wait_adaptive(self, start_time):
+        deadline = start_time + self.max_wait
+        state = self.snapshot()
+        changed_time = time.time()
+        while True:
+            now = time.time()
+            settled_time = changed_time + self.quiet_period
+            if now >= settled_time or now >= deadline:
+                return
+            time.sleep(min(self.poll_interval, settled_time - now, deadline - now))
+            new_state = self.snapshot()
+            if new_state != state:
+                state = new_state
+                changed_time = time.time()
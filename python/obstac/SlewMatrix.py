@@ -0,0 +1,166 @@
+"""Precomputed slew times between all pairs of fields in a fixed catalog
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import copy
+import hashlib
+from tempfile import mkstemp
+
+import numpy
+
+from obstac.Instrument import unit_vectors
+
+SLEW_MATRIX_DTYPE = numpy.int16
+
+def catalog_key(instrument, ra, dec):
+    """Return a key identifying a catalog and the slew model applied to it
+
+    :Parameters:
+        - `instrument`: the `Instrument` whose slew model is used
+        - `ra`: an array of field RAs (degrees)
+        - `dec`: an array of field declinations (degrees)
+
+    :Returns:
+        a hex digest of the field coordinates and slew coefficients
+
+    >>> from obstac.Instrument import Instrument
+    >>> a = catalog_key(Instrument(), [10.0, 20.0], [-5.0, -6.0])
+    >>> b = catalog_key(Instrument(), [10.0, 20.0], [-5.0, -6.5])
+    >>> a == b
+    False
+    """
+    digest = hashlib.sha1()
+    digest.update(numpy.ascontiguousarray(ra, dtype=numpy.float64).tobytes())
+    digest.update(numpy.ascontiguousarray(dec, dtype=numpy.float64).tobytes())
+    coefficients = (instrument.short_slew_zp, instrument.short_slew_slope,
+                    instrument.long_slew_zp, instrument.long_slew_slope,
+                    instrument.longest_short_slew)
+    digest.update(repr(coefficients).encode('ascii'))
+    return digest.hexdigest()
+
+def compute_slew_matrix(instrument, ra, dec):
+    """Calculate the slew times between all pairs of fields
+
+    :Parameters:
+        - `instrument`: the `Instrument` whose slew model is used
+        - `ra`: an array of field RAs (degrees)
+        - `dec`: an array of field declinations (degrees)
+
+    :Returns:
+        a square int16 array in which element [i, j] is the time (in
+        seconds) to slew from field i to field j
+    """
+    ra = numpy.asarray(ra, dtype=numpy.float64)
+    dec = numpy.asarray(dec, dtype=numpy.float64)
+
+    # Do not move the caller's (virtual) telescope
+    probe = copy.copy(instrument)
+    vectors = unit_vectors(ra, dec)
+    slew_times = numpy.empty((len(ra), len(ra)), dtype=SLEW_MATRIX_DTYPE)
+    max_slew_time = numpy.iinfo(SLEW_MATRIX_DTYPE).max
+    for i in range(len(ra)):
+        probe.coords = ra[i], dec[i]
+        row = probe.slew_times_from_unit_vectors(vectors)
+        if len(row) > 0 and row.max() > max_slew_time:
+            raise ValueError("Slew time of %d seconds does not fit in the slew matrix"
+                             % row.max())
+        slew_times[i] = row
+
+    return slew_times
+
+class SlewMatrix(object):
+    """Slew times between all pairs of fields in a fixed catalog
+
+    If a cache directory is given, the matrix is saved there in
+    `numpy` ``.npy`` format, in a file named by the `catalog_key` of
+    the catalog and slew model, and later instances with the same
+    catalog and model memory-map it rather than recomputing it.
+
+    >>> import shutil, tempfile
+    >>> from obstac.Instrument import Instrument
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> ra, dec = [30, 120, 30], [-44, -45, -30]
+    >>> slews = SlewMatrix(Instrument(), ra, dec, cache_dir)
+    >>> slews[0, 1] == Instrument((30, -44)).slew_time(120, -45)
+    True
+    >>> reloaded = SlewMatrix(Instrument(), ra, dec, cache_dir)
+    >>> reloaded.from_cache
+    True
+    >>> reloaded.row(2).tolist() == slews.row(2).tolist()
+    True
+    >>> shutil.rmtree(cache_dir)
+    """
+
+    def __init__(self, instrument, ra, dec, cache_dir=None):
+        """Build or load the slew matrix for a catalog
+
+        :Parameters:
+            - `instrument`: the `Instrument` whose slew model is used
+            - `ra`: an array of field RAs (degrees)
+            - `dec`: an array of field declinations (degrees)
+            - `cache_dir`: a directory in which to cache the matrix (optional)
+        """
+        self.ra = numpy.asarray(ra, dtype=numpy.float64)
+        self.dec = numpy.asarray(dec, dtype=numpy.float64)
+        self.key = catalog_key(instrument, self.ra, self.dec)
+        self.from_cache = False
+
+        if cache_dir is None:
+            self.fname = None
+            self.times = compute_slew_matrix(instrument, self.ra, self.dec)
+            self.times.flags.writeable = False
+            return
+
+        self.fname = os.path.join(cache_dir, 'slew_matrix_%s.npy' % self.key)
+        if os.path.exists(self.fname):
+            self.times = numpy.load(self.fname, mmap_mode='r')
+            self.from_cache = self.times.shape == (len(self.ra), len(self.ra))
+
+        if not self.from_cache:
+            self.save(compute_slew_matrix(instrument, self.ra, self.dec))
+            self.times = numpy.load(self.fname, mmap_mode='r')
+
+    def save(self, slew_times):
+        """Atomically write a slew matrix into the cache file
+
+        :Parameters:
+            - `slew_times`: the array to write
+        """
+        matrix_fd, matrix_fname = mkstemp(dir=os.path.dirname(self.fname),
+                                          suffix='.npy')
+        with os.fdopen(matrix_fd, 'wb') as fp:
+            numpy.save(fp, slew_times)
+        os.chmod(matrix_fname, 0o666)
+        os.rename(matrix_fname, self.fname)
+
+    def __len__(self):
+        return len(self.ra)
+
+    def __getitem__(self, index):
+        return self.times[index]
+
+    def slew_time(self, from_index, to_index):
+        """Return the time to slew between two fields
+
+        :Parameters:
+            - `from_index`: the index of the field slewed from
+            - `to_index`: the index of the field slewed to
+
+        :Returns:
+            the time to slew, in seconds
+        """
+        return self.times[from_index, to_index]
+
+    def row(self, from_index):
+        """Return the times to slew from one field to every field
+
+        :Parameters:
+            - `from_index`: the index of the field slewed from
+
+        :Returns:
+            a read-only view (not a copy) of the matrix row, in seconds
+        """
+        return self.times[from_index]
@@ -0,0 +1,158 @@
+"""Read several shared variables at once, each with its own timeout
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import time
+import threading
+from Queue import Queue
+from collections import namedtuple
+
+from obstac.debug import debug
+
+# The outcome of reading one shared variable: its value (None if the
+# read failed), the exception if it failed, the seconds it took, and
+# whether we had to subscribe again to get it
+FetchResult = namedtuple('FetchResult', ['value', 'error', 'elapsed', 'resubscribed'])
+
+class FetchTimeout(Exception):
+    """A shared variable was not read in time"""
+    pass
+
+class _FetchRequest(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+class _FetchWorker(object):
+    """Read one shared variable on request, on a thread of its own
+
+    A read that hangs only ties up this worker: requests made while it
+    is still busy fail at once rather than queueing up behind it.
+    """
+
+    def __init__(self, name, shared_variable, retry_errors):
+        self.name = name
+        self.shared_variable = shared_variable
+        self.retry_errors = retry_errors
+        self.requests = Queue()
+        self.lock = threading.Lock()
+        self.busy = False
+        self.thread = threading.Thread(name="Fetch%s" % name, target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self):
+        with self.lock:
+            if self.busy:
+                return None
+            self.busy = True
+        request = _FetchRequest()
+        self.requests.put(request)
+        return request
+
+    def read(self):
+        try:
+            return self.shared_variable.read(), False
+        except self.retry_errors:
+            self.shared_variable.subscribe()
+            return self.shared_variable.read(), True
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            start_time = time.time()
+            try:
+                value, resubscribed = self.read()
+                result = FetchResult(value, None, time.time() - start_time, resubscribed)
+            except Exception as e:
+                result = FetchResult(None, e, time.time() - start_time, False)
+            with self.lock:
+                self.busy = False
+            request.result = result
+            request.done.set()
+
+class SnapshotFetcher(object):
+    """Read several shared variables at once, each with its own timeout
+
+    Each shared variable is read on a worker thread of its own, so the
+    time to take a snapshot is that of the slowest read rather than
+    the sum of all of them. If a read fails with one of
+    `retry_errors`, the worker subscribes to the shared variable again
+    and retries once, as autoobs has always done. The time of the last
+    successful read of each is kept in `last_read`.
+
+    >>> class SlowVariable(object):
+    ...     def __init__(self, value, delay):
+    ...         self.value, self.delay = value, delay
+    ...     def read(self):
+    ...         time.sleep(self.delay)
+    ...         return self.value
+    >>> fetcher = SnapshotFetcher({'queue': SlowVariable([1, 2], 0.05),
+    ...                            'inprogress': SlowVariable([3], 0.05),
+    ...                            'stuck': SlowVariable(None, 1.0)},
+    ...                           timeouts={'stuck': 0.1}, default_timeout=0.5)
+    >>> start_time = time.time()
+    >>> results = fetcher.fetch()
+    >>> time.time() - start_time < 0.5
+    True
+    >>> results['queue'].value, results['inprogress'].value
+    ([1, 2], [3])
+    >>> results['stuck'].error
+    FetchTimeout('stuck not read within 0.1 seconds',)
+    >>> sorted(fetcher.last_read.keys())
+    ['inprogress', 'queue']
+    """
+
+    def __init__(self, shared_variables, timeouts=None, default_timeout=5.0,
+                 retry_errors=(Exception,)):
+        """Start a worker for each shared variable
+
+        :Parameters:
+            - `shared_variables`: a dictionary of objects with `read`
+              and `subscribe` methods, such as sve SharedVariables
+            - `timeouts`: a dictionary of the seconds to wait for each
+              shared variable (optional)
+            - `default_timeout`: the seconds to wait for shared variables
+              not in `timeouts` (defaults to 5)
+            - `retry_errors`: exceptions after which to subscribe again
+              and retry the read (defaults to any exception)
+        """
+        self.timeouts = dict((name, default_timeout) for name in shared_variables)
+        if timeouts is not None:
+            self.timeouts.update(timeouts)
+        self.workers = dict((name, _FetchWorker(name, shared_variable, retry_errors))
+                            for name, shared_variable in shared_variables.iteritems())
+        self.last_read = {}
+
+    def fetch(self):
+        """Read all of the shared variables
+
+        :Returns:
+            a dictionary of `FetchResult` tuples, one for each shared
+            variable
+        """
+        start_time = time.time()
+        requests = dict((name, worker.request())
+                        for name, worker in self.workers.iteritems())
+
+        results = {}
+        for name, request in requests.iteritems():
+            timeout = self.timeouts[name]
+            if request is None:
+                results[name] = FetchResult(
+                    None, FetchTimeout("%s still busy with an earlier read" % name), 0.0, False)
+                continue
+            request.done.wait(max(0.0, start_time + timeout - time.time()))
+            if request.done.is_set():
+                results[name] = request.result
+                if request.result.error is None:
+                    self.last_read[name] = time.time()
+            else:
+                debug("Timed out reading %s after %s seconds", name, timeout)
+                results[name] = FetchResult(
+                    None, FetchTimeout("%s not read within %s seconds" % (name, timeout)),
+                    time.time() - start_time, False)
+
+        return results
@@ -0,0 +1,151 @@
+"""Load the queue snapshots autoobs writes, parsing files only when they change
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import json
+from collections import namedtuple, Counter
+
+Snapshot = namedtuple('Snapshot', ['queue', 'previous_queue', 'in_progress'])
+QueueDiff = namedtuple('QueueDiff', ['added', 'removed'])
+
+def exposure_key(exposure):
+    """Return a string that is the same for equal exposures"""
+    return json.dumps(exposure, sort_keys=True)
+
+def queue_diff(previous_queue, queue):
+    """Find the exposures added to and removed from the queue
+
+    :Parameters:
+        - `previous_queue`: the previous contents of the queue (a list of exposures)
+        - `queue`: the current contents of the queue
+
+    :Returns:
+        a `QueueDiff` with lists of the exposures added (in the order
+        they appear in `queue`) and removed (in the order they appeared
+        in `previous_queue`)
+
+    >>> diff = queue_diff([{'object': 'a'}, {'object': 'b'}],
+    ...                   [{'object': 'b'}, {'object': 'c'}])
+    >>> print diff.added, diff.removed
+    [{'object': 'c'}] [{'object': 'a'}]
+    """
+    previous_queue = [] if previous_queue is None else previous_queue
+    queue = [] if queue is None else queue
+
+    previous_keys = [exposure_key(e) for e in previous_queue]
+    keys = [exposure_key(e) for e in queue]
+
+    unmatched = Counter(previous_keys)
+    added = []
+    for key, exposure in zip(keys, queue):
+        if unmatched[key] > 0:
+            unmatched[key] -= 1
+        else:
+            added.append(exposure)
+
+    removed = []
+    for key, exposure in zip(previous_keys, previous_queue):
+        if unmatched[key] > 0:
+            unmatched[key] -= 1
+            removed.append(exposure)
+
+    return QueueDiff(added, removed)
+
+def file_signature(fname):
+    """Return a tuple that changes whenever a file is replaced or modified
+
+    :Returns:
+        (inode, mtime, size) of the file, or None if it does not exist
+    """
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime, st.st_size)
+
+class SnapshotLoader(object):
+    """Load the queue snapshots autoobs writes, parsing files only when they change
+
+    Files that have not changed (by inode, mtime and size) since the
+    last load are not parsed again; the same objects are returned.
+
+    >>> import shutil, tempfile
+    >>> queue_dir = tempfile.mkdtemp()
+    >>> fnames = [os.path.join(queue_dir, f)
+    ...           for f in ('current.json', 'previous.json', 'inprogress.json')]
+    >>> loader = SnapshotLoader(*fnames)
+    >>> for fname, content in zip(fnames, [[{'object': 'b'}], [{'object': 'a'}], []]):
+    ...     with open(fname, 'w') as fp:
+    ...         json.dump(content, fp)
+    >>> snapshot = loader.load()
+    >>> print snapshot.queue, snapshot.previous_queue
+    [{u'object': u'b'}] [{u'object': u'a'}]
+    >>> loader.parse_count
+    3
+    >>> loader.load().queue is snapshot.queue
+    True
+    >>> loader.parse_count
+    3
+    >>> shutil.rmtree(queue_dir)
+    """
+
+    def __init__(self, queue_fname, previous_queue_fname, in_progress_fname,
+                 serializer=None):
+        """Prepare to load snapshots
+
+        :Parameters:
+            - `queue_fname`: the file with the current queue
+            - `previous_queue_fname`: the file with the previous queue
+            - `in_progress_fname`: the file with the exposures in progress
+            - `serializer`: the `Serializer` to decode the files with
+              (optional; defaults to the standard json module)
+        """
+        self.serializer = json if serializer is None else serializer
+        self.fnames = {'queue': queue_fname,
+                       'previous_queue': previous_queue_fname,
+                       'in_progress': in_progress_fname}
+        self.signatures = dict((name, None) for name in self.fnames)
+        self.contents = dict((name, None) for name in self.fnames)
+        self.parse_count = 0
+
+    def _refresh(self, name, reusable):
+        signature = file_signature(self.fnames[name])
+        if signature == self.signatures[name]:
+            return
+
+        if signature is not None and signature in reusable:
+            # autoobs renamed a file we already parsed to this one
+            self.contents[name] = reusable[signature]
+        elif signature is None:
+            self.contents[name] = None
+        else:
+            try:
+                with open(self.fnames[name], 'r') as fp:
+                    self.contents[name] = self.serializer.load(fp)
+                self.parse_count += 1
+            except (IOError, ValueError):
+                # Try again next time
+                self.contents[name] = None
+                signature = None
+
+        self.signatures[name] = signature
+
+    def load(self):
+        """Return the latest snapshot
+
+        :Returns:
+            a `Snapshot` with the queue, previous queue, and exposures in
+            progress
+        """
+        reusable = dict((self.signatures[name], self.contents[name])
+                        for name in ('queue', 'previous_queue')
+                        if self.signatures[name] is not None)
+        self._refresh('queue', reusable)
+        self._refresh('previous_queue', reusable)
+        self._refresh('in_progress', {})
+
+        return Snapshot(self.contents['queue'], self.contents['previous_queue'],
+                        self.contents['in_progress'])
@@ -0,0 +1,250 @@
+"""Exchange queue snapshots and scripts between autoobs and a scheduler over a socket
+
+This is an alternative to the named pipe and files: autoobs listens on
+a Unix domain socket, a scheduler connects to it, and they exchange
+JSON messages, one per line. On each update, autoobs sends::
+
+    {"type": "trigger", "seq": 12, "time": "2014-09-01 03:22:14",
+     "queue": [...], "previous_queue": [...], "in_progress": [...]}
+
+and the scheduler replies on the same connection with::
+
+    {"type": "script", "seq": 12, "script": [...]}
+
+where the script is a (possibly empty) list of exposures in SISPI
+script format. Replies with an old sequence number are ignored.
+
+:Organization: Fermi National Accelerator Laboratory
+"""
+__docformat__ = "restructuredtext en"
+
+import os
+import stat
+import errno
+import json
+import time
+import select
+import socket
+
+from obstac.debug import debug
+
+class ChannelError(Exception):
+    """The connection between autoobs and the scheduler failed"""
+    pass
+
+class MessageStream(object):
+    """Send and receive JSON messages, one per line, on a socket"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = ''
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, message, timeout=None):
+        """Send a message
+
+        :Parameters:
+            - `message`: an object that can be encoded as JSON
+            - `timeout`: seconds to wait for the other end to take it
+              (optional; defaults to forever)
+
+        :Raises:
+            - `socket.timeout`: if it was not all sent in time
+        """
+        if timeout is None:
+            self.sock.sendall(json.dumps(message) + '\n')
+            return
+
+        self.sock.settimeout(max(0.0, timeout))
+        try:
+            self.sock.sendall(json.dumps(message) + '\n')
+        finally:
+            self.sock.settimeout(None)
+
+    def receive(self, timeout=None):
+        """Receive a message
+
+        :Parameters:
+            - `timeout`: seconds to wait for a message (optional; defaults
+              to forever; 0 returns a message only if one has already arrived)
+
+        :Returns:
+            the decoded message, or None if we timed out
+
+        :Raises:
+            - `EOFError`: if the other end closed the connection
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while '\n' not in self.buffer:
+            if deadline is not None:
+                remaining = max(0.0, deadline - time.time())
+                if not select.select([self.sock], [], [], remaining)[0]:
+                    return None
+            data = self.sock.recv(65536)
+            if len(data) == 0:
+                raise EOFError("Connection closed")
+            self.buffer += data
+
+        line, self.buffer = self.buffer.split('\n', 1)
+        return json.loads(line)
+
+    def close(self):
+        self.sock.close()
+
+def connect(fname):
+    """Connect to autoobs
+
+    :Parameters:
+        - `fname`: the path of the socket autoobs listens on
+
+    :Returns:
+        a `MessageStream` on the connection
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(fname)
+    except socket.error:
+        sock.close()
+        raise
+    return MessageStream(sock)
+
+class ChannelServer(object):
+    """The autoobs end of the socket channel
+
+    autoobs talks to only one scheduler at a time: if a new one
+    connects, the old connection is dropped.
+
+    >>> import shutil, tempfile, threading
+    >>> socket_dir = tempfile.mkdtemp()
+    >>> server = ChannelServer(os.path.join(socket_dir, 'obstac.sock'))
+    >>> server.accept()
+    False
+    >>> scheduler = connect(server.fname)
+    >>> def reply():
+    ...     trigger = scheduler.receive()
+    ...     scheduler.send({'type': 'script', 'seq': trigger['seq'],
+    ...                     'script': [{'expType': 'dark', 'count': len(trigger['queue'])}]})
+    >>> thread = threading.Thread(target=reply)
+    >>> thread.start()
+    >>> server.accept()
+    True
+    >>> script = server.request_script('2014-09-01 03:22:14', [{}, {}], [], [], timeout=5)
+    >>> print script[0]['count']
+    2
+    >>> thread.join()
+
+    A scheduler that stops reading is dropped when the timeout is up:
+
+    >>> server.request_script('2014-09-01 03:22:24', [{'comment': 'x' * 1000}] * 5000, [], [],
+    ...                       timeout=0.5)
+    Traceback (most recent call last):
+        ...
+    ChannelError: Timed out sending the snapshot to the scheduler
+    >>> server.accept()
+    False
+    >>> scheduler.close()
+    >>> server.close()
+    >>> shutil.rmtree(socket_dir)
+    """
+
+    def __init__(self, fname):
+        """Start listening for a scheduler
+
+        :Parameters:
+            - `fname`: the path of the socket to create
+        """
+        self.fname = fname
+        try:
+            if stat.S_ISSOCK(os.stat(fname).st_mode):
+                os.remove(fname)
+        except OSError:
+            pass
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(fname)
+        os.chmod(fname, 0o666)
+        self.listener.listen(1)
+        self.listener.setblocking(False)
+        self.stream = None
+        self.seq = 0
+
+    def accept(self):
+        """Accept any waiting scheduler connections
+
+        :Returns:
+            True if a scheduler is connected
+        """
+        while True:
+            try:
+                conn = self.listener.accept()[0]
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            conn.setblocking(True)
+            self.drop()
+            self.stream = MessageStream(conn)
+            debug("Scheduler connected to %s", self.fname)
+
+        return self.stream is not None
+
+    def drop(self):
+        """Drop the connection to the scheduler, if any"""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def request_script(self, time_str, queue, previous_queue, in_progress, timeout):
+        """Send a snapshot to the scheduler, and wait for its script
+
+        :Parameters:
+            - `time_str`: the time of the trigger, as '%Y-%m-%d %H:%M:%S'
+            - `queue`: the contents of the SISPI/OCS queue
+            - `previous_queue`: the previous contents of the SISPI/OCS queue
+            - `in_progress`: the exposures in progress
+            - `timeout`: seconds to wait for the script
+
+        :Returns:
+            the script, or None if the scheduler did not reply in time
+
+        :Raises:
+            - `ChannelError`: if there is no connection to the scheduler,
+              it fails, or it does not take the snapshot in time
+        """
+        if self.stream is None:
+            raise ChannelError("No scheduler connected")
+
+        self.seq += 1
+        deadline = time.time() + timeout
+        try:
+            self.stream.send({'type': 'trigger',
+                              'seq': self.seq,
+                              'time': time_str,
+                              'queue': queue,
+                              'previous_queue': previous_queue,
+                              'in_progress': in_progress},
+                             deadline - time.time())
+            while True:
+                message = self.stream.receive(deadline - time.time())
+                if message is None:
+                    return None
+                if message.get('type') == 'script' and message.get('seq') == self.seq:
+                    return message['script']
+                debug("Ignoring message with sequence number %s", message.get('seq'))
+        except socket.timeout:
+            self.drop()
+            raise ChannelError("Timed out sending the snapshot to the scheduler")
+        except (socket.error, EOFError, ValueError) as e:
+            self.drop()
+            raise ChannelError(str(e))
+
+    def close(self):
+        """Stop listening, and drop any scheduler connection"""
+        self.drop()
+        self.listener.close()
+        try:
+            os.remove(self.fname)
+        except OSError:
+            pass
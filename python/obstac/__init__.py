@@ -1,33 +1,64 @@
 #!/usr/bin/env python
 """Load the obstac package
 
-The primary duty of the code in this file proper is to load the configuration data
-and configure the logger.
+The classes of the package are available as attributes of the package
+(`obstac.Scheduler`, `obstac.Instrument`, and so on), but each
+submodule, and whatever it depends on (such as numpy), is only
+imported when one of its classes is first used, so restarted
+schedulers can start listening for autoobs quickly.
+
+Importing the package has no other side effects; call
+`install_debugger_signal` to enter the debugger on SIGUSR1.
 
 :Authors: Eric H. Neilsen, Jr.
 :Organization: Fermi National Accelerator Laboratory
 """
+from __future__ import absolute_import
 __docformat__ = "restructuredtext en"
 
-import numpy
-
-from ConfigParser import SafeConfigParser
-import os
+import sys
+import types
 import logging
-import logging.config
-from pdb import set_trace
-from signal import signal, SIGUSR1
+from importlib import import_module
 
-from Scheduler import Scheduler
-from Instrument import Instrument
+# Initialize logging (before loading submodules, which use obstac.debug)
+logger = logging.getLogger("obstac")
 
+# Classes available as attributes of the package, each from the
+# submodule of the same name
+LAZY_CLASSES = ('Scheduler', 'Instrument', 'SlewMatrix', 'FieldIndex',
+                'SnapshotLoader', 'ExposureQueue', 'QueueEstimator',
+                'Serializer', 'Publisher', 'SnapshotFetcher',
+                'ConnectionManager', 'CycleMetrics', 'SchedulerProfiler')
 
 # When a SIGUSR1 signal is received, enter the debugger
 def enter_debugger(signum,frame):
+    from pdb import set_trace
     set_trace()
 
-signal(SIGUSR1,enter_debugger)
+def install_debugger_signal():
+    """Enter the debugger when a SIGUSR1 signal is received"""
+    from signal import signal, SIGUSR1
+    signal(SIGUSR1,enter_debugger)
 
-# Initialize logging
-logger = logging.getLogger("obstac")
+def _lazy_class(name):
+    def load(package):
+        return getattr(import_module(__name__ + '.' + name), name)
+    return property(load)
+
+class _LazyPackage(types.ModuleType):
+    """The obstac package, importing submodules when their classes are used
+
+    The classes are properties, so they take precedence over the
+    submodules of the same names, which import puts into the package.
+    """
+    pass
+
+for _name in LAZY_CLASSES:
+    setattr(_LazyPackage, _name, _lazy_class(_name))
 
+_package = _LazyPackage(__name__, __doc__)
+_package.__dict__.update(globals())
+# Keep this module alive: its functions use its globals
+_package._module = sys.modules[__name__]
+sys.modules[__name__] = _package
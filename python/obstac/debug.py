@@ -1,6 +1,6 @@
-import sys, traceback
-from inspect import stack, getmodule
-import inspect
+import os
+import sys
+import logging
 from obstac import logger
 
 DO_DEBUG = __debug__
@@ -17,8 +17,34 @@ def set_debug_out(debug_out):
     logger_debug = debug_out
 
 def debug(text,*args):
+    """Send a debugging message
+
+    Pass values to format into the message as arguments, rather than
+    formatting them with % first, so no formatting is done unless
+    the message is sent:
+
+    >>> set_debug_out(lambda text: sys.stdout.write(text + '\\n'))
+    >>> debug("Waiting %s seconds", 5)
+    Waiting 5 seconds
+    >>> set_debug(False)
+    >>> debug("Waiting %s seconds", 5)
+    >>> set_debug(True)
+    """
+    if not DO_DEBUG:
+        return
+    if logger_debug is _logger_debug and not logger.isEnabledFor(logging.DEBUG):
+        return
+    if args:
+        text = text % args
     if text is not None:
         text = text.replace("\n","\\n")
-    if DO_DEBUG:
-        logger_debug(text)
-    
+    logger_debug(text)
+
+_logger_debug = logger_debug
+
+# With OBSTAC_NODEBUG set in the environment, modules that import
+# debug from here get the no-op from obstac.nodebug instead, so
+# debugging calls cost no more than calling an empty function
+# (and set_debug cannot turn them back on).
+if os.environ.get('OBSTAC_NODEBUG', '') not in ('', '0'):
+    from obstac.nodebug import debug
@@ -3,6 +3,6 @@
 
 do_debug = False
 
-def debug(text):
+def debug(text, *args):
     pass
 